@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+'''
+Benchmarks for the overhead of cluster-func itself, as opposed to the cost of
+the target function.  They measure:
+
+	- direct_*: running synthetic targets (see targets.py) through
+		`run_direct`.  Besides throughput, the per-item overhead is reported:
+		the worker time spent per item, beyond the time the target takes
+		when called in a plain loop.
+	- serializer_*: sending large argument sets, and results, both ways
+		through `run_direct`, with each serializer.  The bytes sent per
+		second (arguments and results) are reported, besides the calls per
+		second.  direct_echo is the same, but leaving the queues to pickle.
+	- binning_*: assigning argument sets to bins with `generate_args_subset`,
+		in each binning mode.
+	- binify: `utils.binify`.
+	- dispatch_*: writing and submitting subjob scripts with `dispatch`,
+		using a fake `qsub`.
+	- startup_*: the time to import cluster_func, and to run `cluf` on a
+		single argument set.
+
+Each benchmark runs in a fresh python process, so that the peak memory used
+by one doesn't affect another.  The peak RSS of that process, and of its
+largest child (e.g. a worker), are reported.  Run it from anywhere:
+
+	$ python benchmarks/run.py -o results.json
+
+The benchmarks use the copy of cluster_func in this repository.  Results are
+saved as JSON.  To compare them with results saved earlier (e.g. from another
+version), use --compare:
+
+	$ python benchmarks/run.py -o new.json --compare old.json
+
+Use --quick for smaller (and noisier) runs, and -k to run only benchmarks
+whose names contain a given string.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import resource
+import tempfile
+import itertools
+import imp
+import subprocess
+import collections
+import multiprocessing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+
+import targets
+
+# Number of items processed by each benchmark, before scaling by --quick
+DIRECT_ITEMS = 20000
+SLOW_DIRECT_ITEMS = 2000
+BINNING_ITEMS = 200000
+DISPATCH_NODES = 200
+PROCESSES = min(4, multiprocessing.cpu_count())
+QUICK_SCALE = 0.1
+STARTUP_REPEATS = 5
+
+
+def run_direct_case(target_name, iterable_name, num_items, chunksize=1,
+	reducer_name=None, serializer=None, payload_bytes=None):
+	'''
+	Time `run_direct` calling the target called `target_name` on
+	`num_items` argument sets from the iterable made by `iterable_name`,
+	using `serializer`, if given.  If `payload_bytes` is given, it's the
+	number of bytes sent for each argument set (including its result), used
+	to report the bytes sent per second.
+	'''
+	from cluster_func import run_direct
+	from cluster_func._cf import as_arguments, unpack
+	target = getattr(targets, target_name)
+	make_iterable = getattr(targets, iterable_name)
+	reducer = getattr(targets, reducer_name) if reducer_name else None
+
+	# Time the target in a plain loop, on a sample of the argument sets.
+	sample = list(itertools.islice(
+		as_arguments(make_iterable(num_items)), max(1, num_items // 20)))
+	start = time.time()
+	for args in sample:
+		positional, keywords = unpack(args)
+		target(*positional, **keywords)
+	serial_seconds = (time.time() - start) / len(sample)
+
+	options = {'processes': PROCESSES, 'chunksize': chunksize}
+	if serializer is not None:
+		options['serializer'] = serializer
+	start = time.time()
+	run_direct(target, make_iterable(num_items), reducer, options)
+	seconds = time.time() - start
+
+	result = {
+		'items': num_items,
+		'seconds': seconds,
+		'processes': PROCESSES,
+		'chunksize': chunksize,
+		'overhead_us': 1e6 * (seconds * PROCESSES / num_items - serial_seconds),
+	}
+	if payload_bytes is not None:
+		result['bytes_per_sec'] = payload_bytes * num_items / seconds
+	return result
+
+
+def serializer_case(num_items, serializer=None):
+	'''
+	Time `run_direct` sending `num_items` large, distinct strings to the echo
+	target, and their results back, using `serializer`.
+	'''
+	return run_direct_case(
+		'echo', 'generate_texts', num_items, chunksize=10,
+		reducer_name='consume', serializer=serializer,
+		payload_bytes=2 * targets.LARGE_SIZE
+	)
+
+
+def has_module(name):
+	try:
+		imp.find_module(name)
+	except ImportError:
+		return False
+	return True
+
+
+def binning_case(num_items, **options):
+	'''
+	Time `generate_args_subset` binning `num_items` argument sets, with the
+	binning `options`.
+	'''
+	from cluster_func._cf import generate_args_subset
+	options = dict(options, these_bins=[0], num_bins=10)
+	iterable = list(targets.generate_records(num_items))
+
+	plan_dir = None
+	if options.pop('plan', False):
+		from cluster_func import planning
+		plan_dir = tempfile.mkdtemp()
+		plan, totals = planning.plan_bins([1.0] * num_items, 10)
+		options['plan'] = os.path.join(plan_dir, 'targets.plan')
+		planning.write_plan(options['plan'], plan)
+
+	try:
+		start = time.time()
+		collections.deque(generate_args_subset(iterable, options), maxlen=0)
+		seconds = time.time() - start
+	finally:
+		if plan_dir is not None:
+			shutil.rmtree(plan_dir)
+
+	return {'items': num_items, 'seconds': seconds}
+
+
+def binify_case(num_items):
+	from cluster_func import utils
+	ids = ['record-%d' % i for i in xrange(num_items)]
+	start = time.time()
+	for string_id in ids:
+		utils.binify(string_id, 10)
+	return {'items': num_items, 'seconds': time.time() - start}
+
+
+def dispatch_case(num_nodes, **options):
+	'''
+	Time `dispatch` writing and submitting scripts for `num_nodes` subjobs,
+	using a fake qsub that only prints a job id.
+	'''
+	from cluster_func._cf import dispatch, get_options
+	temp_dir = tempfile.mkdtemp()
+	try:
+		bin_dir = os.path.join(temp_dir, 'bin')
+		os.mkdir(bin_dir)
+		qsub_path = os.path.join(bin_dir, 'qsub')
+		with open(qsub_path, 'w') as qsub_file:
+			qsub_file.write('#!/bin/sh\necho 1234.fake\n')
+		os.chmod(qsub_path, 0755)
+		os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+
+		options = get_options(dict(
+			options, nodes=num_nodes, queue=True,
+			jobs_dir=os.path.join(temp_dir, 'jobs')
+		), {})
+
+		# Dispatch reports on each subjob.  Don't let that be timed.
+		stdout = sys.stdout
+		sys.stdout = open(os.devnull, 'w')
+		try:
+			start = time.time()
+			dispatch('targets', targets.generate_indices(num_nodes), options)
+			seconds = time.time() - start
+		finally:
+			sys.stdout.close()
+			sys.stdout = stdout
+	finally:
+		shutil.rmtree(temp_dir)
+
+	return {
+		'items': num_nodes,
+		'seconds': seconds,
+		'ms_per_node': 1e3 * seconds / num_nodes,
+	}
+
+
+def scaled(num_items, scale):
+	return max(1, int(num_items * scale))
+
+
+# Benchmarks that run in a process of their own.  Each maps its name to a
+# callable that takes the scale, and returns a dict of measurements.
+CASES = collections.OrderedDict([
+	('direct_noop', lambda s: run_direct_case(
+		'noop', 'generate_indices', scaled(DIRECT_ITEMS, s))),
+	('direct_noop_chunked', lambda s: run_direct_case(
+		'noop', 'generate_indices', scaled(DIRECT_ITEMS, s), chunksize=100)),
+	('direct_noop_auto', lambda s: run_direct_case(
+		'noop', 'generate_indices', scaled(DIRECT_ITEMS, s), chunksize='auto')),
+	('direct_cpu', lambda s: run_direct_case(
+		'cpu', 'generate_indices', scaled(SLOW_DIRECT_ITEMS, s))),
+	('direct_sleep', lambda s: run_direct_case(
+		'sleep', 'generate_indices', scaled(SLOW_DIRECT_ITEMS, s))),
+	('direct_large_arg', lambda s: run_direct_case(
+		'large_arg', 'generate_payloads', scaled(SLOW_DIRECT_ITEMS, s))),
+	('direct_large_result', lambda s: run_direct_case(
+		'large_result', 'generate_indices', scaled(SLOW_DIRECT_ITEMS, s),
+		reducer_name='consume')),
+	('direct_echo', lambda s: serializer_case(scaled(SLOW_DIRECT_ITEMS, s))),
+	('serializer_pickle', lambda s: serializer_case(
+		scaled(SLOW_DIRECT_ITEMS, s), 'pickle')),
+	('serializer_compressed', lambda s: serializer_case(
+		scaled(SLOW_DIRECT_ITEMS, s), 'compressed')),
+	('serializer_bytes', lambda s: serializer_case(
+		scaled(SLOW_DIRECT_ITEMS, s), 'bytes')),
+	('binning_order', lambda s: binning_case(scaled(BINNING_ITEMS, s))),
+	('binning_key', lambda s: binning_case(scaled(BINNING_ITEMS, s), key=0)),
+	('binning_plan', lambda s: binning_case(
+		scaled(BINNING_ITEMS, s), plan=True)),
+	('binning_hash_crc32', lambda s: binning_case(
+		scaled(BINNING_ITEMS, s), hash=[1], hash_function='crc32')),
+	('binning_hash_sha1', lambda s: binning_case(
+		scaled(BINNING_ITEMS, s), hash=[1], hash_function='sha1')),
+	('binning_hash_jump', lambda s: binning_case(
+		scaled(BINNING_ITEMS, s), hash=[1], bin_scheme='jump')),
+	('binning_bin_key', lambda s: binning_case(
+		scaled(BINNING_ITEMS, s), bin_key=targets.record_key)),
+	('binify', lambda s: binify_case(scaled(BINNING_ITEMS, s))),
+	('dispatch_scripts', lambda s: dispatch_case(scaled(DISPATCH_NODES, s))),
+	('dispatch_job_array', lambda s: dispatch_case(
+		scaled(DISPATCH_NODES, s), job_array=True)),
+])
+
+# The cloudpickle serializer needs the cloudpickle package.
+if has_module('cloudpickle'):
+	CASES['serializer_cloudpickle'] = lambda s: serializer_case(
+		scaled(SLOW_DIRECT_ITEMS, s), 'cloudpickle')
+
+
+def run_case(name, scale):
+	'''
+	Run the benchmark called `name`, in this process, and add the throughput
+	and peak memory to its measurements.
+	'''
+	result = CASES[name](scale)
+	result['name'] = name
+	result['items_per_sec'] = result['items'] / max(result['seconds'], 1e-9)
+	result['us_per_item'] = 1e6 * result['seconds'] / result['items']
+
+	# On linux ru_maxrss is in kilobytes.  For children, it's the largest.
+	result['peak_rss_kb'] = resource.getrusage(
+		resource.RUSAGE_SELF).ru_maxrss
+	result['peak_child_rss_kb'] = resource.getrusage(
+		resource.RUSAGE_CHILDREN).ru_maxrss
+	return result
+
+
+def run_case_in_subprocess(name, scale):
+	output = subprocess.check_output([
+		sys.executable, os.path.abspath(__file__), '--case', name,
+		'--scale', str(scale)
+	])
+	return json.loads(output.strip().splitlines()[-1])
+
+
+def time_command(name, command, repeats=STARTUP_REPEATS):
+	'''
+	Time running `command` in a subprocess, taking the best of `repeats`
+	runs, and the largest peak RSS.
+	'''
+	env = dict(os.environ, PYTHONPATH=REPO)
+	best = None
+	peak_rss = 0
+	for repeat in range(repeats):
+		with open(os.devnull, 'w') as devnull:
+			start = time.time()
+			proc = subprocess.Popen(
+				command, env=env, cwd=HERE, stdout=devnull, stderr=devnull)
+			pid, status, rusage = os.wait4(proc.pid, 0)
+			seconds = time.time() - start
+		if status != 0:
+			raise RuntimeError('%s failed: %s' % (name, ' '.join(command)))
+		best = seconds if best is None else min(best, seconds)
+		peak_rss = max(peak_rss, rusage.ru_maxrss)
+
+	return {
+		'name': name,
+		'items': 1,
+		'seconds': best,
+		'items_per_sec': 1 / best,
+		'us_per_item': 1e6 * best,
+		'peak_rss_kb': peak_rss,
+	}
+
+
+STARTUP_CASES = collections.OrderedDict([
+	('startup_import', [sys.executable, '-c', 'import cluster_func']),
+	('startup_cluf', [
+		sys.executable, os.path.join(REPO, 'bin', 'cluf'), 'targets.py',
+		'-p', '1'
+	]),
+])
+
+
+def get_version():
+	'''Describe the version of this repository, using git, if possible.'''
+	try:
+		with open(os.devnull, 'w') as devnull:
+			return subprocess.check_output(
+				['git', 'describe', '--always', '--dirty'], cwd=REPO,
+				stderr=devnull
+			).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def compare(results, baseline):
+	'''
+	Format a table comparing the throughput in `results` with that in
+	`baseline`, for the benchmarks that appear in both.
+	'''
+	baseline_by_name = dict((r['name'], r) for r in baseline['results'])
+	lines = ['%-24s %14s %14s %8s' % (
+		'benchmark', 'baseline/s', 'current/s', 'change')]
+	for result in results['results']:
+		old = baseline_by_name.get(result['name'])
+		if old is None:
+			continue
+		change = result['items_per_sec'] / old['items_per_sec'] - 1
+		lines.append('%-24s %14.1f %14.1f %+7.1f%%' % (
+			result['name'], old['items_per_sec'], result['items_per_sec'],
+			100 * change
+		))
+	return '\n'.join(lines)
+
+
+def format_result(result):
+	line = '%-24s %10d items %9.3fs %12.1f/s %10.2fus/item %8dkB' % (
+		result['name'], result['items'], result['seconds'],
+		result['items_per_sec'], result['us_per_item'], result['peak_rss_kb'])
+	if 'overhead_us' in result:
+		line += '  overhead %.2fus/item' % result['overhead_us']
+	if 'bytes_per_sec' in result:
+		line += '  %.1fMB/s' % (result['bytes_per_sec'] / 1e6)
+	if 'ms_per_node' in result:
+		line += '  %.2fms/node' % result['ms_per_node']
+	return line
+
+
+def main():
+	parser = argparse.ArgumentParser(description=(
+		"Benchmark cluster-func's own overhead."))
+	parser.add_argument(
+		'-o', '--output', help='Path at which to save the results, as JSON.')
+	parser.add_argument(
+		'-c', '--compare',
+		help='Path to results saved earlier, to compare with these results.')
+	parser.add_argument(
+		'-k', '--keyword',
+		help='Only run benchmarks whose names contain this string.')
+	parser.add_argument(
+		'-q', '--quick', action='store_true',
+		help='Process fewer items, for a quick check.')
+	parser.add_argument('--case', help=argparse.SUPPRESS)
+	parser.add_argument('--scale', type=float, help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	# In a subprocess, run one case, and print its results.
+	if args.case is not None:
+		print json.dumps(run_case(args.case, args.scale))
+		return
+
+	scale = QUICK_SCALE if args.quick else 1.0
+	names = [
+		name for name in itertools.chain(CASES, STARTUP_CASES)
+		if args.keyword is None or args.keyword in name
+	]
+
+	results = []
+	for name in names:
+		if name in CASES:
+			result = run_case_in_subprocess(name, scale)
+		else:
+			result = time_command(name, STARTUP_CASES[name])
+		print format_result(result)
+		sys.stdout.flush()
+		results.append(result)
+
+	results = {
+		'version': get_version(),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'host': socket.gethostname(),
+		'cpus': multiprocessing.cpu_count(),
+		'time': time.time(),
+		'scale': scale,
+		'results': results,
+	}
+
+	if args.output is not None:
+		with open(args.output, 'w') as output_file:
+			json.dump(results, output_file, indent=1, sort_keys=True)
+		print 'wrote results to %s' % args.output
+
+	if args.compare is not None:
+		with open(args.compare) as baseline_file:
+			print
+			print compare(results, json.load(baseline_file))
+
+
+if __name__ == '__main__':
+	main()
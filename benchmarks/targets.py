@@ -0,0 +1,91 @@
+'''
+Synthetic target functions and arguments iterables used by the benchmarks.
+Each target isolates one kind of cost:
+
+	- noop: returns immediately, so all of the time is overhead,
+	- cpu: spends a fixed amount of cpu time in python code,
+	- sleep: waits without using the cpu, like an I/O-bound target,
+	- large_arg: receives a large argument, which must be sent to workers,
+	- large_result: returns a large result, which must be sent back.
+	- echo: returns its (large) argument, which is sent both ways.
+
+This module can also be run by `cluf`, e.g. to time startup.
+'''
+
+import time
+
+CPU_LOOPS = 5000
+SLEEP_SECONDS = 0.001
+LARGE_SIZE = 100 * 1024
+
+
+def noop(i):
+	return None
+
+
+def cpu(i):
+	total = 0
+	for j in xrange(CPU_LOOPS):
+		total += j * j
+	return total
+
+
+def sleep(i):
+	time.sleep(SLEEP_SECONDS)
+
+
+def large_arg(payload):
+	return len(payload)
+
+
+def large_result(i):
+	return 'x' * LARGE_SIZE
+
+
+def echo(payload):
+	return payload
+
+
+def generate_indices(num_items):
+	'''Arguments iterable of `num_items` single integer arguments.'''
+	return xrange(num_items)
+
+
+def generate_payloads(num_items, size=LARGE_SIZE):
+	'''Arguments iterable of `num_items` strings of `size` bytes.'''
+	payload = 'x' * size
+	for i in xrange(num_items):
+		yield (payload,)
+
+
+def generate_texts(num_items, size=LARGE_SIZE):
+	'''
+	Arguments iterable of `num_items` distinct, compressible strings of
+	`size` bytes.
+	'''
+	for i in xrange(num_items):
+		record = 'record-%d ' % i
+		yield ((record * (size // len(record) + 1))[:size],)
+
+
+def generate_records(num_items):
+	'''
+	Arguments iterable of (integer, string) argument sets, which can be binned
+	in any of the ways that cluf supports.
+	'''
+	for i in xrange(num_items):
+		yield (i % 10, 'record-%d' % i)
+
+
+def record_key(bin_num, name):
+	return name
+
+
+def consume(results):
+	'''Reducer that consumes the results, so that they are sent back.'''
+	for result in results:
+		pass
+
+
+target = noop
+args = [0]
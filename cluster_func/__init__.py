@@ -1,3 +1,4 @@
 from arguments import Arguments
 from rc_params import RC_PARAMS
-from _cf import dispatch, main, run_direct
+from _cf import dispatch, main, run_direct, get_context
+from _cf import _map as map
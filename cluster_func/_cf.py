@@ -40,23 +40,51 @@ import os
 import sys
 import imp
 import math
+import copy
+import itertools
 import json
+import time
+import pickle
+import threading
+import traceback
+import multiprocessing
 from inspect import getargspec
-from subprocess import check_output
-from multiprocessing import Process
+from array import array
+from multiprocessing import Process, Value, Lock, Queue
 
 # 3rd parties
 from iterable_queue import IterableQueue
 
 # From this package
 import utils
-from arguments import Arguments
-from arg_parser import ClufArgParser
-from exceptions import OptionError, BinError
+import shards
+import journal
+import leases
+import binning
+import planning
+import counting
+import backends
+import results
+import metrics
+import progress
+import profiling
+import threads
+import coroutines
+import sharing
+import serializers
+from arguments import Arguments, get_argument, unpack
+from arg_parser import (
+	ClufArgParser, GatherArgParser, StatsArgParser, ProfileReportArgParser)
+from exceptions import OptionError, BinError, WorkerError
 from rc_params import RC_PARAMS
 
 # Constants
 DEFAULT_PBS_OPTIONS = {'name': '{target}-{subjob}-{num_subjobs}'}
+
+# In job array mode, one script serves every subjob, and each subjob finds
+# its number in an environment variable that depends on the backend.  The 
+# script is named as if it were for the ARRAY_SUBJOB'th subjob.
+ARRAY_SUBJOB = 'array'
 DEFAULT_CLUF_OPTIONS = {
 	'target_func_name': 'target', 
 	'argument_iterable_name': 'args',
@@ -72,10 +100,15 @@ DEFAULT_CLUF_OPTIONS = {
 	'prepend_statements': [],
 	'append_statements': [],
 }
+
+# When `chunksize` is "auto", chunks are sized so that each one takes roughly
+# this many seconds for a worker to process, within the bounds given.
+AUTO_CHUNK_SECONDS = 0.1
+MAX_AUTO_CHUNKSIZE = 10000
  
 DEFAULT_GUILLIMIN_MODULES	= ['Python/2.7.10']
 TEMPLATE = '''#!/bin/bash
-{pbs_option_statements}
+{directive_statements}
 cd {current_directory}
 {prepend_statements}
 {command}
@@ -96,8 +129,13 @@ def main():
 	Optionally submits those scripts via qsub.  Behavior depends on commandline
 	arguments given, see `parse_dispatch_args` for details or run
 		$ cluster-func -h
+
+	If the first argument names one of the SUBCOMMANDS, like "gather", 
+	delegates to its entry point instead.
 	'''
 
+	if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+		return SUBCOMMANDS[sys.argv[1]]()
 
 	# In this block we can catch early problems with command line arguments
 	# that are supplied, and print a friendlier message to the user
@@ -111,7 +149,7 @@ def main():
 
 		# Pass the arguments in target_cli (if any) through to the target
 		# module by putting them in sys.argv before loading the target module.
-		pass_through_args(target_module_path, options['target_cli'])
+		pass_through_args(target_module_path, args['target_cli'])
 
 		# Import the target module
 		target_module_name, module = load_module(target_module_path)
@@ -139,6 +177,125 @@ def main():
 		print '\n%s\n' % str(e)
 		parser.print_usage()
 
+	# The worker's own error was already printed.
+	except WorkerError, e:
+		print '\n%s\n' % str(e)
+		sys.exit(1)
+
+
+def gather_main():
+	'''
+	Entry point for the `cluf gather` command.  Collects the results saved by
+	the subjobs of a job (see `run_direct`), and passes them to a reducer in
+	the target module, or prints them.
+	'''
+	parser = GatherArgParser()
+	try:
+		args = parser.parse_args()
+		target_module_path = args['target_module']
+		pass_through_args(target_module_path, args['target_cli'])
+		target_module_name, module = load_module(target_module_path)
+
+		reducer_func = None
+		if 'reducer' in args:
+			try:
+				reducer_func = getattr(module, args['reducer'])
+			except AttributeError, e:
+				raise OptionError(str(e))
+
+		jobs_dir = args.get('jobs_dir', DEFAULT_CLUF_OPTIONS['jobs_dir'])
+		if not os.path.isdir(jobs_dir):
+			raise OptionError('No such jobs directory: %s' % jobs_dir)
+
+		gathered = results.gather(
+			jobs_dir, target_module_name, args.get('ordered', False),
+			args.get('processes', utils.cpus())
+		)
+		if reducer_func is not None:
+			reducer_func(gathered)
+		else:
+			for result in gathered:
+				print result
+
+	except OptionError, e:
+		print '\n%s\n' % str(e)
+		parser.print_usage()
+
+
+def stats_main():
+	'''
+	Entry point for the `cluf stats` command.  Reports the metrics recorded
+	by the subjobs of a job (see `run_direct`).
+	'''
+	parser = StatsArgParser()
+	try:
+		args = parser.parse_args()
+		jobs_dir = args.get('jobs_dir', DEFAULT_CLUF_OPTIONS['jobs_dir'])
+		if not os.path.isdir(jobs_dir):
+			raise OptionError('No such jobs directory: %s' % jobs_dir)
+
+		target_module_name = os.path.splitext(
+			os.path.basename(args['target_module']))[0]
+		job_metrics = metrics.read_metrics(jobs_dir, target_module_name)
+		if not job_metrics:
+			raise OptionError(
+				'No metrics for %s were found in %s.  Were the subjobs run '
+				'with --metrics?' % (target_module_name, jobs_dir)
+			)
+
+		if args.get('json'):
+			print json.dumps(metrics.summarize(job_metrics), sort_keys=True)
+		else:
+			print metrics.format_report(job_metrics)
+
+	except OptionError, e:
+		print '\n%s\n' % str(e)
+		parser.print_usage()
+
+
+def profile_report_main():
+	'''
+	Entry point for the `cluf profile-report` command.  Merges the profiles
+	written by the workers of all subjobs of a job (see `run_direct`), and
+	prints the top functions.
+	'''
+	parser = ProfileReportArgParser()
+	try:
+		args = parser.parse_args()
+		jobs_dir = args.get('jobs_dir', DEFAULT_CLUF_OPTIONS['jobs_dir'])
+		if not os.path.isdir(jobs_dir):
+			raise OptionError('No such jobs directory: %s' % jobs_dir)
+
+		target_module_name = os.path.splitext(
+			os.path.basename(args['target_module']))[0]
+		paths = profiling.find_profiles(jobs_dir, target_module_name)
+		if not paths:
+			raise OptionError(
+				'No profiles for %s were found in %s.  Were the subjobs run '
+				'with --profile?' % (target_module_name, jobs_dir)
+			)
+
+		stats = profiling.merge_profiles(paths)
+		print 'Merged %d profiles' % len(paths)
+		if 'output' in args:
+			stats.dump_stats(args['output'])
+			print 'wrote merged profile to %s' % args['output']
+		stats.strip_dirs()
+		stats.sort_stats(args.get('sort', 'cumulative'))
+		stats.print_stats(args.get('limit', 30))
+
+	except OptionError, e:
+		print '\n%s\n' % str(e)
+		parser.print_usage()
+
+
+# Commands that `main` delegates to, given as the first argument.
+SUBCOMMANDS = {
+	'gather': gather_main,
+	'stats': stats_main,
+	'profile-report': profile_report_main,
+}
+
 
 def load_source(target_module_path):
 	'''
@@ -289,8 +446,9 @@ def dispatch(target_module_name, iterable, options):
 			need not be within a tuple (unless that single argument is itself a
 			tuple).
 
-		- queue [bool] - Whether to enqueue the generated scripts to
-			the job scheduler using the `qsub` command.  Default is to enqueue.
+		- queue [bool] - Whether to submit the generated scripts using the
+			submission backend (e.g. to the job scheduler using `qsub`).  The
+			job ids are recorded in a manifest in `jobs_dir`.
 
 		- target_cli [list] - Command line arguments intended for interpretation
 			by the target module.  These are passed through, and, when the
@@ -298,19 +456,92 @@ def dispatch(target_module_name, iterable, options):
 			this function), those arguments will appear in sys.argv, just as
 			they would if the target module were directly run in a shell.
 
+		- dynamic [str] - If given, subjobs claim blocks of iterations from
+			a lease directory at this path, or from a coordinator, rather than
+			being assigned bins.  A coordinator's address should be given as
+			"tcp://host:port".  If "tcp", a coordinator is launched.
+
+		- materialize [bool] - Whether to enumerate the arguments iterable
+			once, here, writing the argument sets for each subjob into its own
+			shard file in `jobs_dir`.  Subjobs then read their shard rather
+			than enumerating the arguments iterable themselves.
+
+		- count [callable] - If given, it's called (with no arguments) to
+			count the argument sets, when `iterations` is given, and the 
+			arguments iterable doesn't support len().  Otherwise, the 
+			arguments iterable is counted by enumerating it, and the count is
+			cached in `jobs_dir`.
+
+		- recount [bool] - Whether to enumerate the arguments iterable to 
+			count it, even if a count was cached in `jobs_dir`.
+
+		- job_array [bool] - Whether to write a single script, for a job 
+			array, instead of one script per subjob.  Each subjob determines
+			its bin from an environment variable (e.g. $PBS_ARRAYID).  If 
+			`queue` is set, the job array is submitted all at once.
+
+		- backend [str] - The submission backend: "pbs" (the default), 
+			"slurm", or "local" (see the backends module).
+
+		- submit_concurrency [int] - Maximum number of submissions to make 
+			at once.  For the local backend, this is the number of subjobs
+			run at once.
+
+		- cost [callable] - If given, it's called with each argument set,
+			and should return the argument set's estimated cost (e.g. its 
+			expected run time).  Argument sets are then assigned to subjobs
+			so that each subjob gets about the same total cost.  The 
+			assignment is written to a plan file in `jobs_dir`.
+
 	[No outputs]
 	'''
 
-	# How many nodes will we use?  We might need to count the arguments iterable.
-	options['nodes'] = get_num_nodes(options, iterable)
-
 	# Ensure the jobs dir exists.
 	utils.ensure_exists(options['jobs_dir'])
 
+	# When materializing argument sets, we can't count the arguments iterable
+	# (or estimate costs) separately from enumerating it, because it might be
+	# a generator.  So spool it to a shard first (which knows its length), if 
+	# we need to count it.
+	spool = None
+	if options.get('materialize') and (
+		'nodes' not in options or 'cost' in options
+	):
+		spool_path = os.path.join(
+			options['jobs_dir'], target_module_name + '.spool')
+		shards.write_shard(spool_path, iterable)
+		spool = iterable = shards.read_shard(spool_path)
+
+	# When weighting by cost, estimate the cost of every argument set.  The
+	# iterable can then be counted by counting the costs.
+	costs = None
+	if 'cost' in options:
+		print 'Estimating the cost of each argument set...'
+		costs = array('d', planning.generate_costs(
+			as_arguments(iterable), options['cost']))
+
+	# How many nodes will we use?  We might need to count the arguments iterable.
+	options['nodes'] = get_num_nodes(
+		options, iterable if costs is None else costs, target_module_name)
+
+	# Plan which subjob gets each argument set, balancing the total costs.
+	if costs is not None:
+		totals = plan_costs(target_module_name, costs, options)
+		print (
+			'Dividing work by estimated cost: total cost per node is '
+			'%.4g to %.4g' % (min(totals), max(totals))
+		)
+
 	# Print a message about what will be hashed.  Reduces user errors from
 	# badly formatted hash options (which would silently cause all of the work
 	# to be done by a single node)
-	if 'hash' in options:
+	if 'bin_scheme' in options:
+		print 'Assigning hashes to bins using the %s scheme' % options['bin_scheme']
+
+	if 'bin_key' in options:
+		print 'Dividing work by hashing the bin key of each argument set'
+
+	elif 'hash' in options:
 		print 'Dividing work by hashing arguments'
 		positional_args = [str(h) for h in options['hash'] if isinstance(h, int)]
 		keyword_args = [
@@ -327,41 +558,121 @@ def dispatch(target_module_name, iterable, options):
 			% (arg_type, options['key'])
 		)
 
-	else:
-		print 'Dividing work based on argument order'
-
-	# Make each job script, and possibly enqueue it
-	for node_num in range(options['nodes']):
+	elif 'dynamic' in options:
+		# Launch a coordinator if one was requested, but no address given
+		if options['dynamic'] == 'tcp':
+			options['dynamic'] = leases.start_coordinator(
+				options.get('lease_seconds', leases.DEFAULT_LEASE_SECONDS))
+		print (
+			'Work will be divided dynamically, using leases from %s' 
+			% options['dynamic']
+		)
 
-		# Format the script for this iteration
-		script = format_script(target_module_name, node_num, options)
+	elif 'cost' not in options:
+		print 'Dividing work based on argument order'
 
-		# Write the script to disk
-		script_path = resolve_script_path(target_module_name, node_num, options)
+	# Write the argument sets for each subjob into its own shard file
+	if options.get('materialize'):
+		print 'Writing argument sets into shard files...'
+		shard_paths = [
+			resolve_script_path(target_module_name, node_num, options, '.shard')
+			for node_num in range(options['nodes'])
+		]
+		bin_options = dict(options, num_bins=options['nodes'])
+		shards.write_shards(
+			shard_paths, assign_bins(iterable, bin_options))
+		if spool is not None:
+			spool.close()
+			os.remove(spool.path)
+
+	# Read the scripts to be prepended and appended just once.
+	statements = read_statements(options)
+	backend = backends.get_backend(options)
+	concurrency = options.get(
+		'submit_concurrency', backend.default_concurrency)
+
+	# Make a single script for a job array, and possibly enqueue it
+	if options.get('job_array'):
+		script = format_script(
+			target_module_name, backend.array_id, options, statements)
+		script_path = resolve_script_path(
+			target_module_name, ARRAY_SUBJOB, options)
 		open(script_path, 'w').write(script)
-
-		# Queue the script
-		if options['queue']:
-			print 'submitting job %d' % node_num
-			print check_output(['qsub %s' % script_path], shell=True)
-		else:
-			print 'created script for subjob %d' % node_num
+		if not options['queue']:
+			print 'created job array script for %d subjobs' % options['nodes']
+			return
+
+		print 'submitting job array of %d subjobs' % options['nodes']
+		entries = backend.submit_array(
+			script_path, options['nodes'], concurrency)
+		for entry in entries:
+			entry.setdefault('subjob', ARRAY_SUBJOB)
+			entry['script'] = script_path
+
+	# Make each job script, and possibly enqueue them all
+	else:
+		script_paths = []
+		for node_num in range(options['nodes']):
+
+			# Format the script for this iteration
+			script = format_script(
+				target_module_name, node_num, options, statements)
+
+			# Write the script to disk
+			script_path = resolve_script_path(
+				target_module_name, node_num, options)
+			open(script_path, 'w').write(script)
+			script_paths.append(script_path)
+			if not options['queue']:
+				print 'created script for subjob %d' % node_num
+
+		if not options['queue']:
+			return
+
+		# Queue the scripts
+		print 'submitting %d subjobs' % options['nodes']
+		entries = backends.submit_scripts(backend, script_paths, concurrency)
+		for subjob, entry in enumerate(entries):
+			entry.update(subjob=subjob, script=script_paths[subjob])
+
+	# Record the submitted jobs in the manifest
+	for entry in entries:
+		print 'subjob %s: job %s' % (entry['subjob'], entry['job_id'])
+	manifest_path = os.path.join(
+		options['jobs_dir'], target_module_name + '.manifest')
+	backends.write_manifest(manifest_path, backend, entries)
+	print 'wrote manifest to %s' % manifest_path
+
+
+def plan_costs(target_module_name, costs, options):
+	'''
+	Assign argument sets, whose estimated costs are `costs`, to nodes, and
+	write the plan to a plan file in the jobs dir.  The plan file's path is
+	stored in `options` under "plan".  Returns the total cost per node.
+	'''
+	plan, totals = planning.plan_bins(costs, options['nodes'])
+	options['plan'] = os.path.join(
+		options['jobs_dir'], target_module_name + '.plan')
+	planning.write_plan(options['plan'], plan)
+	return totals
 
 
-def resolve_script_path(target_module_name, node_num, options):
+def resolve_script_path(target_module_name, node_num, options, extension=None):
+	if extension is None:
+		extension = backends.get_backend(options).script_extension
 	script_name_fmt = options['pbs_options'].get(
 		'name', DEFAULT_PBS_OPTIONS['name'])
 	script_name = script_name_fmt.format(
 		target=target_module_name, subjob=node_num, num_subjobs=options['nodes'])
-	return os.path.join(options['jobs_dir'], script_name + '.pbs')
-
+	return os.path.join(options['jobs_dir'], script_name + extension)
 
-def format_script(target_module_name, node_num, options):
 
-	# Work out pbs statements for this job
-	pbs_option_statements = format_pbs_statements(
-		target_module_name, node_num, options
-	)
+def read_statements(options):
+	'''
+	Get the statements to be prepended and appended to subjob scripts, which
+	come from the `prepend_script` and `append_script` files, and from the
+	`prepend_statements` and `append_statements` options.
+	'''
 
 	# Get any additional statements to prepend
 	prepend_statements = [
@@ -377,11 +688,26 @@ def format_script(target_module_name, node_num, options):
 	append_statements.extend(options['append_statements'])
 	append_statements = '\n'.join(append_statements)
 
+	return prepend_statements, append_statements
+
+
+def format_script(target_module_name, node_num, options, statements=None):
+
+	# Work out scheduler directives for this job
+	directive_statements = format_directive_statements(
+		target_module_name, node_num, options
+	)
+
+	# Get any additional statements to prepend and append
+	if statements is None:
+		statements = read_statements(options)
+	prepend_statements, append_statements = statements
+
 	command = format_command_statement(target_module_name, node_num, options)
 
-	# Format the pbs script for this job
+	# Format the script for this job
 	return TEMPLATE.format(
-		pbs_option_statements=pbs_option_statements,
+		directive_statements=directive_statements,
 		prepend_statements=prepend_statements,
 		append_statements=append_statements,
 		current_directory=os.getcwd(),
@@ -403,23 +729,106 @@ def format_command_statement(target_module_name, node_num, options):
 		'cluf',
 		target_module_name,
 		'-m', 'direct',
-		'-b', '%s/%s' % (node_num, options['nodes']),
 		'-t', options['target_func_name'],
 		'-a', options['argument_iterable_name'],
 	])
 
+	# Subjobs either claim work dynamically, or are assigned a bin
+	if 'dynamic' in options:
+		command_tokens.extend(['-d', options['dynamic']])
+		if 'block_size' in options:
+			command_tokens.extend(['--block-size', str(options['block_size'])])
+		if 'lease_seconds' in options:
+			command_tokens.extend([
+				'--lease-seconds', str(options['lease_seconds'])])
+	else:
+		command_tokens.extend(['-b', '%s/%s' % (node_num, options['nodes'])])
+
 	# Add the hash option if any
 	if 'hash' in options:
 		command_tokens.extend(['-x', options['hash_cli']])
 
+	# Add the bin key option if any.  A bin key that was given as a callable
+	# (in `cluf_options`) will be found by the subjob in the target module.
+	if 'bin_key_cli' in options:
+		command_tokens.extend(['--bin-key', options['bin_key_cli']])
+
+	# Add the hash function option if any
+	if 'hash_function' in options:
+		command_tokens.extend(['--hash-function', options['hash_function']])
+
+	# Add the bin scheme option if any
+	if 'bin_scheme' in options:
+		command_tokens.extend(['--bin-scheme', options['bin_scheme']])
+
 	# Add the key option if any
 	if 'key' in options:
 		command_tokens.extend(['-k', str(options['key'])])
 
+	# Add the reducer option if any
+	if 'reducer_func_name' in options:
+		command_tokens.extend(['-r', options['reducer_func_name']])
+
+	# Add the setup and teardown options if any.  Like the bin key, these
+	# may have been given as callables in `cluf_options`.
+	if 'setup_cli' in options:
+		command_tokens.extend(['--setup', options['setup_cli']])
+	if 'teardown_cli' in options:
+		command_tokens.extend(['--teardown', options['teardown_cli']])
+
 	# Add the processors option if any
 	if 'processes' in options:
 		command_tokens.extend(['-p', str(options['processes'])])
 
+	# Add the executor and threads options if any
+	if 'executor' in options:
+		command_tokens.extend(['--executor', options['executor']])
+	if 'threads' in options:
+		command_tokens.extend(['--threads', str(options['threads'])])
+	if 'threads_per_process' in options:
+		command_tokens.extend([
+			'--threads-per-process', str(options['threads_per_process'])])
+	if 'shared_memory' in options:
+		command_tokens.extend(['--shared-memory', str(options['shared_memory'])])
+	if 'serializer' in options:
+		command_tokens.extend(['--serializer', options['serializer']])
+	if 'async_concurrency' in options:
+		command_tokens.extend([
+			'--async-concurrency', str(options['async_concurrency'])])
+
+	# Add the chunksize option if any
+	if 'chunksize' in options:
+		command_tokens.extend(['-c', str(options['chunksize'])])
+
+	# Add the resume, save results, metrics, heartbeat, and profile options if
+	# any.  The journal, results, metrics, heartbeat, and profiles are kept
+	# in the jobs dir.
+	if options.get('resume'):
+		command_tokens.append('--resume')
+	if options.get('save_results'):
+		command_tokens.append('--save-results')
+	if options.get('metrics'):
+		command_tokens.append('--metrics')
+	if options.get('heartbeat'):
+		command_tokens.append('--heartbeat')
+	if 'profile' in options:
+		command_tokens.extend(['--profile', options['profile']])
+	keeps_files = ('resume', 'save_results', 'metrics', 'heartbeat', 'profile')
+	if any(options.get(option) for option in keeps_files):
+		command_tokens.extend(['-j', options['jobs_dir']])
+
+	# Add the progress option if any
+	if 'progress' in options:
+		command_tokens.extend(['--progress', str(options['progress'])])
+
+	# If argument sets were materialized, point the subjob to its shard.
+	# Otherwise, if work was planned by cost, point the subjob to the plan.
+	if options.get('materialize'):
+		command_tokens.extend(['-S', resolve_script_path(
+			target_module_name, node_num, options, '.shard')])
+	elif 'plan' in options:
+		command_tokens.extend(['--plan', options['plan']])
+
 	# Place the pass-through command line args (if any) after a '--' separator
 	if len(options['target_cli']):
 		command_tokens.append('--')
@@ -428,7 +837,7 @@ def format_command_statement(target_module_name, node_num, options):
 	return ' '.join(command_tokens)
 
 
-def get_num_nodes(options, argument_iterable):
+def get_num_nodes(options, argument_iterable, target_module_name=None):
 
 	# If nodes was explicitly provided as an option, use that
 	if 'nodes' in options:
@@ -443,16 +852,10 @@ def get_num_nodes(options, argument_iterable):
 
 	print 'Counting iterations to determine number of nodes needed...'
 	# The number of nodes will be based on the supplied number of iterations per
-	# node.  We need to count total iterations.  Try calling len directly on
-	# the argument iterable (this will work for lists, e.g.)
-	try:
-		num_iterations = len(argument_iterable)
-
-	# If the iterable doesn't know it's length, we need to count it.
-	except TypeError:
-		num_iterations = 0
-		for item in argument_iterable:
-			num_iterations += 1
+	# node.  We need to count total iterations.  That's done without 
+	# enumerating the argument iterable if possible; see the counting module.
+	num_iterations = counting.count_iterations(
+		argument_iterable, options, target_module_name)
 
 	# Calculate the number of nodes needed based on iterations per node
 	nodes = int(math.ceil(num_iterations / float(options['iterations'])))
@@ -464,65 +867,42 @@ def get_num_nodes(options, argument_iterable):
 	return nodes
 
 
-def format_pbs_statements(target_module_name, node_num, options):
+def format_directive_statements(target_module_name, node_num, options):
 	'''
-	Helper function that prepares the pbs option statements for scripts created
-	by dispatch.
+	Helper function that prepares the scheduler directives for scripts created
+	by dispatch, using the submission backend (see the backends module).
 
 	Inputs
 
 	* target_module_name [str] - the name of the target module (no file 
 		extension).
 
-	* node_num [int] - node identifier between 0 and the number of nodes 
-		(=`nodes`).
+	* node_num [int|str] - node identifier between 0 and the number of nodes 
+		(=`nodes`), or the backend's `array_id`, for a job array.
 
 	* options [dict(pbs_options={},node=int)] - Dictionary that contains
 		a dictionary of PBS configuration options and an integer representing the
 		total number of nodes being used for the job.
-		The following keys may appear in the pbs_options:
-		- '<key>': where <key> is the name of any option specified in the form 
-			-l <key>=<val>
-			examples: 'walltime', 'ppn', 'pmem', 'gpus', etc.
+		The following keys may appear in the pbs_options, besides those 
+		handled by the backend:
 		- 'stdout': the path to where stdout should be written.
 		- 'stderr': the path to where stderr should be written.
 		- 'name': the name to be given to the job (e.g. as seen when running
 			qstat).
-		* Note -- 'nodes' should not appear within pbs_options because each 
-			script is intended to run on one machine.
 	'''
 
 	# Pull out the relevant options for easier access
 	pbs_options = options['pbs_options']
 	nodes = options['nodes']
 
-	# Many pbs parameters are specified using a generic statement format.
-	# Identify the parameters that need to be handled separately.
-	non_generic_params = {'ppn', 'stdout', 'stderr', 'name'}
-
-	# First format the generic parameters
-	pbs_option_statements = [
-		'#PBS -l %s=%s' % (k, v) 
-		for k, v in pbs_options.items() 
-		if k not in non_generic_params
-	]
-
-	# Next we will handle each of the non-generic parameters.
-	# We begin by specifying the number of processors.
-	if 'ppn' in pbs_options:
-		pbs_option_statements.append(
-			'#PBS -l nodes=1:ppn=%s' % pbs_options['ppn'])
-	elif 'processes' in options:
-		pbs_option_statements.append(
-			'#PBS -l nodes=1:ppn=%s' % options['processes'])
-
 	# Specify the name of the job (this is what will display, e.g., when
 	# calling qstat)
+	job_array = options.get('job_array')
 	job_name_formatter = pbs_options.get('name', DEFAULT_PBS_OPTIONS['name'])
 	job_name = job_name_formatter.format(
-		target=target_module_name, subjob=node_num, num_subjobs=nodes
+		target=target_module_name, 
+		subjob=ARRAY_SUBJOB if job_array else node_num, num_subjobs=nodes
 	)
-	pbs_option_statements.append('#PBS -N ' + job_name)
 
 	# Specify the stdout path.  If none was given, use the default.
 	stdout_path_formatter = pbs_options.get(
@@ -532,7 +912,6 @@ def format_pbs_statements(target_module_name, node_num, options):
 	)
 	stdout_relative_path = os.path.expanduser(stdout_relative_path)
 	stdout_path = os.path.join(options['jobs_dir'], stdout_relative_path)
-	pbs_option_statements.append('#PBS -o ' + stdout_path)
 
 	# Specify the stderr path.  If none was given, use the default.
 	stderr_path_formatter = pbs_options.get(
@@ -542,9 +921,10 @@ def format_pbs_statements(target_module_name, node_num, options):
 	)
 	stderr_relative_path = os.path.expanduser(stderr_relative_path)
 	stderr_path = os.path.join(options['jobs_dir'], stderr_relative_path)
-	pbs_option_statements.append('#PBS -e ' + stderr_path)
 
-	return '\n'.join(pbs_option_statements)
+	backend = backends.get_backend(options)
+	return '\n'.join(backend.format_directives(
+		job_name, stdout_path, stderr_path, options))
 
 
 def run_direct(target_func, iterable, reducer_func, options):
@@ -596,10 +976,101 @@ def run_direct(target_func, iterable, reducer_func, options):
 			than 0.  In normal usage, this should be equal to the number of
 			machines over which the work has been spread.
 
+		- dynamic [str] - path to a lease directory, or address of a 
+			coordinator ("tcp://host:port").  If given, blocks of iterations
+			are claimed from it, instead of processing the iterations in
+			`these_bins`.  See the `leases` module.
+
+		- block_size [int] - number of iterations per block, when `dynamic`
+			is given.
+
+		- lease_seconds [int] - number of seconds after which a block's lease
+			expires if not renewed, when `dynamic` is given.
+
+		- resume [bool] - Whether to journal the completion of argument sets,
+			and skip argument sets that were completed by earlier runs.  
+			Journals are kept in `jobs_dir`, one per set of bins.
+
+		- save_results [bool] - Whether to save the return values of the
+			target function in `jobs_dir`, one file per worker process, so 
+			that they can be gathered later (see the `results` module).
+
+		- metrics [bool] - Whether to record histograms of the time spent
+			calling the target function, waiting for work, and generating
+			work, and write them to a metrics file in `jobs_dir` (see the
+			`metrics` module).
+
+		- progress [float] - If given, report progress every this many 
+			seconds, to stderr (see the `progress` module).
+
+		- heartbeat [bool] - Whether to write progress reports to a 
+			heartbeat file in `jobs_dir`, instead of to stderr.
+
+		- executor ["process"|"thread"] - Whether workers are processes (the
+			default), or threads of this process.  Threads suit targets that
+			mostly wait on I/O.
+
+		- threads [int] - number of worker threads, when `executor` is
+			"thread".  By default, this is 5 times the number of cpus.
+
+		- threads_per_process [int] - If given, each worker process runs a
+			pool of this many threads, which take chunks from the queue as
+			they become free.  Suits targets that release the GIL, or
+			partly wait on I/O.
+
+		- async_concurrency [int] - When the target is a coroutine function,
+			the number of calls that each worker runs at once, on its own
+			event loop (see the `coroutines` module).  Default is 100.
+
+		- shared_memory [int] - If given, NumPy arrays of at least this many
+			bytes, among argument sets and results, are sent between
+			processes through shared memory, rather than being pickled (see
+			the `sharing` module).  Not available when `executor` is
+			"thread".
+
+		- serializer ["pickle"|"cloudpickle"|"compressed"|"bytes"] - If
+			given, serialize chunks of argument sets and results this way
+			before queueing them, rather than leaving the queues to pickle
+			them (see the `serializers` module).  Not available when
+			`executor` is "thread".
+
+		- profile ["cprofile"|"sample"] - If given, run each worker under 
+			this profiler, and write its profile to `jobs_dir` (see the
+			`profiling` module).
+
+		- jobs_dir [str] - Directory in which to keep the journal, saved
+			results, metrics, heartbeat file, and profiles.
+
+		- shard [str] - path to a shard file written by dispatch.  If given,
+			`iterable` should be a ShardReader for it.  Its argument sets are
+			taken to belong to this job already, and aren't binned again.
+			Workers are sent slices of the shard, and read argument sets 
+			from it directly.
+
+		- setup [callable] - called once in each worker process, before it
+			starts taking work, to load state that the target needs (e.g. a
+			large model).  Its return value is available to the target
+			through `get_context`.  When `executor` is "thread", it's called
+			once, for all of the worker threads.
+
+		- teardown [callable] - called once in each worker process (or once,
+			when `executor` is "thread") after its work is done.
+
+		- reducer_func_name [str] - name of a callable in the target module 
+			that will be called, in its own process, with an iterator over the
+			return values of the target function.  Results are yielded as they
+			are produced, in no particular order.
+
 		- processes [int|None] - number of worker processes to be concurrently 
 			spawned for repeated execution of the target function.  By default
 			this is equal to the number of cpus available on the machine.
 
+		- chunksize [int|"auto"] - number of argument sets sent to a worker
+			at a time.  Larger chunks amortize the cost of queueing for 
+			targets that run quickly.  If "auto", the chunk size is adjusted
+			as the job runs, based on the measured time per call.  Default is
+			1.
+
 		- target_func_name [str] - name of the target function.  It can 
 			actually be an identifier for any callable in the module's
 			namespace.  Default is to look for a callable called "target".
@@ -624,39 +1095,583 @@ def run_direct(target_func, iterable, reducer_func, options):
 	# then normalize and validate options.
 	options = get_options({}, options)
 
-	# Make a queue on which to put arguments
-	args_queue = IterableQueue()
+	# Coroutine targets are run many at a time by each worker.
+	async_concurrency = None
+	if coroutines.is_coroutine_function(target_func):
+		async_concurrency = options.get(
+			'async_concurrency', coroutines.DEFAULT_CONCURRENCY)
+		if 'threads_per_process' in options:
+			raise OptionError(
+				'`threads_per_process` can\'t be used with coroutine targets.')
+	elif 'async_concurrency' in options:
+		raise OptionError(
+			'`async_concurrency` requires the target to be a coroutine '
+			'function (and asyncio, or trollius, to be installed).'
+		)
+
+	# Chunks of argument sets, and of results, may be serialized before being
+	# queued, rather than leaving them to be pickled by the queues.  Make
+	# the serializer now, since it may need a package that isn't installed.
+	serializer = None
+	if 'serializer' in options:
+		serializer = serializers.get_serializer(options['serializer'])
+
+	# Workers are either processes (the default), which are sent argument
+	# sets through queues served by a manager process, or threads of this 
+	# process, which are handed argument sets directly.  Make a queue on which
+	# to put arguments.
+	if options.get('executor') == 'thread':
+		worker_class = threading.Thread
+		num_workers = options.get(
+			'threads', threads.DEFAULT_THREADS_PER_CPU * utils.cpus())
+		args_queue = threads.ThreadQueue(2 * num_workers)
+		make_queue = threads.ThreadQueue
+	else:
+		worker_class = Process
+		num_workers = options.get('processes', utils.cpus())
+		args_queue = IterableQueue()
+		make_queue = IterableQueue
+
+	results_queue = None
 	if reducer_func is not None:
-		results_queue = IterableQueue()
+		results_queue = make_queue()
 
-	# Start the pool of workers
-	for proc_num in range(options.get('processes', utils.cpus())):
-		proc = Process(
-			target=worker, 
-			args=(
-				target_func,
-				args_queue.get_consumer(),
-				results_queue.get_producer() if reducer_func else None
-			)
+	# If a worker (or the reducer) fails, it sets `abort`, after which no
+	# more work is handed out, and the job fails once the workers stop.
+	if worker_class is Process:
+		abort = multiprocessing.Event()
+	else:
+		abort = threading.Event()
+
+	# When chunks are sized automatically, workers report the time spent
+	# calling the target function, so that the size of chunks can be adapted.
+	chunksize = options.get('chunksize', 1)
+	timing = CallTiming() if chunksize == 'auto' else None
+
+	# When resuming, workers journal the keys of completed argument sets, and 
+	# argument sets completed in earlier runs are skipped.
+	journal_writer = None
+	completed = None
+	if options.get('resume'):
+		journal_dir = resolve_journal_dir(target_func, options)
+		utils.ensure_exists(journal_dir)
+		journal_writer = journal.JournalWriter(journal_dir)
+		completed = journal.load_completed(
+			journal_dir,
+			hashed=binning.uses_hashing(options)
 		)
-		proc.start()
+
+	# When saving results, workers write each result along with the key of
+	# its argument set.
+	result_writer = None
+	if options.get('save_results'):
+		results_dir = resolve_results_dir(target_func, options)
+		utils.ensure_exists(results_dir)
+		result_writer = results.ResultWriter(results_dir)
+	keyed = journal_writer is not None or result_writer is not None
+
+	# When work is divided dynamically, workers acknowledge the chunks they
+	# complete (or skip), so that we know when blocks are done.  Blocks are
+	# only claimed when the workers are running low on work, i.e. have fewer
+	# than a few chunks each (or each thread, or concurrent call).
+	acks = None
+	if 'dynamic' in options:
+		lease_seconds = options.get(
+			'lease_seconds', leases.DEFAULT_LEASE_SECONDS)
+		acks = Queue()
+		lease_tracker = leases.LeaseTracker(
+			leases.open_leases(options['dynamic'], lease_seconds), acks,
+			lease_seconds, leases.CHUNKS_PER_WORKER * num_workers
+			* (options.get('threads_per_process') or 1) * (async_concurrency or 1),
+			abort
+		)
+		lease_tracker.start()
+
+	# When recording metrics, each worker gets its own histograms, in shared
+	# memory.
+	job_metrics = None
+	if options.get('metrics'):
+		job_metrics = metrics.JobMetrics(num_workers)
+
+	# When reporting progress, each worker counts the argument sets it
+	# completes, and a thread reports on the counts.
+	monitor = None
+	if 'progress' in options or options.get('heartbeat'):
+		heartbeat_path = None
+		if options.get('heartbeat'):
+			utils.ensure_exists(options['jobs_dir'])
+			heartbeat_path = resolve_heartbeat_path(target_func, options)
+		monitor = progress.ProgressMonitor(
+			num_workers, options.get('progress', progress.DEFAULT_INTERVAL),
+			get_job_total(iterable, options), heartbeat_path
+		)
+
+	# When sharing memory, large arrays are sent to workers, and results to
+	# the reducer, through shared memory segments.
+	sharer = None
+	if 'shared_memory' in options:
+		sharer = sharing.Sharer(options['shared_memory'])
+
+	# When profiling, each worker writes its own profile.
+	profiler = None
+	if 'profile' in options:
+		profile_dir = resolve_profile_dir(target_func, options)
+		utils.ensure_exists(profile_dir)
+		profiler = profiling.Profiler(options['profile'], profile_dir)
+
+	# Each worker process sets up its own state.  Threads share this
+	# process, so its state is set up once, here, for all of them.
+	setup_func = options.get('setup')
+	teardown_func = options.get('teardown')
+	if worker_class is not Process:
+		if setup_func is not None:
+			set_context(setup_func())
+		worker_hooks = (None, None)
+	else:
+		worker_hooks = (setup_func, teardown_func)
+
+	# Start the pool of workers
+	worker_procs = start_workers(
+		target_func, num_workers, args_queue, results_queue, timing,
+		journal_writer, acks, result_writer, job_metrics,
+		monitor.counters if monitor else None, profiler, worker_class,
+		async_concurrency, options.get('threads_per_process'), *worker_hooks,
+		sharer=sharer, serializer=serializer, abort=abort
+	)
+	if monitor is not None:
+		monitor.start()
 
 	# Start a process for reduction, if we have a reducer function
 	if reducer_func:
 		# Start the reducer process, if needed
-		reducer_proc = Process(
-			target=reducer_func,
-			args=(results_queue.get_consumer(),)
+		reducer_proc = worker_class(
+			target=reducer,
+			args=(
+				reducer_func, results_queue.get_consumer(), sharer is not None,
+				serializer, abort
+			)
 		)
 		reducer_proc.start()
 
+		# All endpoints for the results queue have been made
+		results_queue.close()
+
 	# Start loading work onto the args queue
 	args_producer = args_queue.get_producer()
 	args_queue.close()
-	for args in generate_args_subset(iterable, options):
-		args_producer.put(args)
-	args_producer.close()
 
+	# Argument sets in a shard were already binned during dispatch.  Rather
+	# than sending the argument sets themselves, send slices of the shard, 
+	# from which workers read argument sets directly.
+	if 'dynamic' in options:
+		chunks = generate_dynamic_chunks(
+			iterable, lease_tracker, options.get(
+				'block_size', leases.DEFAULT_BLOCK_SIZE),
+			lambda: get_chunksize(chunksize, timing), completed
+		)
+		if not keyed:
+			chunks = ((chunk, None) for chunk, keys in chunks)
+
+	elif 'shard' in options:
+		slices = shards.generate_slices(
+			iterable, lambda: get_chunksize(chunksize, timing), completed)
+		chunks = (
+			(chunk, [iterable.key(k) for k in chunk.indices] if keyed else None)
+			for chunk in slices
+		)
+
+	# Otherwise, send chunks of argument sets.  If journaling or saving
+	# results, also send the keys for the argument sets.
+	elif keyed:
+		keyed_args = generate_keyed_args_subset(iterable, options, completed)
+		chunks = (
+			(
+				[args for key, args in keyed_chunk],
+				[key for key, args in keyed_chunk]
+			)
+			for keyed_chunk in generate_chunks(keyed_args, chunksize, timing)
+		)
+	else:
+		args_subset = generate_args_subset(iterable, options)
+		chunks = (
+			(chunk, None)
+			for chunk in generate_chunks(args_subset, chunksize, timing)
+		)
+
+	# Move large arrays into shared memory before their chunks are queued.
+	# Workers read the argument sets in a shard directly, so those aren't.
+	if sharer is not None and 'shard' not in options:
+		chunks = ((sharer.share_chunk(chunk), keys) for chunk, keys in chunks)
+
+	# Serialize chunks here, so that the queue only has to send a string.
+	if serializer is not None:
+		chunks = ((serializer.dumps(chunk), keys) for chunk, keys in chunks)
+
+	# Stop handing out work as soon as a worker fails.
+	chunks = itertools.takewhile(lambda chunk: not abort.is_set(), chunks)
+
+	# When recording metrics, time the generation of each chunk, and putting
+	# it onto the queue (which blocks if the queue is contended).
+	try:
+		if job_metrics is None:
+			for chunk_num, (chunk, keys) in enumerate(chunks):
+				args_producer.put((chunk_num, chunk, keys))
+		else:
+			chunks = metrics.timed(chunks, job_metrics.generate)
+			for chunk_num, (chunk, keys) in enumerate(chunks):
+				start = time.time()
+				args_producer.put((chunk_num, chunk, keys))
+				job_metrics.put.record(time.time() - start)
+
+	# If generating work fails, let the workers skip what they were given.
+	except BaseException:
+		abort.set()
+		raise
+
+	# Wait for the workers to finish.  The queues are served by a manager
+	# process that goes away when this process exits, so we can't leave early.
+	finally:
+		args_producer.close()
+		for proc in worker_procs:
+			proc.join()
+
+		if worker_class is not Process and teardown_func is not None:
+			teardown_func()
+
+	if monitor is not None:
+		monitor.stop()
+
+	if job_metrics is not None:
+		utils.ensure_exists(options['jobs_dir'])
+		job_metrics.write(resolve_metrics_path(target_func, options), options)
+
+	# Complete the last blocks.  Report blocks that aren't done, e.g. because
+	# the job was stopped, or their leases haven't expired yet and the
+	# arguments iterable can't be enumerated again to run them.
+	if acks is not None:
+		lease_tracker.stop()
+		unfinished = lease_tracker.leases.unfinished()
+		if unfinished:
+			sys.stderr.write(
+				'Blocks not done by any subjob yet: %s.  Unless other subjobs '
+				'are still running them, rerun a subjob to finish them.\n'
+				% ', '.join(str(block) for block in unfinished)
+			)
+
+	# Wait for the reducer to consume the last of the results.
+	if reducer_func:
+		reducer_proc.join()
+
+	# Remove any segments that weren't received.
+	if sharer is not None:
+		sharer.close()
+
+	if abort.is_set():
+		raise WorkerError(
+			'The job was stopped because a worker (or the reducer) failed.')
+
+
+# Exported as `cluster_func.map`, so as not to hide the builtin `map` here.
+def _map(target, iterable, processes=None, chunksize=1, ordered=False,
+	max_in_flight=None):
+	'''
+	Calls `target` on each argument set yielded by `iterable` using a pool of
+	worker processes, and returns an iterator over the return values.  This is
+	the library counterpart to running `cluf` in direct mode.  Argument sets
+	are interpreted the same way (tuples are unpacked, and `Arguments` objects
+	supply positional and keyword arguments).
+
+	Work is only fed to the workers as results are consumed: at most
+	`max_in_flight` chunks of argument sets (default is twice the number of
+	processes) are submitted and not yet yielded at any time.  So the
+	iterable is read lazily, and a slow consumer won't accumulate results.
+
+	If the returned iterator is closed (or garbage collected) before it is
+	exhausted, no more work is submitted, the chunks already in flight are
+	allowed to finish (their results are discarded), and the workers exit.
+
+	If `target` raises an exception in a worker, it is re-raised by the
+	returned iterator as soon as it arrives (results of other chunks that
+	haven't been yielded yet are discarded), and the workers are terminated.
+
+	Inputs
+
+	* target [callable] - the function to be called on each argument set.
+
+	* iterable [iterable] - yields the argument sets.
+
+	* processes [int|None] - number of worker processes.  Default is the 
+		number of cpus available on the machine.
+
+	* chunksize [int|"auto"] - number of argument sets sent to a worker at a
+		time.  See `run_direct`.
+
+	* ordered [bool] - if True, results are yielded in the order of the
+		argument sets that produced them.  Otherwise they are yielded in the
+		order that they finish.
+
+	* max_in_flight [int|None] - limit on the number of chunks that have been
+		submitted but whose results have not yet been yielded.
+
+	Outputs
+
+	* [iterator] - yields the return values of `target`.
+	'''
+	options = {'chunksize': chunksize}
+	utils.normalize_options(options)
+	utils.validate_options(options)
+	chunksize = options['chunksize']
+
+	if processes is None:
+		processes = utils.cpus()
+	if max_in_flight is None:
+		max_in_flight = 2 * processes
+
+	return _map_results(
+		target, iterable, processes, chunksize, ordered, max_in_flight)
+
+
+def _map_results(
+	target, iterable, processes, chunksize, ordered, max_in_flight
+):
+	'''Generator that does the work for `_map`.'''
+
+	args_queue = IterableQueue()
+	results_queue = IterableQueue()
+	timing = CallTiming() if chunksize == 'auto' else None
+	worker_procs = start_workers(
+		target, processes, args_queue, results_queue, timing)
+
+	args_producer = args_queue.get_producer()
+	results_consumer = results_queue.get_consumer()
+	args_queue.close()
+	results_queue.close()
+
+	# Every argument set belongs to this job, there is only one bin.
+	args_subset = generate_args_subset(iterable, {
+		'these_bins': [0], 'num_bins': 1})
+	chunks = (
+		(chunk_num, chunk, None) for chunk_num, chunk 
+		in enumerate(generate_chunks(args_subset, chunksize, timing))
+	)
+
+	# Chunks submitted but not yet yielded, and, if ordered, the results 
+	# that arrived before their turn.
+	in_flight = 0
+	pending = {}
+	next_chunk_num = 0
+	producer_closed = False
+	failed = False
+
+	try:
+		while True:
+
+			# Top up the work in flight, until there is no more work.
+			while not producer_closed and in_flight < max_in_flight:
+				try:
+					args_producer.put(next(chunks))
+					in_flight += 1
+				except StopIteration:
+					args_producer.close()
+					producer_closed = True
+
+			if in_flight == 0:
+				break
+
+			chunk_num, results = results_consumer.get()
+			if isinstance(results, WorkerFailure):
+				failed = True
+				raise results.error
+
+			if not ordered:
+				in_flight -= 1
+				for result in results:
+					yield result
+				continue
+
+			# In ordered mode, yield any results whose turn has come.
+			pending[chunk_num] = results
+			while next_chunk_num in pending:
+				in_flight -= 1
+				for result in pending.pop(next_chunk_num):
+					yield result
+				next_chunk_num += 1
+
+	finally:
+		# Stop submitting work, let the workers finish what's in flight, and
+		# discard their results.  This lets the queues shut down cleanly.
+		if not producer_closed:
+			args_producer.close()
+
+		# But if a worker failed, don't wait for the others.  Their queue
+		# endpoints will never be closed, so stop the queues' managers too.
+		if failed:
+			for proc in worker_procs:
+				proc.terminate()
+				proc.join()
+			abandon_queue(args_queue)
+			abandon_queue(results_queue)
+
+		else:
+			for chunk_num, results in results_consumer:
+				pass
+			for proc in worker_procs:
+				proc.join()
+
+
+def abandon_queue(queue):
+	'''
+	Stop the process that manages the IterableQueue `queue`, which would
+	otherwise wait forever for endpoints that can't be closed any more,
+	because the processes holding them were terminated.
+	'''
+	queue._management_process.terminate()
+	queue._management_process.join()
+
+
+def start_workers(
+	target_func, processes, args_queue, results_queue, timing,
+	journal_writer=None, acks=None, result_writer=None, job_metrics=None,
+	progress_counters=None, profiler=None, worker_class=Process,
+	async_concurrency=None, threads_per_process=None, setup_func=None,
+	teardown_func=None, sharer=None, serializer=None, abort=None
+):
+	'''
+	Start `processes` worker processes that each run `target_func` on chunks
+	of argument sets from `args_queue`.  If `results_queue` is not None, the
+	workers put their results on it.  If `job_metrics` is not None, each
+	worker records into its own element of `job_metrics.workers`, and
+	likewise for `progress_counters`.  If `profiler` is not None, workers
+	are run using it.  `worker_class` can be threading.Thread, to start
+	workers as threads instead of processes.  If `async_concurrency` is not
+	None, `target_func` is a coroutine function, and each worker runs up to
+	that many calls at once.  If `threads_per_process` is not None, each
+	worker runs a pool of that many threads, which are profiled individually.
+	`setup_func` and `teardown_func`, if not None, are called in each worker
+	before and after its work.  If `sharer` is not None, workers send large
+	arrays among their results through shared memory, using it.  If
+	`serializer` is not None, workers use it to deserialize chunks of
+	argument sets, and to serialize their results.  If `abort` is not None,
+	workers set it if they fail, and skip any remaining work once it's set.
+	The workers are returned.  See `worker` for the remaining arguments.
+	'''
+	# Threads in a pool are each profiled, rather than the whole worker.
+	pool_profiler = None
+	if threads_per_process is not None:
+		profiler, pool_profiler = None, profiler
+
+	worker_procs = []
+	for proc_num in range(processes):
+
+		# Writers open their file on first use.  Threads share this process,
+		# so each needs its own copy, so as not to share the file.
+		if worker_class is not Process:
+			journal_writer = copy.copy(journal_writer)
+			result_writer = copy.copy(result_writer)
+
+		proc = worker_class(
+			target=profiler.run if profiler else worker,
+			args=(() if profiler is None else (worker,)) + (
+				target_func,
+				args_queue.get_consumer(),
+				results_queue.get_producer() if results_queue else None,
+				timing,
+				journal_writer,
+				acks,
+				result_writer,
+				job_metrics.workers[proc_num] if job_metrics else None,
+				progress_counters[proc_num] if progress_counters else None,
+				async_concurrency,
+				threads_per_process,
+				pool_profiler,
+				setup_func,
+				teardown_func,
+				sharer,
+				serializer,
+				abort
+			)
+		)
+		proc.start()
+		worker_procs.append(proc)
+
+	return worker_procs
+
+
+def resolve_journal_dir(target_func, options):
+	'''
+	The journal for a job is named after the module of the target function, 
+	and the bins that the job is responsible for.
+	'''
+	journal_name = '%s-%s-%s.journal' % (
+		getattr(target_func, '__module__', 'target'),
+		','.join([str(b) for b in options['these_bins']]),
+		options['num_bins']
+	)
+	return os.path.join(options['jobs_dir'], journal_name)
+
+
+def resolve_results_dir(target_func, options):
+	'''
+	Saved results are kept alongside the journal, and named the same way.
+	'''
+	return resolve_journal_dir(target_func, options)[:-len('.journal')] + (
+		results.EXTENSION)
+
+
+def resolve_metrics_path(target_func, options):
+	'''
+	The metrics file is kept alongside the journal, and named the same way.
+	'''
+	return resolve_journal_dir(target_func, options)[:-len('.journal')] + (
+		metrics.EXTENSION)
+
+
+def resolve_profile_dir(target_func, options):
+	'''
+	Profiles are kept alongside the journal, and named the same way.
+	'''
+	return resolve_journal_dir(target_func, options)[:-len('.journal')] + (
+		profiling.EXTENSION)
+
+
+def resolve_heartbeat_path(target_func, options):
+	'''
+	The heartbeat file is kept alongside the journal, and named the same way.
+	'''
+	return resolve_journal_dir(target_func, options)[:-len('.journal')] + (
+		'.heartbeat')
+
+
+def get_job_total(iterable, options):
+	'''
+	The number of argument sets that the job will run, if it can be found
+	without enumerating `iterable`, or otherwise None.  It can't be known in
+	advance when work is divided dynamically, or by hashing or key, and 
+	argument sets skipped when resuming are included.
+	'''
+	if 'shard' in options:
+		return len(iterable)
+
+	if 'plan' in options:
+		these_bins = frozenset(options['these_bins'])
+		plan = planning.read_plan(options['plan'])
+		return sum(1 for this_bin in plan if this_bin in these_bins)
+
+	if (
+		'dynamic' in options or 'key' in options 
+		or binning.uses_hashing(options)
+	):
+		return None
+
+	# Work is dealt around to each bin in turn.
+	length = counting.get_length(iterable)
+	if length is None:
+		return None
+	num_bins = options['num_bins']
+	return sum(
+		(length - this_bin + num_bins - 1) // num_bins
+		for this_bin in set(options['these_bins']) if this_bin < num_bins
+	)
 
 
 def get_target_func_and_iterable(target_module, options):
@@ -667,15 +1682,46 @@ def get_target_func_and_iterable(target_module, options):
 	except AttributeError, e:
 		raise OptionError(str(e))
 
+	# If argument sets were materialized during dispatch, read them from the
+	# shard instead of enumerating the arguments iterable.
+	if 'shard' in options:
+		iterable = shards.read_shard(options['shard'])
+
 	# What we call the "iterable" may be an iterable or a callable that yields
 	# an iterable.  Resolve that now.
-	try:
-		iter(iterable)
-	except TypeError:
-		iterable = iterable()
+	else:
+		try:
+			iter(iterable)
+		except TypeError:
+			iterable = iterable()
+
+	# The bin key may be given as the name of a callable in the target
+	# module.  Resolve it now.
+	if isinstance(options.get('bin_key'), basestring):
+		try:
+			options['bin_key'] = getattr(target_module, options['bin_key'])
+		except AttributeError, e:
+			raise OptionError(str(e))
+
+	# The cost, count, setup, and teardown functions, if any, may be given by
+	# name.
+	for option in ('cost', 'count', 'setup', 'teardown'):
+		if isinstance(options.get(option), basestring):
+			try:
+				options[option] = getattr(target_module, options[option])
+			except AttributeError, e:
+				raise OptionError(str(e))
 
-	# TODO: try to return reducer func instead of None
-	return target_func, iterable, None
+	# The reducer is optional.
+	reducer_func = None
+	if 'reducer_func_name' in options:
+		try:
+			reducer_func = getattr(
+				target_module, options['reducer_func_name'])
+		except AttributeError, e:
+			raise OptionError(str(e))
+
+	return target_func, iterable, reducer_func
 
 
 def pass_through_args(target_module_path, args):
@@ -704,23 +1750,279 @@ def pass_through_args(target_module_path, args):
 
 
 
-def worker(target_func, args_consumer, results_producer):
+# The value returned by the `setup` callable in this worker process.
+_context = None
+
+
+def get_context():
+	'''
+	Get the value returned by the `setup` callable (see `run_direct`) in this
+	worker process, or None if there is no setup callable.  This is how the
+	target function gets at state that is loaded once per worker.
+	'''
+	return _context
+
+
+def set_context(context):
+	global _context
+	_context = context
+
+
+def worker(
+	target_func, args_consumer, results_producer, timing=None,
+	journal_writer=None, acks=None, result_writer=None, worker_metrics=None,
+	completed_counter=None, async_concurrency=None, threads_per_process=None,
+	profiler=None, setup_func=None, teardown_func=None, sharer=None,
+	serializer=None, abort=None
+):
 	'''
 	Runs the callable `target_func` repeatedly inside a single process.  
-	Consumes sets of arguments from the IterableQueue.ConsumerQueue 
-	`args_consumer`, unpacks them, and executes target_func with them.
+	Consumes numbered chunks, i.e. (chunk_num, argument sets, keys), from
+	the IterableQueue.ConsumerQueue `args_consumer`, unpacks them, and 
+	executes target_func with them.  If `timing` is a CallTiming, the time
+	spent on each chunk is recorded in it.  If `results_producer` is not None,
+	the results for each chunk are put onto it as (chunk_num, list of 
+	results).  If `result_writer` is not None, the results are saved with it,
+	along with their keys.  If `journal_writer` is not None, the keys of each
+	completed chunk are recorded with it.  If `acks` is not None, each chunk
+	is acknowledged on it as (chunk_num, completed), whether it was completed
+	or skipped.  If `worker_metrics` is not None, each call, the time spent
+	waiting for each chunk, and the worker's running time are recorded in it
+	(see `metrics.WorkerMetrics`).  If `completed_counter` is not None, its value is
+	incremented by the number of argument sets in each completed chunk.
+	If `async_concurrency` is not None, `target_func` must be a coroutine
+	function, and up to that many calls are run at once, on an event loop
+	(see the `coroutines` module).  If `threads_per_process` is not None,
+	chunks are handed to a pool of that many threads, each run under
+	`profiler` if it's not None.  If `setup_func` is not None, it's called
+	before taking any work, and its return value becomes the worker's context
+	(see `get_context`).  If `teardown_func` is not None, it's called once
+	the work is done, or the worker fails (unless `setup_func` failed).  If
+	`sharer` is not None, arrays in argument sets may arrive in shared
+	memory, and large arrays among the results are put onto
+	`results_producer` through shared memory, using it (see `sharing`).  If
+	`serializer` is not None, chunks of argument sets were serialized with
+	it, and results are serialized with it before being put onto
+	`results_producer` (see `serializers`).
+
+	If the target function (or anything else) raises an exception, a
+	WorkerFailure is put onto `results_producer` in place of the chunk's
+	results, `abort` is set (if it's not None), the remaining chunks are
+	consumed without being run, and the exception is re-raised.  Chunks are
+	also skipped once `abort` has been set by another worker.
 	'''
-	# Continually run target_func on arguments from the arguments queue
-	for args in args_consumer:
-		result = target_func(*args.args, **args.kwargs)
+	# Failing workers keep consuming from the queue, so that it can shut down.
+	queue_consumer = args_consumer
+
+	# Skip the remaining work once any worker has failed.
+	if abort is not None:
+		args_consumer = skip_after_abort(args_consumer, abort, acks)
+
+	# When recording metrics, time each wait for a chunk of arguments
+	if worker_metrics is not None:
+		worker_metrics.start()
+		args_consumer = metrics.timed(args_consumer, worker_metrics.waits)
+
+	# Deserialize chunks, if they were serialized before being queued
+	if serializer is not None:
+		args_consumer = (
+			(chunk_num, serializer.loads(chunk), keys)
+			for chunk_num, chunk, keys in args_consumer
+		)
+
+	# Get the arrays for argument sets that were sent through shared memory
+	if sharer is not None:
+		args_consumer = (
+			(chunk_num, sharing.attach_chunk(chunk), keys)
+			for chunk_num, chunk, keys in args_consumer
+		)
+
+	# Threads in a pool share the writers, counters and histograms.
+	lock = threading.Lock()
+
+	def complete(chunk_num, chunk, keys, results, seconds):
+		'''Hand off the results of a completed chunk.'''
+		with lock:
+			hand_off(chunk_num, chunk, keys, results, seconds)
+
+	def hand_off(chunk_num, chunk, keys, results, seconds):
 
 		# Pack results onto the queue if we're running a reducer
 		if results_producer:
-			results_producer.put(result)
+			queued = results
+			if sharer is not None:
+				queued = sharer.share_results(queued)
+			if serializer is not None:
+				queued = serializer.dump_results(queued)
+			results_producer.put((chunk_num, queued))
+
+		if timing is not None:
+			timing.record(seconds, len(chunk))
+
+		# Save the results before journaling them, so that completed argument
+		# sets always have saved results.
+		if result_writer is not None:
+			result_writer.record(keys, results)
+
+		if journal_writer is not None:
+			journal_writer.record(keys)
+
+		if completed_counter is not None:
+			completed_counter.value += len(chunk)
+
+		if acks is not None:
+			acks.put((chunk_num, True))
+
+	failed = []
+	def fail(chunk_num):
+		'''Report the exception being handled, raised for chunk `chunk_num`.'''
+		if acks is not None and chunk_num is not None:
+			acks.put((chunk_num, False))
+		with lock:
+			if failed:
+				return
+			failed.append(chunk_num)
+		if abort is not None:
+			abort.set()
+		if results_producer:
+			results_producer.put((chunk_num, WorkerFailure(sys.exc_info())))
+
+	def run_chunk(item):
+		chunk_num, chunk, keys = item
+		start = time.time()
+		try:
+			if worker_metrics is None:
+				results = [
+					target_func(*args) if type(args) is tuple
+					else target_func(*args.args, **args.kwargs)
+					for args in chunk
+				]
+			else:
+				results = []
+				for args in chunk:
+					with lock:
+						call_start = worker_metrics.begin_call()
+					positional, keywords = unpack(args)
+					results.append(target_func(*positional, **keywords))
+					with lock:
+						worker_metrics.end_call(call_start)
+		except BaseException:
+			fail(chunk_num)
+			raise
+		complete(chunk_num, chunk, keys, results, time.time() - start)
+
+	try:
+		if setup_func is not None:
+			set_context(setup_func())
+
+		# Once set up, always tear down, even if the target function fails.
+		try:
+
+			# Coroutine targets are driven by an event loop, which completes
+			# chunks as their calls finish.
+			if async_concurrency is not None:
+				coroutines.CoroutineRunner(
+					target_func, args_consumer, async_concurrency, complete,
+					worker_metrics
+				).run()
+
+			# Otherwise, continually run target_func on arguments from the
+			# arguments queue, in this thread, or in a pool of threads.
+			elif threads_per_process is None:
+				for item in args_consumer:
+					run_chunk(item)
+			else:
+				threads.run_pool(
+					run_chunk, args_consumer, threads_per_process, profiler)
+
+		finally:
+			if teardown_func is not None:
+				teardown_func()
+
+	# Anything that stops the worker, including SystemExit (which would
+	# silently end a thread), must not leave the queue without a consumer.
+	except BaseException:
+		error = sys.exc_info()
+		fail(None)
+		for chunk_num, chunk, keys in queue_consumer:
+			if acks is not None:
+				acks.put((chunk_num, False))
+		raise error[0], error[1], error[2]
+
+	finally:
+		if worker_metrics is not None:
+			worker_metrics.stop()
+
+		if result_writer is not None:
+			result_writer.close()
+
+		if journal_writer is not None:
+			journal_writer.close()
+
+		# Close the producer when there are no more results to put
+		if results_producer:
+			results_producer.close()
+
 
-	# Close the producer when there are no more results to put
-	if results_producer:
-		results_producer.close()
+def skip_after_abort(chunks, abort, acks=None):
+	'''
+	Yield the numbered chunks from `chunks` until `abort` is set, after which
+	the rest are consumed but skipped.  If `acks` is not None, skipped chunks
+	are acknowledged as not completed.
+	'''
+	for chunk_num, chunk, keys in chunks:
+		if not abort.is_set():
+			yield chunk_num, chunk, keys
+		elif acks is not None:
+			acks.put((chunk_num, False))
+
+
+def reducer(
+	reducer_func, results_consumer, shared=False, serializer=None, abort=None
+):
+	'''
+	Runs the callable `reducer_func` inside the reducer process, passing it
+	an iterator over the individual results found in the chunks of results 
+	consumed from `results_consumer`.  If `shared` is True, arrays among the
+	results may have been sent through shared memory (see `sharing`).  If
+	`serializer` is not None, chunks of results were serialized with it.
+
+	If a worker fails, `reducer_func` is stopped by a WorkerError raised from
+	the iterator.  If `reducer_func` fails itself, `abort` is set (if it's
+	not None), so that the workers stop, and the exception is re-raised.
+	'''
+	results = iter_results(results_consumer, serializer)
+	if shared:
+		results = (sharing.attach_result(result) for result in results)
+	try:
+		reducer_func(results)
+	except WorkerError:
+		pass
+	except Exception:
+		if abort is not None:
+			abort.set()
+		raise
+
+	# If the reducer returned early, drain the remaining results.  The 
+	# results queue can't shut down until its consumer has seen them all.
+	finally:
+		for chunk_results in results_consumer:
+			pass
+
+
+def iter_results(results_consumer, serializer=None):
+	'''
+	Yield the individual results from numbered chunks of results, which were
+	serialized with `serializer`, if it's not None.  Raises WorkerError if a
+	worker failed.
+	'''
+	for chunk_num, results in results_consumer:
+		if isinstance(results, WorkerFailure):
+			raise WorkerError('A worker failed: %s' % results.error)
+		if serializer is not None:
+			results = serializer.load_results(results)
+		for result in results:
+			yield result
 
 
 def generate_args_subset(iterable, options):
@@ -747,7 +2049,7 @@ def generate_args_subset(iterable, options):
 
 	To understand `key`, recall that each element of `iterable` is a tuple 
 	of arguments to be supplied to the target function.  `key` selects one 
-	of the arguments, and uses its sha1 hash to determine whether that
+	of the arguments, and uses its hash to determine whether that
 	particluar argument set belongs to `these_bins`.  
 
 	Ideally `key` should point to an argument whose value is unique in 
@@ -765,51 +2067,274 @@ def generate_args_subset(iterable, options):
 	packed into a length-1 tuple (except if it is iteslf a tuple, since that
 	would be ambiguous).
 	"""
+	these_bins = frozenset(options['these_bins'])
+	for key, this_bin, args in assign_bins(iterable, options, keyed=False):
+		if this_bin in these_bins:
+			yield args
 
-	# If "hash" is specified, then concatenate the string representations
-	# of each argument indexed in hash (which is a list of ints), and
-	# hash it to determine the bin.
-	if 'hash' in options:
-		for args in as_arguments(iterable):
-			hashable = ''.join([
-				str(args[i])
-				for i in options['hash'] if i in args
-			])
-			this_bin = utils.binify(hashable, options['num_bins'])
-			if this_bin in options['these_bins']:
-				yield args
+
+def generate_keyed_args_subset(iterable, options, completed=None):
+	"""
+	Like `generate_args_subset`, but yields (key, args), where the key
+	identifies the argument set (see `assign_bins`).  Argument sets whose
+	keys are in `completed` are skipped.
+	"""
+	these_bins = frozenset(options['these_bins'])
+	for key, this_bin, args in assign_bins(iterable, options):
+		if this_bin in these_bins:
+			if completed is None or key not in completed:
+				yield key, args
+
+
+def assign_bins(iterable, options, keyed=True):
+	"""
+	Generator that yields (key, bin, args) for every element of `iterable`,
+	with elements as argument sets (see `as_arguments`).  The bin is
+	determined as described in `generate_args_subset`, using the `hash`,
+	`bin_key`, or `key` options if set, and otherwise based on the element's
+	position.
+
+	The key identifies the argument set across runs.  It is the element's
+	position, except when hashing, in which case the iterable need not be
+	stable, and the key is taken from the hash.  Since that takes extra work,
+	hashing yields None as the key if `keyed` is False.
+	"""
+
+	# If "hash" or "bin_key" is specified, then hash the selected arguments,
+	# or the bin key, to determine the bin.  See the binning module.
+	if binning.uses_hashing(options):
+		for key_bin_args in binning.generate_hashed_bins(
+			as_arguments(iterable), options, keyed
+		):
+			yield key_bin_args
+
+	# If work was planned by cost, the plan designates the bin for each
+	# argument set by position.
+	elif 'plan' in options:
+		plan = planning.read_plan(options['plan'])
+		for i, args in enumerate(as_arguments(iterable)):
+			if i >= len(plan):
+				raise BinError(
+					'The arguments iterable yielded more argument sets than '
+					'when work was planned (%d)' % len(plan)
+				)
+			yield i, plan[i], args
 
 	# However, if "key" is specified, then the key'th argument designates
 	# the bin
 	elif 'key' in options:
 		for i, args in enumerate(as_arguments(iterable)):
 			try:
-				key = args[options['key']]
+				key = get_argument(args, options['key'])
 			except KeyError:
 				raise BinError(
 					'Argument %s was not found in iteration %d' 
 					% (repr(options['key']), i)
 				)
-			if key in options['these_bins']:
-				yield args
+			yield i, key, args
 
 	# By default, work is dealt around to each bin in the order that it is
 	# yielded
 	else:
 		for i, args in enumerate(as_arguments(iterable)):
-			if i % options['num_bins'] in options['these_bins']:
-				yield args
+			yield i, i % options['num_bins'], args
+
+
+def generate_dynamic_chunks(
+	iterable, lease_tracker, block_size, chunk_sizes, completed=None
+):
+	"""
+	Generator that yields (chunk, keys) for the argument sets in the blocks
+	of iterations that are claimed through `lease_tracker`.  A block is
+	`block_size` consecutive iterations.  Chunks never span blocks.  The
+	tracker is told about each chunk before it's yielded, and about each
+	block once all of its chunks have been yielded.  The keys
+	are the iteration indices, and iterations in `completed` are skipped.
+	`chunk_sizes` is a callable that returns the size of the next chunk.
+
+	Blocks are claimed as the arguments iterable is enumerated, once the
+	workers have room for them (see `leases.LeaseTracker`).  After reaching
+	the end of the iterable, this waits for other subjobs to finish their
+	blocks, and claims any whose leases expire, enumerating the iterable again
+	to get their argument sets.  If the iterable is an iterator, it can't be
+	enumerated again, so those blocks are left for a rerun.
+	"""
+	leases = lease_tracker.leases
+	block = lease_tracker.claim(0)
+	chunk, keys = [], []
+	size = chunk_sizes()
+	num_iterations = 0
+
+	for i, args in enumerate(as_arguments(iterable)):
+		num_iterations = i + 1
+		if block is None:
+			break
+
+		# When we pass the end of the block, finish it and claim another
+		this_block = i // block_size
+		if this_block > block:
+			if chunk:
+				lease_tracker.sent(block)
+				yield chunk, keys
+				chunk, keys = [], []
+			lease_tracker.emitted(block)
+			block = lease_tracker.claim(this_block)
+			if block is None:
+				break
+
+		if this_block < block or (completed is not None and i in completed):
+			continue
+
+		chunk.append(args)
+		keys.append(i)
+		if len(chunk) >= size:
+			lease_tracker.sent(block)
+			yield chunk, keys
+			chunk, keys = [], []
+			size = chunk_sizes()
+
+	# If we reached the end of the iterable, record how many blocks there are.
+	else:
+		leases.set_end(int(math.ceil(num_iterations / float(block_size))))
+
+	if block is not None:
+		if chunk:
+			lease_tracker.sent(block)
+			yield chunk, keys
+		lease_tracker.emitted(block)
+
+	if iter(iterable) is iterable:
+		return
+
+	# Wait for the blocks held by other subjobs, claiming those whose leases
+	# expire (i.e. whose subjobs died), until all of the blocks are done.
+	while True:
+		block = lease_tracker.claim(0)
+		if block is None:
+			if lease_tracker.aborted():
+				return
+			unfinished = leases.unfinished()
+			if not unfinished or set(unfinished) <= lease_tracker.in_progress():
+				return
+			time.sleep(lease_tracker.wait_seconds)
+			continue
+
+		chunk, keys = [], []
+		size = chunk_sizes()
+		start = block * block_size
+		block_args = itertools.islice(
+			enumerate(as_arguments(iterable)), start, start + block_size)
+		for i, args in block_args:
+			if completed is not None and i in completed:
+				continue
+			chunk.append(args)
+			keys.append(i)
+			if len(chunk) >= size:
+				lease_tracker.sent(block)
+				yield chunk, keys
+				chunk, keys = [], []
+				size = chunk_sizes()
+		if chunk:
+			lease_tracker.sent(block)
+			yield chunk, keys
+		lease_tracker.emitted(block)
+
+
+def generate_chunks(iterable, chunksize, timing=None):
+	"""
+	Generator that groups the elements of `iterable` into lists, so that 
+	they can be put onto the arguments queue together.  `chunksize` is either
+	the number of elements per list, or "auto", in which case each chunk is 
+	sized based on the per-call time measured so far by `timing`.
+	"""
+	chunk = []
+	size = get_chunksize(chunksize, timing)
+	for item in iterable:
+		chunk.append(item)
+		if len(chunk) >= size:
+			yield chunk
+			chunk = []
+			size = get_chunksize(chunksize, timing)
+
+	# Yield the last (partial) chunk, if any
+	if chunk:
+		yield chunk
+
+
+def get_chunksize(chunksize, timing):
+	"""
+	Resolve the size of the next chunk.  An "auto" chunksize aims for chunks
+	that take roughly AUTO_CHUNK_SECONDS to process.  Until calls have been
+	timed, chunks of one argument set are used.
+	"""
+	if chunksize != 'auto':
+		return chunksize
+
+	mean_call_time = timing.mean()
+	if mean_call_time is None:
+		return 1
+	if mean_call_time == 0:
+		return MAX_AUTO_CHUNKSIZE
+	size = int(AUTO_CHUNK_SECONDS / mean_call_time)
+	return max(1, min(size, MAX_AUTO_CHUNKSIZE))
+
+
+class CallTiming(object):
+	"""
+	Accumulates the total time spent calling the target function, and the
+	number of calls made, in shared memory so that workers can report timings
+	to the parent process.
+	"""
+
+	def __init__(self):
+		self.lock = Lock()
+		self.seconds = Value('d', 0.0, lock=False)
+		self.calls = Value('l', 0, lock=False)
+
+	def record(self, seconds, calls):
+		with self.lock:
+			self.seconds.value += seconds
+			self.calls.value += calls
+
+	def mean(self):
+		with self.lock:
+			if self.calls.value == 0:
+				return None
+			return self.seconds.value / self.calls.value
+
+
+class WorkerFailure(object):
+	"""
+	Put onto the results queue by a worker in place of a chunk's results,
+	when the worker fails.  Holds the exception, or if it can't be pickled,
+	a WorkerError describing it, and the formatted traceback.
+	"""
+
+	def __init__(self, exc_info):
+		error_type, error, tb = exc_info
+		self.traceback = ''.join(traceback.format_exception(*exc_info))
+		try:
+			pickle.loads(pickle.dumps(error, pickle.HIGHEST_PROTOCOL))
+		except Exception:
+			error = WorkerError(''.join(
+				traceback.format_exception_only(error_type, error)).strip())
+		self.error = error
 
 
 def as_arguments(iterable):
-	"""Ensure elements emerge wrapped Arguments objects."""
+	"""
+	Ensure elements emerge as argument sets: plain tuples of positional
+	arguments, or Arguments objects, if they have keyword arguments.
+	"""
 	for item in iterable:
-		if isinstance(item, Arguments):
+		if type(item) is tuple:
 			yield item
+		elif isinstance(item, Arguments):
+			yield item if item.kwargs else item.args
 		elif isinstance(item, tuple):
-			yield Arguments(*item)
+			yield tuple(item)
 		else:
-			yield Arguments(item)
+			yield (item,)
 
 
 
@@ -1,5 +1,6 @@
 import sys
 import utils
+import sharing
 import argparse
 
 class ClufArgParser(object):
@@ -49,13 +50,60 @@ class ClufArgParser(object):
 			'-a', '--args',
 			help='Alternate name for the arguments iterable.  Default is "args".'
 		)
+		parser.add_argument(
+			'-r', '--reducer',
+			help=(
+				'Name of a callable in the target module that will be given '
+				'an iterator over the return values of the target function, as '
+				'they are produced.  By default return values are discarded.  '
+				'In dispatch mode, each subjob runs its own reducer over the '
+				'results from that subjob.'
+			)
+		)
+		parser.add_argument(
+			'--setup',
+			help=(
+				'Name of a callable in the target module that is called once '
+				'in each worker process, before it starts taking work, to '
+				'load state that the target function needs.  Its return '
+				'value is available to the target function through '
+				'cluster_func.get_context().'
+			)
+		)
+		parser.add_argument(
+			'--teardown',
+			help=(
+				'Name of a callable in the target module that is called once '
+				'in each worker process, after its work is done.'
+			)
+		)
 		parser.add_argument(
 			'-q', '--queue', action='store_true', default=None,
 			help=(
-				'Enqueue the generated scripts using qsub.  This option only '
+				'Enqueue the generated scripts using qsub (or using the '
+				'backend chosen with --backend).  The job ids are recorded in '
+				'a manifest in the jobs directory.  This option only '
 				'takes effect in dispatch mode.'
 			)
 		)
+		parser.add_argument(
+			'--backend', choices=('pbs', 'slurm', 'local'),
+			help=(
+				'How subjob scripts are written and submitted: "pbs" (the '
+				'default) uses qsub, "slurm" uses sbatch, and "local" runs '
+				'the scripts on this machine.  This option only takes effect '
+				'in dispatch mode.'
+			)
+		)
+		parser.add_argument(
+			'--submit-concurrency', type=int,
+			help=(
+				'Maximum number of subjobs to submit at once.  With the '
+				'local backend, this is the number of subjobs that run at '
+				'once, and the default is 1.  Otherwise the default is 8.  '
+				'This option only takes effect in dispatch mode.'
+			)
+		)
 		parser.add_argument(
 			'-p', '--processes', type=int, help=(
 			'Number of worker processes to spawn (i.e. number of concurrent '
@@ -64,6 +112,70 @@ class ClufArgParser(object):
 			'worker processes processes.'
 			)
 		)
+		parser.add_argument(
+			'--executor', choices=('process', 'thread'),
+			help=(
+				'How workers are run: "process" (the default) runs each '
+				'worker in its own process, while "thread" runs them all as '
+				'threads of one process, and hands them argument sets '
+				'directly.  Use "thread" for targets that mostly wait on '
+				'I/O.'
+			)
+		)
+		parser.add_argument(
+			'--threads', type=int,
+			help=(
+				'Number of worker threads, when using --executor=thread.  '
+				'Default is 5 times the number of cpus.'
+			)
+		)
+		parser.add_argument(
+			'--threads-per-process', type=int,
+			help=(
+				'Run a pool of this many threads in each worker process, '
+				'for targets that release the GIL or partly wait on I/O.  '
+				'Concurrency is then --processes times this, with one copy '
+				'of the target module per process.'
+			)
+		)
+		parser.add_argument(
+			'--shared-memory', type=int, nargs='?',
+			const=sharing.DEFAULT_MIN_BYTES, metavar='MIN_BYTES',
+			help=(
+				'Send NumPy arrays of at least MIN_BYTES (default 1 MiB), '
+				'among argument sets and results, between processes through '
+				'shared memory, rather than pickling them.'
+			)
+		)
+		parser.add_argument(
+			'--serializer',
+			choices=('pickle', 'cloudpickle', 'compressed', 'bytes'),
+			help=(
+				'How chunks of argument sets and results are serialized '
+				'between processes: "pickle" uses the highest pickle '
+				'protocol, "cloudpickle" can also send lambdas and closures '
+				'(requires the cloudpickle package), "compressed" compresses '
+				'pickles with zlib, and "bytes" sends string results as they '
+				'are.  By default, the queues pickle them.'
+			)
+		)
+		parser.add_argument(
+			'--async-concurrency', type=int,
+			help=(
+				'When the target is a coroutine function, the number of '
+				'calls each worker runs at once, on its own event loop.  '
+				'Default is 100.'
+			)
+		)
+		parser.add_argument(
+			'-c', '--chunksize', help=(
+			'Number of argument sets sent to a worker process at a time.  '
+			'Larger chunks reduce the overhead of passing work to workers, '
+			'which helps when the target function runs quickly.  Set to '
+			'"auto" to choose the chunk size based on the measured time per '
+			'call.  Default is 1.'
+			)
+		)
 		parser.add_argument(
 			'-b', '--bins', 
 			help=(
@@ -126,6 +238,142 @@ class ClufArgParser(object):
 				'Set the PBS options.'
 			)
 		)
+		parser.add_argument(
+			'-J', '--job-array', action='store_true', default=None,
+			help=(
+				'Write a single script for a job array, in which each '
+				'subjob gets its bin from the array index (e.g. $PBS_ARRAYID), '
+				'instead of one script per subjob.  With -q, the job array is '
+				'submitted using a single call to qsub (or sbatch).  This '
+				'option only takes effect in dispatch mode.'
+			)
+		)
+		parser.add_argument(
+			'-M', '--materialize', action='store_true', default=None,
+			help=(
+				'Enumerate the arguments iterable once, during dispatch, and '
+				'write the argument sets for each subjob into a shard file in '
+				'the jobs directory.  Subjobs then read their own shard '
+				'instead of enumerating the whole arguments iterable.  This '
+				'option only takes effect in dispatch mode.'
+			)
+		)
+		parser.add_argument(
+			'-d', '--dynamic',
+			help=(
+				'Divide work dynamically: rather than being assigned a bin, '
+				'subjobs repeatedly claim blocks of iterations, so that fast '
+				'subjobs do more of the work.  The value should be the path '
+				'to a directory on a filesystem shared by the subjobs, which '
+				'will hold leases on the blocks, or the address of a '
+				'coordinator, like tcp://host:port.  In dispatch mode, the '
+				'value "tcp" launches a coordinator on this machine.'
+			)
+		)
+		parser.add_argument(
+			'--block-size', type=int,
+			help=(
+				'Number of iterations in each block claimed by subjobs when '
+				'dividing work dynamically.  Default is 1000.'
+			)
+		)
+		parser.add_argument(
+			'--lease-seconds', type=int,
+			help=(
+				'Number of seconds after which a subjob that stopped renewing '
+				'its lease on a block (e.g. because it died) loses it, when '
+				'dividing work dynamically.  Default is 600.'
+			)
+		)
+		parser.add_argument(
+			'--cost',
+			help=(
+				'Name of a callable in the target module that returns the '
+				'estimated cost (e.g. run time) of each argument set, when '
+				'called with the same arguments as the target function.  '
+				'Argument sets are then assigned to subjobs so that each gets '
+				'about the same total cost, rather than the same number of '
+				'argument sets.  This option only takes effect in dispatch '
+				'mode.'
+			)
+		)
+		parser.add_argument(
+			'--plan',
+			help=(
+				'Path to a plan file, written in dispatch mode with --cost, '
+				'that assigns argument sets to bins.  Subjob scripts set this '
+				'automatically.  This option only takes effect in direct mode.'
+			)
+		)
+		parser.add_argument(
+			'-R', '--resume', action='store_true', default=None,
+			help=(
+				'Record the argument sets that are completed in a journal '
+				'within the jobs directory, and skip argument sets that were '
+				'completed by earlier runs.  Use this to restart a job that '
+				'was interrupted without redoing work.  In dispatch mode, '
+				'subjobs are made to resume.'
+			)
+		)
+		parser.add_argument(
+			'-s', '--save-results', action='store_true', default=None,
+			help=(
+				'Save the return values of the target function in the jobs '
+				'directory, so that they can be collected from all subjobs '
+				'using `cluf gather`.  In dispatch mode, subjobs are made to '
+				'save their results.'
+			)
+		)
+		parser.add_argument(
+			'--metrics', action='store_true', default=None,
+			help=(
+				'Record histograms of the time taken by calls to the target '
+				'function, of the time that workers wait for work, and of the '
+				'time spent generating work, and write them to a metrics file '
+				'in the jobs directory.  Report on them using `cluf stats`.  '
+				'In dispatch mode, subjobs are made to record metrics.'
+			)
+		)
+		parser.add_argument(
+			'--progress', type=float, metavar='SECONDS',
+			help=(
+				'Report progress every SECONDS seconds: the number of '
+				'argument sets completed (out of the total, if it is known), '
+				'the throughput overall and of each worker, and the estimated '
+				'time remaining.  Reports are written to stderr.  In dispatch '
+				'mode, subjobs are made to report progress.'
+			)
+		)
+		parser.add_argument(
+			'--heartbeat', action='store_true', default=None,
+			help=(
+				'Write progress reports to a heartbeat file in the jobs '
+				'directory, replacing it with each report, instead of writing '
+				'them to stderr.  Reports are made every 30 seconds, unless '
+				'set otherwise using --progress.'
+			)
+		)
+		parser.add_argument(
+			'--profile', nargs='?', const='cprofile',
+			choices=('cprofile', 'sample'),
+			help=(
+				'Profile each worker process, and write its profile to the '
+				'jobs directory.  Merge the profiles using `cluf '
+				'profile-report`.  "cprofile" (the default) traces every '
+				'call; "sample" samples the call stack periodically, which '
+				'has less overhead.  In dispatch mode, subjobs are made to '
+				'profile their workers.'
+			)
+		)
+		parser.add_argument(
+			'-S', '--shard',
+			help=(
+				'Path to a shard file, written in dispatch mode with '
+				'--materialize, from which to read argument sets instead of '
+				'the arguments iterable.  Subjob scripts set this '
+				'automatically.  This option only takes effect in direct mode.'
+			)
+		)
 
 		# Only one of the the optional arguments that determine the argument(s)
 		# on which to base binning cannot both be set.
@@ -154,6 +402,36 @@ class ClufArgParser(object):
 				'and less error-prone.'
 			)
 		)
+		group.add_argument(
+			'--bin-key',
+			help=(
+				'Name of a callable in the target module that returns a '
+				'string identifying each argument set, when called with the '
+				'same arguments as the target function.  The string is hashed '
+				'to determine which bin the iteration belongs in.  Use this '
+				'instead of -x when the arguments are large or their string '
+				'representations are unsuitable.'
+			)
+		)
+		parser.add_argument(
+			'--hash-function', choices=('crc32', 'sha1', 'xxh64'),
+			help=(
+				'Hash function used to determine bins when hashing arguments '
+				'with -x or --bin-key.  Default is "sha1", which gives the '
+				'same bins as earlier versions of cluf.  "crc32" is much '
+				'faster.  "xxh64" requires the xxhash package.'
+			)
+		)
+		parser.add_argument(
+			'--bin-scheme', choices=('modulo', 'jump'),
+			help=(
+				'How hashes are assigned to bins when hashing arguments with '
+				'-x or --bin-key.  "modulo" (the default) takes the hash '
+				'modulo the number of bins.  "jump" uses jump consistent '
+				'hashing, so that changing the number of bins only moves '
+				'the work that needs to move.'
+			)
+		)
 
 		# The optional arguments that determine number of nodes / iterations per 
 		# node are mutually exlusive.
@@ -178,6 +456,14 @@ class ClufArgParser(object):
 				'This option can only be set on the command line.'
 			)
 		)
+		parser.add_argument(
+			'--recount', action='store_true', default=None,
+			help=(
+				'When using --iterations, count the iterations by enumerating '
+				'the arguments iterable, even if a count was cached in the '
+				'jobs directory by an earlier dispatch.'
+			)
+		)
 
 		return parser
 
@@ -229,3 +515,197 @@ class ClufArgParser(object):
 		underlying argument parser.
 		"""
 		self.parser.print_usage()
+
+
+class GatherArgParser(object):
+	'''
+	Parser for the `cluf gather` command, which collects the results saved
+	by the subjobs of a job.
+	'''
+
+	def __init__(self):
+		self.parser = self._build_parser()
+
+
+	def _build_parser(self):
+		parser = argparse.ArgumentParser(
+			prog='cluf gather',
+			description=(
+				'Collect the results saved by subjobs that were run with '
+				'--save-results.'
+			)
+		)
+		parser.add_argument(
+			'target_module',
+			help='path to the python module that contains the target function.'
+		)
+		parser.add_argument(
+			'-j', '--jobs-dir',
+			help=(
+				'Directory in which the subjobs saved their results.  Default '
+				'is the current directory.'
+			)
+		)
+		parser.add_argument(
+			'-r', '--reducer',
+			help=(
+				'Name of a callable in the target module that will be given '
+				'an iterator over the gathered results.  By default, results '
+				'are printed, one per line.'
+			)
+		)
+		parser.add_argument(
+			'-O', '--ordered', action='store_true', default=None,
+			help=(
+				'Gather results in the order of the arguments iterable.  '
+				'Results of argument sets that were run more than once are '
+				'only gathered once.  Ordering needs results to have been '
+				'saved without -x or --bin-key.'
+			)
+		)
+		parser.add_argument(
+			'-p', '--processes', type=int,
+			help=(
+				'Number of processes that read result files in parallel, when '
+				'results are not ordered.  Default is the number of cpus.'
+			)
+		)
+		return parser
+
+
+	def parse_args(self, args=sys.argv[2:]):
+		'''
+		Parses the command line arguments for the `cluf gather` command.
+		Arguments that aren't recognized are passed through to the target
+		module.
+		'''
+		parsed_args, target_cli = self.parser.parse_known_args(args)
+		parsed_args = {
+			k: v
+			for k, v in vars(parsed_args).items()
+			if v is not None
+		}
+		parsed_args['target_cli'] = [a for a in target_cli if a != '--']
+		return parsed_args
+
+
+	def print_usage(self):
+		self.parser.print_usage()
+
+
+class StatsArgParser(object):
+	'''
+	Parser for the `cluf stats` command, which reports on the metrics
+	recorded by the subjobs of a job.
+	'''
+
+	def __init__(self):
+		self.parser = self._build_parser()
+
+
+	def _build_parser(self):
+		parser = argparse.ArgumentParser(
+			prog='cluf stats',
+			description=(
+				'Report on the metrics recorded by subjobs that were run with '
+				'--metrics.'
+			)
+		)
+		parser.add_argument(
+			'target_module',
+			help='path to the python module that contains the target function.'
+		)
+		parser.add_argument(
+			'-j', '--jobs-dir',
+			help=(
+				'Directory in which the subjobs wrote their metrics.  Default '
+				'is the current directory.'
+			)
+		)
+		parser.add_argument(
+			'--json', action='store_true', default=None,
+			help='Print a summary of all subjobs together, as JSON.'
+		)
+		return parser
+
+
+	def parse_args(self, args=sys.argv[2:]):
+		'''
+		Parses the command line arguments for the `cluf stats` command.
+		'''
+		return {
+			k: v
+			for k, v in vars(self.parser.parse_args(args)).items()
+			if v is not None
+		}
+
+
+	def print_usage(self):
+		self.parser.print_usage()
+
+
+class ProfileReportArgParser(object):
+	'''
+	Parser for the `cluf profile-report` command, which merges the profiles
+	written by the subjobs of a job.
+	'''
+
+	def __init__(self):
+		self.parser = self._build_parser()
+
+
+	def _build_parser(self):
+		parser = argparse.ArgumentParser(
+			prog='cluf profile-report',
+			description=(
+				'Merge the profiles written by subjobs that were run with '
+				'--profile, and print the top functions.'
+			)
+		)
+		parser.add_argument(
+			'target_module',
+			help='path to the python module that contains the target function.'
+		)
+		parser.add_argument(
+			'-j', '--jobs-dir',
+			help=(
+				'Directory in which the subjobs wrote their profiles.  Default '
+				'is the current directory.'
+			)
+		)
+		parser.add_argument(
+			'-s', '--sort',
+			help=(
+				'How to sort functions, using any of the keys accepted by '
+				'pstats, e.g. "cumulative", "tottime", or "calls".  Default '
+				'is "cumulative".'
+			)
+		)
+		parser.add_argument(
+			'-n', '--limit', type=int,
+			help='Number of functions to print.  Default is 30.'
+		)
+		parser.add_argument(
+			'-o', '--output',
+			help=(
+				'Path at which to write the merged profile, which can be '
+				'read using pstats or other profile viewers.'
+			)
+		)
+		return parser
+
+
+	def parse_args(self, args=sys.argv[2:]):
+		'''
+		Parses the command line arguments for the `cluf profile-report`
+		command.
+		'''
+		return {
+			k: v
+			for k, v in vars(self.parser.parse_args(args)).items()
+			if v is not None
+		}
+
+
+	def print_usage(self):
+		self.parser.print_usage()
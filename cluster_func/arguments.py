@@ -1,8 +1,26 @@
+'''
+Argument sets.  Internally, and on the way to workers, an argument set is
+either a plain tuple of positional arguments, or, if it has keyword
+arguments, an Arguments object.  Plain tuples are the most compact to
+pickle, and most argument sets only have positional arguments.  Use
+`unpack` and `get_argument` to read an argument set of either form.
+'''
+
 class Arguments(object):
+
+	# No per-instance __dict__, and a compact pickle (see __reduce__), since
+	# Arguments are pickled onto the queue for every argument set.
+	__slots__ = ('args', 'kwargs')
+
 	def __init__(self, *args, **kwargs):
 		self.args = args
 		self.kwargs=kwargs
 
+	def __reduce__(self):
+		if self.kwargs:
+			return make_arguments, (self.args, self.kwargs)
+		return Arguments, self.args
+
 	def __str__(self):
 		positional_args_tokens = [repr(a) for a in self.args]
 		kwargs_tokens = ['%s=%s' % (k,repr(v)) for k,v in self.kwargs.items()]
@@ -28,3 +46,31 @@ class Arguments(object):
 
 	def __repr__(self):
 		return 'Arguments' + self.__str__()
+
+
+def make_arguments(args, kwargs):
+	'''Make an Arguments object when unpickling.'''
+	return Arguments(*args, **kwargs)
+
+
+def unpack(args):
+	'''
+	Get the positional arguments (a tuple), and keyword arguments (a dict), of
+	the argument set `args`.
+	'''
+	if type(args) is tuple:
+		return args, {}
+	return args.args, args.kwargs
+
+
+def get_argument(args, key):
+	'''
+	Get the argument of the argument set `args` at position `key`, if it's
+	an int, or else having the name `key`.  Raises KeyError if there is none.
+	'''
+	if type(args) is tuple:
+		try:
+			return args[key]
+		except (IndexError, TypeError):
+			raise KeyError(key)
+	return args[key]
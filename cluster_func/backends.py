@@ -0,0 +1,271 @@
+'''
+Submission backends, which know how to write the scheduler directives at the
+top of subjob scripts, and how to submit those scripts.  Three are provided:
+
+	- pbs: submits scripts using qsub (job arrays use a `#PBS -t` directive),
+	- slurm: submits scripts using sbatch (job arrays use an `#SBATCH --array`
+		directive),
+	- local: runs scripts on this machine, as a pool of local processes.
+
+Scheduler options are given using the `pbs_options` dict, whose keys are
+translated for SLURM.  Submissions are made concurrently, using at most
+`submit_concurrency` at a time, which, for the local backend, limits how
+many subjobs run at once.  The job IDs that are returned by the scheduler
+are recorded in a manifest in the jobs dir.
+'''
+
+import os
+import json
+import subprocess
+from multiprocessing.pool import ThreadPool
+from exceptions import OptionError
+
+DEFAULT_BACKEND = 'pbs'
+
+
+class Backend(object):
+	'''
+	Interface for submission backends.  Subclasses set:
+
+		- array_id [str] - the shell variable in which subjobs of a job array
+			find their subjob number.
+		- script_extension [str] - the file extension for subjob scripts.
+		- default_concurrency [int] - the default number of submissions
+			that are made at once.
+	'''
+
+	name = None
+	array_id = None
+	script_extension = None
+	default_concurrency = 8
+
+	def format_directives(self, job_name, stdout_path, stderr_path, options):
+		'''
+		Make the list of statements that go at the top of a subjob script.
+		When `options['job_array']` is set, the script is for a job array of
+		`options['nodes']` subjobs, and `stdout_path` and `stderr_path`
+		contain `array_id`.
+		'''
+		raise NotImplementedError
+
+	def submit(self, script_path):
+		'''Submit the script at `script_path`, returning a manifest entry.'''
+		raise NotImplementedError
+
+	def submit_array(self, script_path, num_subjobs, concurrency):
+		'''
+		Submit the job array script at `script_path`, having `num_subjobs`
+		subjobs, returning a list of manifest entries.  Entries for
+		individual subjobs have their "subjob" set.  Schedulers get the range
+		of the job array from the script's directives only, so that the script
+		can also be submitted by hand.
+		'''
+		raise NotImplementedError
+
+
+def redirect_output(stdout_path, stderr_path):
+	'''
+	Statement by which a script redirects its own stdout and stderr.  This is
+	used where the scheduler can't be told the paths, and must come before
+	the script changes directory.
+	'''
+	return 'exec >"%s" 2>"%s"' % (
+		os.path.abspath(stdout_path), os.path.abspath(stderr_path))
+
+
+def count_processors(options):
+	'''
+	Number of processors to request for a subjob, when `pbs_options` doesn't
+	give one: one per worker, i.e. `processes`, times `threads_per_process`
+	if given.  None if `processes` isn't given.
+	'''
+	if 'processes' not in options:
+		return None
+	return options['processes'] * options.get('threads_per_process', 1)
+
+
+class PBSBackend(Backend):
+
+	name = 'pbs'
+	array_id = '$PBS_ARRAYID'
+	script_extension = '.pbs'
+
+	def format_directives(self, job_name, stdout_path, stderr_path, options):
+		'''
+		The following keys may appear in `options['pbs_options']`:
+
+		- '<key>': where <key> is the name of any option specified in the form
+			-l <key>=<val>
+			examples: 'walltime', 'ppn', 'pmem', 'gpus', etc.
+		- 'stdout', 'stderr', and 'name', which have already been resolved
+			into `stdout_path`, `stderr_path`, and `job_name`.
+		* Note -- 'nodes' should not appear within pbs_options because each
+			script is intended to run on one machine.
+		'''
+		pbs_options = options['pbs_options']
+
+		# Many pbs parameters are specified using a generic statement format.
+		# Identify the parameters that need to be handled separately.
+		non_generic_params = {'ppn', 'stdout', 'stderr', 'name'}
+
+		# First format the generic parameters
+		statements = [
+			'#PBS -l %s=%s' % (k, v)
+			for k, v in pbs_options.items()
+			if k not in non_generic_params
+		]
+
+		# Next we will handle each of the non-generic parameters.
+		# We begin by specifying the number of processors.
+		if 'ppn' in pbs_options:
+			statements.append('#PBS -l nodes=1:ppn=%s' % pbs_options['ppn'])
+		elif count_processors(options) is not None:
+			statements.append(
+				'#PBS -l nodes=1:ppn=%s' % count_processors(options))
+
+		# Specify the name of the job (this is what will display, e.g., when
+		# calling qstat)
+		statements.append('#PBS -N ' + job_name)
+
+		# PBS doesn't expand variables in the stdout and stderr paths, so each
+		# subjob of a job array redirects its own output.  This must come
+		# after all of the PBS statements.
+		if options.get('job_array'):
+			statements.append('#PBS -t 0-%d' % (options['nodes'] - 1))
+			statements.append(redirect_output(stdout_path, stderr_path))
+		else:
+			statements.append('#PBS -o ' + stdout_path)
+			statements.append('#PBS -e ' + stderr_path)
+
+		return statements
+
+	def submit(self, script_path):
+		return {'job_id': subprocess.check_output(['qsub', script_path]).strip()}
+
+	def submit_array(self, script_path, num_subjobs, concurrency):
+		return [self.submit(script_path)]
+
+
+class SlurmBackend(Backend):
+
+	name = 'slurm'
+	array_id = '$SLURM_ARRAY_TASK_ID'
+	script_extension = '.slurm'
+
+	# How the keys of `pbs_options` translate into sbatch options.  Other
+	# keys are passed through as --<key>=<value>.
+	TRANSLATIONS = {
+		'walltime': 'time',
+		'ppn': 'cpus-per-task',
+		'pmem': 'mem-per-cpu',
+		'mem': 'mem',
+		'gpus': 'gres=gpu',
+	}
+
+	def format_directives(self, job_name, stdout_path, stderr_path, options):
+		pbs_options = options['pbs_options']
+		statements = []
+		for key, value in pbs_options.items():
+			if key in ('ppn', 'stdout', 'stderr', 'name'):
+				continue
+			option = self.TRANSLATIONS.get(key, key)
+			separator = ':' if '=' in option else '='
+			statements.append('#SBATCH --%s%s%s' % (option, separator, value))
+
+		# One task per subjob, using the requested number of processors
+		statements.append('#SBATCH --ntasks=1')
+		if 'ppn' in pbs_options:
+			statements.append('#SBATCH --cpus-per-task=%s' % pbs_options['ppn'])
+		elif count_processors(options) is not None:
+			statements.append(
+				'#SBATCH --cpus-per-task=%s' % count_processors(options))
+
+		statements.append('#SBATCH --job-name=' + job_name)
+		if options.get('job_array'):
+			statements.append('#SBATCH --array=0-%d' % (options['nodes'] - 1))
+			statements.append(redirect_output(stdout_path, stderr_path))
+		else:
+			statements.append('#SBATCH --output=' + stdout_path)
+			statements.append('#SBATCH --error=' + stderr_path)
+
+		return statements
+
+	def submit(self, script_path):
+		return {'job_id': self._sbatch([script_path])}
+
+	def submit_array(self, script_path, num_subjobs, concurrency):
+		return [self.submit(script_path)]
+
+	def _sbatch(self, args):
+		# With --parsable, sbatch prints "job_id[;cluster]"
+		output = subprocess.check_output(['sbatch', '--parsable'] + args)
+		return output.strip().split(';')[0]
+
+
+class LocalBackend(Backend):
+	'''
+	Runs subjob scripts with bash on this machine, at most `concurrency` at a
+	time, and waits for them to finish.  Each subjob's entry in the manifest
+	records its process id as the job id, and its exit status.
+	'''
+
+	name = 'local'
+	array_id = '$CLUF_ARRAY_ID'
+	script_extension = '.sh'
+	default_concurrency = 1
+
+	def format_directives(self, job_name, stdout_path, stderr_path, options):
+		return [redirect_output(stdout_path, stderr_path)]
+
+	def submit(self, script_path, env=None):
+		process = subprocess.Popen(['bash', script_path], env=env)
+		return {'job_id': str(process.pid), 'returncode': process.wait()}
+
+	def submit_array(self, script_path, num_subjobs, concurrency):
+		def submit_subjob(subjob):
+			env = dict(os.environ, CLUF_ARRAY_ID=str(subjob))
+			return dict(self.submit(script_path, env), subjob=subjob)
+		return run_concurrently(submit_subjob, range(num_subjobs), concurrency)
+
+
+BACKENDS = {
+	'pbs': PBSBackend,
+	'slurm': SlurmBackend,
+	'local': LocalBackend,
+}
+
+
+def get_backend(options):
+	'''Get the backend named by `options['backend']`, or the default.'''
+	name = options.get('backend', DEFAULT_BACKEND)
+	if name not in BACKENDS:
+		raise OptionError(
+			'`backend` must be one of %s.' % ', '.join(sorted(BACKENDS)))
+	return BACKENDS[name]()
+
+
+def run_concurrently(func, items, concurrency):
+	'''Apply `func` to each of `items`, `concurrency` at a time.'''
+	pool = ThreadPool(max(1, min(concurrency, len(items))))
+	try:
+		return pool.map(func, items, chunksize=1)
+	finally:
+		pool.close()
+		pool.join()
+
+
+def submit_scripts(backend, script_paths, concurrency):
+	'''
+	Submit each of the scripts at `script_paths`, making at most
+	`concurrency` submissions at once.  Returns a list of manifest entries.
+	'''
+	return run_concurrently(backend.submit, script_paths, concurrency)
+
+
+def write_manifest(path, backend, entries):
+	'''Write the manifest of submitted jobs to `path`, as JSON.'''
+	with open(path, 'w') as manifest_file:
+		json.dump(
+			{'backend': backend.name, 'jobs': entries}, manifest_file,
+			indent=1, sort_keys=True
+		)
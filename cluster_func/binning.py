@@ -0,0 +1,187 @@
+'''
+Hash-based binning, which assigns each argument set to a bin based on a
+hash of a string derived from the argument set (the "hashable").
+
+The hashable is either the concatenated string representations of the
+arguments selected by the `hash` option, or the value returned by a
+user-supplied `bin_key` callable, which is called with the same arguments as
+the target function.
+
+Several hash functions are available.  All of them are stable across
+machines and processes.  The default, sha1, is the hash used by earlier
+versions of cluster-func (see `utils.binify`), so that jobs keep assigning
+argument sets to the same bins.  crc32 is much faster, and can be chosen for
+new jobs.  xxh64 is also available if the `xxhash` package is installed.
+
+By default, an argument set's bin is its hash modulo the number of bins.
+That means that changing the number of bins moves almost every argument set
+to a different bin.  The "jump" bin scheme instead uses jump consistent
+hashing (Lamping and Veach, 2014), so that going from N to M > N bins only
+moves the (M-N)/M of argument sets that land in the new bins.
+
+When journaling (see the journal module), an argument set is identified by
+a 64-bit key derived from its hash.  Hash functions narrower than that widen
+their hash into a key, which is only done when keys are needed.
+'''
+
+import hashlib
+from zlib import crc32
+from exceptions import OptionError
+from arguments import unpack, get_argument
+import journal
+
+try:
+	import xxhash
+except ImportError:
+	xxhash = None
+
+DEFAULT_HASH_FUNCTION = 'sha1'
+DEFAULT_BIN_SCHEME = 'modulo'
+CRC_MASK = 2**32 - 1
+JUMP_MASK = 2**64 - 1
+JUMP_MULTIPLIER = 2862933555777941757
+
+
+def crc32_hash(hashable):
+	return crc32(hashable) & CRC_MASK
+
+def crc32_key(hashable, hash_value):
+	# Widen to 64 bits using the crc of the reversed hashable, which is
+	# independent of the crc of the hashable itself.
+	return hash_value << 32 | (crc32(hashable[::-1]) & CRC_MASK)
+
+def sha1_hash(hashable):
+	return int(hashlib.sha1(hashable).hexdigest(), 16)
+
+def xxh64_hash(hashable):
+	return xxhash.xxh64(hashable).intdigest()
+
+def truncated_key(hashable, hash_value):
+	return hash_value & journal.KEY_MASK
+
+
+# Maps each hash function's name to a pair of callables: one hashes the
+# hashable, the other makes a key from the hashable and its hash.
+HASH_FUNCTIONS = {
+	'crc32': (crc32_hash, crc32_key),
+	'sha1': (sha1_hash, truncated_key),
+	'xxh64': (xxh64_hash, truncated_key),
+}
+
+
+def modulo_bin(hash_value, num_bins):
+	return hash_value % num_bins
+
+def jump_bin(hash_value, num_bins):
+	'''Jump consistent hash of the low 64 bits of `hash_value`.'''
+	key = hash_value & JUMP_MASK
+	this_bin, candidate = -1, 0
+	while candidate < num_bins:
+		this_bin = candidate
+		key = (key * JUMP_MULTIPLIER + 1) & JUMP_MASK
+		candidate = int((this_bin + 1) * (float(1 << 31) / ((key >> 33) + 1)))
+	return this_bin
+
+
+BIN_SCHEMES = {
+	'modulo': modulo_bin,
+	'jump': jump_bin,
+}
+
+
+def uses_hashing(options):
+	'''Whether `options` call for binning by hashing.'''
+	return 'hash' in options or 'bin_key' in options
+
+
+def get_hash_functions(name=None):
+	'''
+	Get the (hash, key) callables for the hash function called `name`, or
+	for the default hash function if `name` is None.
+	'''
+	if name is None:
+		name = DEFAULT_HASH_FUNCTION
+	if name not in HASH_FUNCTIONS:
+		raise OptionError(
+			'`hash_function` must be one of %s.'
+			% ', '.join(sorted(HASH_FUNCTIONS))
+		)
+	if name == 'xxh64' and xxhash is None:
+		raise OptionError(
+			'The xxh64 hash function requires the `xxhash` package.')
+	return HASH_FUNCTIONS[name]
+
+
+def get_bin_func(name=None):
+	'''
+	Get the callable that maps a hash value and number of bins to a bin, for
+	the bin scheme called `name`, or for the default scheme if `name` is None.
+	'''
+	if name is None:
+		name = DEFAULT_BIN_SCHEME
+	if name not in BIN_SCHEMES:
+		raise OptionError(
+			'`bin_scheme` must be one of %s.' % ', '.join(sorted(BIN_SCHEMES)))
+	return BIN_SCHEMES[name]
+
+
+def get_hashable_func(options):
+	'''
+	Make a callable that takes an argument set and returns its hashable,
+	according to the `bin_key` or `hash` options.
+	'''
+	bin_key = options.get('bin_key')
+	if bin_key is not None:
+		def hashable(args):
+			positional, keywords = unpack(args)
+			value = bin_key(*positional, **keywords)
+			if isinstance(value, str):
+				return value
+			if isinstance(value, unicode):
+				return value.encode('utf8')
+			return str(value)
+		return hashable
+
+	# Look each selected argument up once.  Missing arguments are left out.
+	selectors = options['hash']
+
+	# Usually, a single positional argument is selected.
+	if len(selectors) == 1 and isinstance(selectors[0], int):
+		position = selectors[0]
+		def hashable(args):
+			positional, keywords = unpack(args)
+			try:
+				return str(positional[position])
+			except IndexError:
+				if position in keywords:
+					return str(keywords[position])
+				return ''
+		return hashable
+
+	def hashable(args):
+		parts = []
+		for i in selectors:
+			try:
+				parts.append(str(get_argument(args, i)))
+			except KeyError:
+				pass
+		return ''.join(parts)
+	return hashable
+
+
+def generate_hashed_bins(arguments, options, keyed=True):
+	'''
+	Generator that yields (key, bin, args) for each argument set in
+	`arguments`, where the bin is determined from the hash of the argument
+	set's hashable, using the bin scheme.  If `keyed` is False, keys are not
+	computed, and are None.
+	'''
+	hash_func, key_func = get_hash_functions(options.get('hash_function'))
+	bin_func = get_bin_func(options.get('bin_scheme'))
+	hashable_func = get_hashable_func(options)
+	num_bins = options['num_bins']
+	for args in arguments:
+		hashable = hashable_func(args)
+		hash_value = hash_func(hashable)
+		key = key_func(hashable, hash_value) if keyed else None
+		yield key, bin_func(hash_value, num_bins), args
@@ -0,0 +1,184 @@
+'''
+Support for target functions that are coroutine functions.  Rather than
+calling such a target once at a time, each worker drives many calls at once
+on an event loop of its own, up to a limit on the number of calls in flight
+(the "async concurrency").  Argument sets are taken from the worker's queue
+as calls finish and free up slots, so a worker only holds as many argument
+sets as it's working on (plus the rest of the current chunk).
+
+This needs asyncio, or, under python 2, its backport, trollius.  Coroutine
+functions for trollius are written using the `trollius.coroutine`
+decorator, and `yield From(...)`.  Neither is imported here: a coroutine
+target will already have imported one, and importing them slows down the
+start of every job.
+'''
+
+import sys
+import time
+import functools
+import collections
+from arguments import unpack
+
+DEFAULT_CONCURRENCY = 100
+
+
+def get_asyncio():
+	'''The asyncio module, or trollius, if either has been imported.'''
+	return sys.modules.get('asyncio') or sys.modules.get('trollius')
+
+
+def is_coroutine_function(func):
+	'''Whether `func` is a coroutine function.'''
+	asyncio = get_asyncio()
+	return asyncio is not None and asyncio.iscoroutinefunction(func)
+
+
+def ensure_future(coroutine, loop):
+	# Older versions of asyncio (and trollius) call this `async`.
+	asyncio = get_asyncio()
+	ensure = getattr(asyncio, 'ensure_future', None)
+	if ensure is None:
+		ensure = getattr(asyncio, 'async')
+	return ensure(coroutine, loop=loop)
+
+
+class ChunkState(object):
+	'''The results of a chunk of argument sets, as its calls finish.'''
+
+	def __init__(self, chunk_num, chunk, keys):
+		self.chunk_num = chunk_num
+		self.chunk = chunk
+		self.keys = keys
+		self.results = [None] * len(chunk)
+		self.remaining = len(chunk)
+		self.start = time.time()
+
+
+class CoroutineRunner(object):
+	'''
+	Runs the coroutine function `target_func` on the argument sets in the
+	chunks, (chunk_num, argument sets, keys), from `chunks`, with at most
+	`concurrency` calls in flight.  When all of the calls for a chunk are
+	done, `complete` is called with the chunk's number, argument sets, keys,
+	results, and the time taken.  If `worker_metrics` is not None, each call
+	is recorded in it (see `metrics.WorkerMetrics`).
+	'''
+
+	def __init__(self, target_func, chunks, concurrency, complete,
+		worker_metrics=None):
+		self.target_func = target_func
+		self.chunks = iter(chunks)
+		self.concurrency = concurrency
+		self.complete = complete
+		self.worker_metrics = worker_metrics
+
+		self.loop = None
+		self.backlog = collections.deque()
+		self.in_flight = 0
+		self.fetching = False
+		self.exhausted = False
+		self.error = None
+
+	def run(self):
+		asyncio = get_asyncio()
+		self.loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(self.loop)
+		try:
+			self.loop.call_soon(self.fill)
+			self.loop.run_forever()
+		finally:
+			self.loop.close()
+			asyncio.set_event_loop(None)
+
+		# Errors raised by the target function are re-raised here, as they
+		# would be if the target were called directly.
+		if self.error is not None:
+			raise self.error[0], self.error[1], self.error[2]
+
+	def fill(self):
+		'''
+		Start calls until the limit is reached, fetching another chunk if
+		needed.  Once all of the chunks are done, stop the loop.
+		'''
+		while self.in_flight < self.concurrency and self.backlog:
+			self.start_call(*self.backlog.popleft())
+			if self.error is not None:
+				return
+
+		if self.in_flight < self.concurrency and not self.backlog:
+			if not self.fetching and not self.exhausted:
+				# Getting a chunk may block, so do it outside the loop.
+				self.fetching = True
+				future = self.loop.run_in_executor(None, next, self.chunks, None)
+				future.add_done_callback(self.fetched)
+
+		if self.exhausted and not self.in_flight and not self.backlog:
+			self.loop.stop()
+
+	def fetched(self, future):
+		self.fetching = False
+		if self.error is not None:
+			self.loop.stop()
+			return
+		try:
+			item = future.result()
+		except Exception:
+			return self.fail()
+
+		if item is None:
+			self.exhausted = True
+		else:
+			chunk_state = ChunkState(*item)
+			if not chunk_state.chunk:
+				self.finish_chunk(chunk_state)
+			for index, args in enumerate(chunk_state.chunk):
+				self.backlog.append((chunk_state, index, args))
+		self.fill()
+
+	def start_call(self, chunk_state, index, args):
+		self.in_flight += 1
+		if self.worker_metrics is not None:
+			call_start = self.worker_metrics.begin_call()
+		else:
+			call_start = time.time()
+		positional, keywords = unpack(args)
+		try:
+			task = ensure_future(
+				self.target_func(*positional, **keywords), self.loop)
+		except Exception:
+			return self.fail()
+		task.add_done_callback(functools.partial(
+			self.finished, chunk_state, index, call_start))
+
+	def finished(self, chunk_state, index, call_start, task):
+		self.in_flight -= 1
+		if self.error is not None:
+			return
+		try:
+			chunk_state.results[index] = task.result()
+		except Exception:
+			return self.fail()
+
+		if self.worker_metrics is not None:
+			self.worker_metrics.end_call(call_start)
+
+		chunk_state.remaining -= 1
+		if chunk_state.remaining == 0:
+			self.finish_chunk(chunk_state)
+		self.fill()
+
+	def finish_chunk(self, chunk_state):
+		self.complete(
+			chunk_state.chunk_num, chunk_state.chunk, chunk_state.keys,
+			chunk_state.results, time.time() - chunk_state.start
+		)
+
+	def fail(self):
+		'''
+		Stop running, so that the exception being handled can be raised.  If
+		a chunk is being fetched, wait for it, so that nothing else is taking
+		chunks once `run` returns.
+		'''
+		self.error = sys.exc_info()
+		if not self.fetching:
+			self.loop.stop()
@@ -0,0 +1,116 @@
+'''
+Counting the arguments iterable, which is needed to work out how many nodes
+to use when the number of iterations per node is given.  Enumerating a large
+iterable can take a long time (and consumes it, if it's a generator), so
+other ways are tried first, in this order:
+
+	1. len(), or the __length_hint__ protocol,
+	2. a user-supplied `count` callable (or the name of one in the target
+		module), which takes no arguments and returns the count,
+	3. a count cached in the jobs dir by an earlier dispatch, if the target
+		module's source and its command line arguments haven't changed since.
+
+Failing those, the iterable is enumerated, and the count is cached.  The
+count only affects how many nodes are used, so a stale count doesn't cause
+work to be missed, but the cache can be ignored using the `recount` option.
+'''
+
+import os
+import sys
+import json
+import hashlib
+import itertools
+import collections
+
+
+def count_iterations(iterable, options, target_module_name=None):
+	'''
+	Count the argument sets in `iterable`, as described above.  `options`
+	may hold the `count`, `recount`, `jobs_dir`, and `target_cli` options.
+	The cache is only used if the target module can be found by its name,
+	`target_module_name`.
+	'''
+	count = get_length(iterable)
+	if count is not None:
+		return count
+
+	if options.get('count') is not None:
+		return int(options['count']())
+
+	cache_path = cache_key = None
+	if target_module_name is not None:
+		cache_key = get_cache_key(target_module_name, options)
+	if cache_key is not None:
+		cache_path = os.path.join(
+			options['jobs_dir'], target_module_name + '.count')
+		if not options.get('recount'):
+			count = read_cached_count(cache_path, cache_key)
+			if count is not None:
+				print '\tusing the count cached in %s' % cache_path
+				return count
+
+	count = enumerate_count(iterable)
+	if cache_path is not None:
+		write_cached_count(cache_path, cache_key, count)
+	return count
+
+
+def get_length(iterable):
+	'''
+	The length of `iterable` according to len() or __length_hint__, or None
+	if neither is available.
+	'''
+	try:
+		return len(iterable)
+	except TypeError:
+		pass
+	try:
+		hint = iterable.__length_hint__()
+	except (AttributeError, TypeError):
+		return None
+	return hint if hint >= 0 else None
+
+
+def enumerate_count(iterable):
+	'''Count `iterable` by enumerating it, without a python-level loop.'''
+	counter = itertools.count()
+	collections.deque(itertools.izip(iterable, counter), maxlen=0)
+	return next(counter)
+
+
+def get_cache_key(target_module_name, options):
+	'''
+	Make a key identifying the target module's source and command line
+	arguments, or return None if the module's source can't be found.
+	'''
+	module = sys.modules.get(target_module_name)
+	path = getattr(module, '__file__', None)
+	if path is None:
+		return None
+	if path.endswith(('.pyc', '.pyo')) and os.path.exists(path[:-1]):
+		path = path[:-1]
+	try:
+		with open(path, 'rb') as module_file:
+			source = module_file.read()
+	except IOError:
+		return None
+	digest = hashlib.sha1(source)
+	digest.update(json.dumps(options.get('target_cli', [])))
+	return digest.hexdigest()
+
+
+def read_cached_count(cache_path, cache_key):
+	'''The count cached at `cache_path` under `cache_key`, if any.'''
+	try:
+		with open(cache_path) as cache_file:
+			cached = json.load(cache_file)
+	except (IOError, ValueError):
+		return None
+	if cached.get('key') != cache_key:
+		return None
+	return cached.get('count')
+
+
+def write_cached_count(cache_path, cache_key, count):
+	with open(cache_path, 'w') as cache_file:
+		json.dump({'key': cache_key, 'count': count}, cache_file)
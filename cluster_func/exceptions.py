@@ -8,3 +8,14 @@ class RCFormatError(ValueError):
 
 class BinError(KeyError):
 	pass
+
+class ShardFormatError(ValueError):
+	pass
+
+class PlanFormatError(ValueError):
+	pass
+
+# Raised in direct mode when a worker (or the reducer) failed, after the
+# job has been stopped
+class WorkerError(RuntimeError):
+	pass
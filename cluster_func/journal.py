@@ -0,0 +1,152 @@
+'''
+The completion journal records which argument sets have been completed, so
+that an interrupted job can be resumed without repeating work.
+
+Each argument set is identified by a key.  Normally this is the argument
+set's position in the arguments iterable (even when it was materialized into
+a shard), but when binning by hashing, the iterable might not be stable, so
+the key is derived from the hash instead.
+
+A journal is a directory, in which each worker process appends the keys that
+it completes to its own file (named by host and process id), so that workers
+never contend for a file.  Keys are written as fixed-width 8-byte integers.
+Writes go straight to the operating system, and are fsync'd at most once
+every SYNC_SECONDS.
+'''
+
+import os
+import time
+import struct
+import socket
+import bisect
+from array import array
+
+KEY = struct.Struct('<Q')
+KEY_MASK = 2**64 - 1
+SYNC_SECONDS = 1.0
+READ_SIZE = KEY.size * 2**16
+
+
+def find_key_typecode():
+	'''
+	The array typecode for unsigned integers as wide as a key, or None if
+	there isn't one.  Python 2 has no fixed-width typecode ('L' is 4 bytes
+	on some platforms), so check the width of each candidate.
+	'''
+	for typecode in ('L', 'Q'):
+		try:
+			if array(typecode).itemsize == KEY.size:
+				return typecode
+		except ValueError:
+			pass
+	return None
+
+KEY_TYPECODE = find_key_typecode()
+
+
+class JournalWriter(object):
+	'''
+	Appends completed keys to a file of its own within the journal
+	`directory`.  The file is opened on first use, so a JournalWriter can be
+	made in a parent process and handed to worker processes.
+	'''
+
+	def __init__(self, directory):
+		self.directory = directory
+		self.fd = None
+		self.last_sync = None
+
+	def record(self, keys):
+		if self.fd is None:
+			path = os.path.join(self.directory, '%s-%d.journal' % (
+				socket.gethostname(), os.getpid()))
+			self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+			self.last_sync = time.time()
+
+		# Write the keys in one call, so a record is never split by a crash
+		# except at the very end of the file.
+		keys = list(keys)
+		os.write(self.fd, struct.pack('<%dQ' % len(keys), *keys))
+
+		if time.time() - self.last_sync > SYNC_SECONDS:
+			os.fsync(self.fd)
+			self.last_sync = time.time()
+
+	def close(self):
+		if self.fd is not None:
+			os.fsync(self.fd)
+			os.close(self.fd)
+			self.fd = None
+
+
+class IndexSet(object):
+	'''
+	Set of non-negative integer keys, which are expected to be dense (e.g.
+	iteration indices), stored as a bitmap.
+	'''
+
+	def __init__(self):
+		self.bits = bytearray()
+
+	def add(self, key):
+		byte, bit = divmod(key, 8)
+		if byte >= len(self.bits):
+			self.bits.extend('\0' * max(byte + 1 - len(self.bits), len(self.bits)))
+		self.bits[byte] |= 1 << bit
+
+	def __contains__(self, key):
+		byte, bit = divmod(key, 8)
+		return byte < len(self.bits) and bool(self.bits[byte] & (1 << bit))
+
+
+class KeySet(object):
+	'''
+	Set of sparse 64-bit keys (e.g. derived from hashes), stored as a sorted
+	array, or a sorted list if no array typecode is wide enough.
+	'''
+
+	def __init__(self):
+		self.keys = array(KEY_TYPECODE) if KEY_TYPECODE else []
+		self.is_sorted = True
+
+	def add(self, key):
+		self.keys.append(key)
+		self.is_sorted = False
+
+	def __contains__(self, key):
+		if not self.is_sorted:
+			if KEY_TYPECODE:
+				self.keys = array(KEY_TYPECODE, sorted(self.keys))
+			else:
+				self.keys.sort()
+			self.is_sorted = True
+		i = bisect.bisect_left(self.keys, key)
+		return i < len(self.keys) and self.keys[i] == key
+
+
+def load_completed(directory, hashed=False):
+	'''
+	Read all of the keys recorded in the journal `directory`.  Returns a
+	KeySet if `hashed` is True, and otherwise an IndexSet.  A partly
+	written key at the end of a file (from a worker that was killed while
+	writing) is ignored.
+	'''
+	completed = KeySet() if hashed else IndexSet()
+	if not os.path.isdir(directory):
+		return completed
+
+	for fname in os.listdir(directory):
+		if not fname.endswith('.journal'):
+			continue
+		with open(os.path.join(directory, fname), 'rb') as journal_file:
+			while True:
+				data = journal_file.read(READ_SIZE)
+				num_keys = len(data) // KEY.size
+				if num_keys == 0:
+					break
+				keys = struct.unpack(
+					'<%dQ' % num_keys, data[:num_keys * KEY.size])
+				for key in keys:
+					completed.add(key)
+
+	return completed
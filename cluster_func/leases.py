@@ -0,0 +1,567 @@
+'''
+Dynamic division of work between subjobs.  Rather than owning a fixed bin,
+subjobs repeatedly claim *blocks* of consecutive iteration indices, so that
+fast subjobs end up doing more of the work than slow ones.
+
+A subjob holds a *lease* on each block it claims, and renews its leases
+periodically.  If a subjob dies, its leases expire, and the blocks are
+claimed by other subjobs.  Once a block's argument sets have all been
+processed, it is marked done.
+
+Two interchangeable backends keep track of leases:
+
+ - LeaseDirectory, a directory on a filesystem shared by the subjobs.  Claims
+	are made by atomically creating lease files, so no locking is needed.
+
+ - CoordinatorClient, which talks to a small TCP server (see `serve`) that
+	keeps track of leases in memory.  `start_coordinator` launches one as a
+	detached process.
+
+Both provide `claim`, `renew`, `complete`, `set_end`, and `unfinished`.
+
+Subjobs only claim a block when their workers have room for more work (see
+LeaseTracker), so that a subjob that starts late still finds blocks to claim.
+Once a subjob reaches the end of the arguments iterable, it waits for the
+blocks held by others to be done, claiming any whose leases expire.
+'''
+
+import os
+import sys
+import time
+import json
+import errno
+import socket
+import threading
+import subprocess
+import SocketServer
+from Queue import Empty
+from exceptions import OptionError
+
+DEFAULT_BLOCK_SIZE = 1000
+DEFAULT_LEASE_SECONDS = 600
+TCP_PREFIX = 'tcp://'
+STOP = 'stop'
+
+# A subjob claims another block only when fewer than this many chunks per
+# worker (or per thread, or concurrent call) are waiting to be acknowledged.
+CHUNKS_PER_WORKER = 2
+
+# Once past the end of the arguments iterable, a subjob checks this often
+# (at most) for blocks whose leases have expired.
+WAIT_SECONDS = 10
+
+# While waiting for room to claim a block, check this often whether the job
+# was aborted (in which case some chunks may never be acknowledged).
+ABORT_POLL_SECONDS = 1
+
+
+def holder_id():
+	'''Identifies this process as the holder of leases.'''
+	return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def open_leases(location, lease_seconds):
+	'''
+	Get the lease backend for `location`, which is either the path to a lease
+	directory, or the address of a coordinator, as "tcp://host:port".
+	'''
+	if location.startswith(TCP_PREFIX):
+		try:
+			host, port = location[len(TCP_PREFIX):].rsplit(':', 1)
+			port = int(port)
+		except ValueError:
+			raise OptionError(
+				'The coordinator address should look like tcp://host:port, '
+				'got %s' % location
+			)
+		return CoordinatorClient(host, port)
+	return LeaseDirectory(location, lease_seconds)
+
+
+class LeaseDirectory(object):
+	'''
+	Keeps track of leases using files in `directory`:
+
+	 - `<block>.lease` exists while a subjob holds the block.  It contains the
+		holder's id, and its modification time is refreshed on renewal.
+	 - `<block>.done` exists once the block is complete.
+	 - `end` holds the number of blocks, once a subjob has found the end of
+		the arguments iterable.
+	'''
+
+	def __init__(self, directory, lease_seconds):
+		self.directory = directory
+		self.lease_seconds = lease_seconds
+		self.holder = holder_id()
+		self.held = set()
+		self.end = None
+
+		# Blocks never stop being done, so remember the ones we've seen.
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		self.done = set([
+			int(fname[:-len('.done')]) for fname in os.listdir(directory)
+			if fname.endswith('.done')
+		])
+
+	def _path(self, block, extension):
+		return os.path.join(self.directory, '%d%s' % (block, extension))
+
+	def _read_end(self):
+		if self.end is None:
+			try:
+				self.end = int(open(os.path.join(self.directory, 'end')).read())
+			except (IOError, ValueError):
+				pass
+		return self.end
+
+	def _try_create_lease(self, block):
+		try:
+			fd = os.open(
+				self._path(block, '.lease'),
+				os.O_WRONLY | os.O_CREAT | os.O_EXCL
+			)
+		except OSError as e:
+			if e.errno == errno.EEXIST:
+				return False
+			raise
+		os.write(fd, self.holder)
+		os.close(fd)
+		return True
+
+	def _expired(self, path):
+		return time.time() - os.stat(path).st_mtime >= self.lease_seconds
+
+	def _try_steal_lease(self, block):
+		'''Take over the lease on `block`, but only if it has expired.'''
+		lease_path = self._path(block, '.lease')
+		expired_path = '%s.expired.%s' % (lease_path, self.holder)
+		try:
+			if not self._expired(lease_path):
+				return False
+
+			# Only one subjob can succeed in moving the expired lease aside.
+			os.rename(lease_path, expired_path)
+		except OSError as e:
+			if e.errno == errno.ENOENT:
+				return False
+			raise
+
+		# Between checking the lease and moving it, another subjob may have
+		# stolen it, and made a fresh lease, which is what we moved.  If so,
+		# put it back (unless yet another lease has been made since).
+		if not self._expired(expired_path):
+			try:
+				os.link(expired_path, lease_path)
+			except OSError as e:
+				if e.errno != errno.EEXIST:
+					raise
+			os.remove(expired_path)
+			return False
+
+		os.remove(expired_path)
+		return self._try_create_lease(block)
+
+	def claim(self, min_block):
+		'''
+		Claim the first available block numbered `min_block` or higher.  The
+		block is returned, or None if there are no more blocks.
+		'''
+		block = min_block
+		while True:
+			end = self._read_end()
+			if end is not None and block >= end:
+				return None
+			if block not in self.done:
+				if self._try_create_lease(block) or self._try_steal_lease(block):
+
+					# A lease can be created just after the block is completed
+					# by someone else, so check that it isn't done.
+					if os.path.exists(self._path(block, '.done')):
+						os.remove(self._path(block, '.lease'))
+						self.done.add(block)
+					else:
+						self.held.add(block)
+						return block
+				elif os.path.exists(self._path(block, '.done')):
+					self.done.add(block)
+			block += 1
+
+	def renew(self):
+		'''
+		Refresh the leases held.  Leases that were lost (because they expired
+		and were claimed by another subjob) are no longer renewed.
+		'''
+		for block in list(self.held):
+			lease_path = self._path(block, '.lease')
+			try:
+				if open(lease_path).read() == self.holder:
+					os.utime(lease_path, None)
+					continue
+			except (IOError, OSError):
+				pass
+			self.held.discard(block)
+
+	def complete(self, block):
+		'''Mark `block` as done, and release the lease on it.'''
+		open(self._path(block, '.done'), 'w').close()
+		self.done.add(block)
+		if block in self.held:
+			self.held.discard(block)
+			try:
+				os.remove(self._path(block, '.lease'))
+			except OSError:
+				pass
+
+	def set_end(self, num_blocks):
+		'''Record that there are `num_blocks` blocks in total.'''
+		if self._read_end() is not None:
+			return
+		end_path = os.path.join(self.directory, 'end')
+		tmp_path = '%s.%s' % (end_path, self.holder)
+		open(tmp_path, 'w').write(str(num_blocks))
+		os.rename(tmp_path, end_path)
+		self.end = num_blocks
+
+	def unfinished(self):
+		'''
+		The blocks that aren't done yet, or None if the number of blocks isn't
+		known yet.
+		'''
+		end = self._read_end()
+		if end is None:
+			return None
+		unfinished = []
+		for block in range(end):
+			if block in self.done:
+				continue
+			if os.path.exists(self._path(block, '.done')):
+				self.done.add(block)
+				continue
+			unfinished.append(block)
+		return unfinished
+
+
+class CoordinatorClient(object):
+	'''
+	Keeps track of leases by making requests to the coordinator at `host`
+	and `port`.  Each request is one line of JSON, answered with one line of
+	JSON.
+
+	The coordinator exits a while after all of the blocks are done, so a
+	subjob that starts (or finishes) later than that can't reach it.  Once
+	the coordinator can't be reached, it's taken to be finished: there are no
+	more blocks to claim, and none unfinished.
+	'''
+
+	def __init__(self, host, port):
+		self.address = (host, port)
+		self.holder = holder_id()
+		self.gone = False
+
+	def _request(self, **request):
+		'''
+		Make `request`, and return the response, or None if the coordinator
+		can't be reached.
+		'''
+		if self.gone:
+			return None
+		request['holder'] = self.holder
+		try:
+			connection = socket.create_connection(self.address)
+			try:
+				connection_file = connection.makefile('r+')
+				connection_file.write(json.dumps(request) + '\n')
+				connection_file.flush()
+
+				# The coordinator may shut down before answering.
+				return json.loads(connection_file.readline())
+			finally:
+				connection.close()
+		except (socket.error, ValueError) as e:
+			self.gone = True
+			sys.stderr.write(
+				'The coordinator at %s%s:%d can\'t be reached (%s).  Assuming '
+				'that all blocks are done.\n'
+				% (TCP_PREFIX, self.address[0], self.address[1], e)
+			)
+			return None
+
+	def claim(self, min_block):
+		response = self._request(op='claim', min_block=min_block)
+		return None if response is None else response['block']
+
+	def renew(self):
+		self._request(op='renew')
+
+	def complete(self, block):
+		self._request(op='complete', block=block)
+
+	def set_end(self, num_blocks):
+		self._request(op='set_end', num_blocks=num_blocks)
+
+	def unfinished(self):
+		response = self._request(op='unfinished')
+		return [] if response is None else response['blocks']
+
+
+class CoordinatorState(object):
+	'''The state of a coordinator, which follows the same rules as a
+	LeaseDirectory.'''
+
+	def __init__(self, lease_seconds):
+		self.lease_seconds = lease_seconds
+		self.lock = threading.Lock()
+		self.leases = {}
+		self.done = set()
+		self.end = None
+
+		# All blocks before the frontier are done.
+		self.frontier = 0
+
+	def claim(self, holder, min_block):
+		now = time.time()
+		block = max(min_block, self.frontier)
+		while self.end is None or block < self.end:
+			lease = self.leases.get(block)
+			if block not in self.done and (lease is None or lease[1] < now):
+				self.leases[block] = (holder, now + self.lease_seconds)
+				return block
+			block += 1
+		return None
+
+	def renew(self, holder):
+		expires = time.time() + self.lease_seconds
+		for block, lease in self.leases.items():
+			if lease[0] == holder:
+				self.leases[block] = (holder, expires)
+
+	def complete(self, holder, block):
+		self.done.add(block)
+		self.leases.pop(block, None)
+		while self.frontier in self.done:
+			self.done.remove(self.frontier)
+			self.frontier += 1
+
+	def set_end(self, holder, num_blocks):
+		if self.end is None:
+			self.end = num_blocks
+
+	def unfinished(self, holder):
+		if self.end is None:
+			return None
+		return [
+			block for block in range(self.frontier, self.end)
+			if block not in self.done
+		]
+
+	def finished(self):
+		return self.end is not None and self.frontier >= self.end
+
+	def handle(self, request):
+		with self.lock:
+			op = request['op']
+			holder = request['holder']
+			if op == 'claim':
+				return {'block': self.claim(holder, request['min_block'])}
+			elif op == 'renew':
+				self.renew(holder)
+			elif op == 'complete':
+				self.complete(holder, request['block'])
+			elif op == 'set_end':
+				self.set_end(holder, request['num_blocks'])
+			elif op == 'unfinished':
+				return {'blocks': self.unfinished(holder)}
+			else:
+				return {'error': 'unknown op: %s' % op}
+			return {}
+
+
+class CoordinatorHandler(SocketServer.StreamRequestHandler):
+	def handle(self):
+		request = json.loads(self.rfile.readline())
+		response = self.server.state.handle(request)
+		self.wfile.write(json.dumps(response) + '\n')
+
+		# Once all blocks are done, the coordinator has nothing left to do.
+		# Stay up for a while, so that subjobs can find out.
+		with self.server.state.lock:
+			if self.server.state.finished() and not self.server.stopping:
+				self.server.stopping = True
+				timer = threading.Timer(
+					self.server.state.lease_seconds, self.server.shutdown)
+				# Handler threads are daemons, so the timer would be too.
+				timer.daemon = False
+				timer.start()
+
+
+class CoordinatorServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+	allow_reuse_address = True
+	daemon_threads = True
+	stopping = False
+
+
+def serve(host, port, lease_seconds):
+	'''
+	Run a coordinator on `host` and `port` (if port is 0, a free port is
+	used), until all blocks are done.  Once listening, the coordinator's
+	address is written to stdout as "tcp://host:port".
+	'''
+	server = CoordinatorServer((host, port), CoordinatorHandler)
+	server.state = CoordinatorState(lease_seconds)
+	sys.stdout.write('%s%s:%d\n' % (
+		TCP_PREFIX, socket.getfqdn(), server.server_address[1]))
+	sys.stdout.flush()
+
+	# Detach from the stdout of whoever launched us.
+	devnull = os.open(os.devnull, os.O_WRONLY)
+	os.dup2(devnull, sys.stdout.fileno())
+	server.serve_forever()
+
+
+def start_coordinator(lease_seconds, port=0):
+	'''
+	Launch a coordinator as a detached process, which outlives this one.  Its
+	address is returned.
+	'''
+	coordinator = subprocess.Popen(
+		[
+			sys.executable, '-c',
+			'from cluster_func.leases import serve; serve("", %d, %r)'
+			% (port, lease_seconds)
+		],
+		stdout=subprocess.PIPE, close_fds=True, preexec_fn=os.setsid
+	)
+	address = coordinator.stdout.readline().strip()
+	coordinator.stdout.close()
+	if not address.startswith(TCP_PREFIX):
+		raise OptionError('The coordinator failed to start.')
+	return address
+
+
+class LeaseTracker(object):
+	'''
+	Runs in the process that hands out work, keeping track of which blocks
+	have been fully processed by the workers, and renewing the leases
+	in the meantime.  Workers put (chunk number, completed) onto `acks` for
+	each chunk that they complete, or skip (because the job is being stopped).
+	A block is completed once all of its chunks have been sent (see
+	`emitted`) and acknowledged as completed.  Chunks are numbered in the
+	order that they are sent, starting from 0.
+
+	Blocks are claimed through `claim`, which waits until fewer than
+	`max_outstanding` chunks are waiting to be acknowledged (if it's not
+	None), so that a subjob doesn't hold more blocks than its workers are
+	about to work on.  Once the event `abort` is set (if it's not None), no
+	more blocks are claimed.
+	'''
+
+	def __init__(
+		self, leases, acks, lease_seconds, max_outstanding=None, abort=None
+	):
+		self.leases = leases
+		self.acks = acks
+		self.renew_seconds = lease_seconds / 3.0
+		self.wait_seconds = min(WAIT_SECONDS, self.renew_seconds)
+		self.max_outstanding = max_outstanding
+		self.abort = abort
+		self.lock = threading.Lock()
+		self.room = threading.Condition(self.lock)
+		self.chunk_blocks = {}
+		self.next_chunk_num = 0
+		self.num_outstanding = 0
+		self.outstanding = {}
+		self.emitted_blocks = set()
+		self.skipped_blocks = set()
+		self.claimed = set()
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+
+	def start(self):
+		self.thread.start()
+
+	def claim(self, min_block):
+		'''
+		Once the workers have room for more work, claim the first available
+		block numbered `min_block` or higher.  The block is returned, or None
+		if there are no more blocks available, or the job was aborted.
+		'''
+		with self.lock:
+			while (
+				self.max_outstanding is not None
+				and self.num_outstanding >= self.max_outstanding
+				and not self.aborted()
+			):
+				self.room.wait(ABORT_POLL_SECONDS)
+		if self.aborted():
+			return None
+		block = self.leases.claim(min_block)
+		if block is not None:
+			with self.lock:
+				self.claimed.add(block)
+		return block
+
+	def aborted(self):
+		return self.abort is not None and self.abort.is_set()
+
+	def in_progress(self):
+		'''The blocks claimed by this tracker that aren't completed yet.'''
+		with self.lock:
+			return set(self.claimed)
+
+	def sent(self, block):
+		'''Record that the next chunk, belonging to `block`, is being sent.'''
+		with self.lock:
+			self.chunk_blocks[self.next_chunk_num] = block
+			self.next_chunk_num += 1
+			self.num_outstanding += 1
+			self.outstanding[block] = self.outstanding.get(block, 0) + 1
+
+	def emitted(self, block):
+		'''Record that all of the chunks for `block` have been sent.'''
+		with self.lock:
+			self.emitted_blocks.add(block)
+			self._complete_if_done(block)
+
+	def _complete_if_done(self, block):
+		if block in self.skipped_blocks:
+			return
+		if block in self.emitted_blocks and not self.outstanding.get(block):
+			self.emitted_blocks.discard(block)
+			self.outstanding.pop(block, None)
+			self.claimed.discard(block)
+			self.leases.complete(block)
+
+	def run(self):
+		last_renewal = time.time()
+		while True:
+			try:
+				ack = self.acks.get(timeout=self.renew_seconds)
+			except Empty:
+				ack = None
+
+			# STOP is sent by `stop`, once the workers are finished.
+			if ack == STOP:
+				return
+
+			# Skipped chunks free up room, but their blocks are never
+			# completed.  Their leases will expire, for others to claim.
+			if ack is not None:
+				chunk_num, completed = ack
+				with self.lock:
+					block = self.chunk_blocks.pop(chunk_num)
+					self.outstanding[block] -= 1
+					self.num_outstanding -= 1
+					if not completed:
+						self.skipped_blocks.add(block)
+					self._complete_if_done(block)
+					self.room.notify_all()
+
+			if time.time() - last_renewal > self.renew_seconds:
+				self.leases.renew()
+				last_renewal = time.time()
+
+	def stop(self):
+		'''Call once the workers are finished, to process the last acks.'''
+		self.acks.put(STOP)
+		self.thread.join()
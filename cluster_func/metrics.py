@@ -0,0 +1,355 @@
+'''
+Metrics that show where the time in a direct-mode job goes: calling the
+target function, waiting for work, or generating and queueing work in the
+parent process.
+
+Durations are counted in histograms with fixed buckets, rather than being
+recorded one by one.  Bucket 0 counts durations shorter than MIN_SECONDS, and
+bucket i counts durations from MIN_SECONDS * 2**(i-1) up to MIN_SECONDS * 2**i.
+The last bucket also counts anything longer.  Histograms are kept in shared
+memory, one set per worker, so workers record into them without locking or
+messaging the parent.
+
+At the end of the job, the metrics are written to a metrics file in the jobs
+dir, as JSON:
+
+	{
+		"bins": [...], "num_bins": ..., "host": ..., "wall_seconds": ...,
+		"generate": <histogram>, "put": <histogram>,
+		"workers": [
+			{
+				"pid": ..., "calls": <histogram>, "waits": <histogram>,
+				"busy_seconds": ..., "seconds": ...
+			}, ...
+		]
+	}
+
+where each <histogram> is {"counts": [...], "total_seconds": ...}.  The
+"generate" and "put" histograms time producing each chunk of argument sets,
+and putting it onto the queue, in the parent.  For each worker, "calls" times
+each call of the target function, and "waits" times getting each chunk from
+the queue, during which the worker is idle.  "pid" is the worker's process id
+(which thread workers share).  "seconds" is the time from when the worker
+started until it finished, and "busy_seconds" is the part of that time during
+which at least one call of the target function was running.
+
+A worker's utilization is busy_seconds / seconds.  Calls overlap when a worker
+runs a pool of threads, or coroutines, so busy_seconds is the length of the
+union of the calls' intervals, rather than the sum of the call times (which is
+the "calls" histogram's total_seconds).  The utilization is therefore at most
+1, whatever the number of calls in flight, and shows how much of the time the
+worker had something to do, not how much of its capacity was used.  Metrics
+files written by earlier versions have no busy_seconds, and their utilization
+is the call time over the call and wait time instead.
+'''
+
+import os
+import json
+import math
+import time
+import socket
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+MIN_SECONDS = 1e-6
+NUM_BUCKETS = 40
+EXTENSION = '.metrics'
+
+
+class Histogram(object):
+	'''
+	Counts of durations in fixed buckets (see above), and their total, in
+	shared memory.  Only one process should record into a Histogram.
+	'''
+
+	def __init__(self):
+		self.counts = RawArray('L', NUM_BUCKETS)
+		self.total_seconds = RawValue('d', 0.0)
+
+	def record(self, seconds):
+		self.counts[get_bucket(seconds)] += 1
+		self.total_seconds.value += seconds
+
+	def as_dict(self):
+		return {
+			'counts': list(self.counts),
+			'total_seconds': self.total_seconds.value
+		}
+
+
+class WorkerMetrics(object):
+	'''
+	The histograms recorded by one worker, its busy time and running time
+	(see above), and its process id.  The worker calls `start` once it starts,
+	`begin_call` and `end_call` around each call of the target function, and
+	`stop` once it's done.  Threads sharing a WorkerMetrics must hold a lock
+	around `begin_call` and `end_call`.
+	'''
+
+	def __init__(self):
+		self.pid = RawValue('l', 0)
+		self.calls = Histogram()
+		self.waits = Histogram()
+		self.busy_seconds = RawValue('d', 0.0)
+		self.seconds = RawValue('d', 0.0)
+
+		# Only the worker's process uses these.
+		self.started = None
+		self.running = 0
+		self.busy_since = None
+
+	def start(self):
+		self.pid.value = os.getpid()
+		self.started = time.time()
+
+	def stop(self):
+		self.seconds.value = time.time() - self.started
+
+	def begin_call(self):
+		'''Note that a call has started, returning its start time.'''
+		now = time.time()
+		if not self.running:
+			self.busy_since = now
+		self.running += 1
+		return now
+
+	def end_call(self, call_start):
+		'''Note that the call started at `call_start` has finished.'''
+		now = time.time()
+		self.calls.record(now - call_start)
+		self.running -= 1
+		if not self.running:
+			self.busy_seconds.value += now - self.busy_since
+
+	def as_dict(self):
+		return {
+			'pid': self.pid.value,
+			'calls': self.calls.as_dict(),
+			'waits': self.waits.as_dict(),
+			'busy_seconds': self.busy_seconds.value,
+			'seconds': self.seconds.value,
+		}
+
+
+class JobMetrics(object):
+	'''
+	The histograms recorded by the parent process, and by each of
+	`processes` workers.
+	'''
+
+	def __init__(self, processes):
+		self.start = time.time()
+		self.generate = Histogram()
+		self.put = Histogram()
+		self.workers = [WorkerMetrics() for proc_num in range(processes)]
+
+	def as_dict(self):
+		return {
+			'host': socket.gethostname(),
+			'wall_seconds': time.time() - self.start,
+			'generate': self.generate.as_dict(),
+			'put': self.put.as_dict(),
+			'workers': [worker.as_dict() for worker in self.workers],
+		}
+
+	def write(self, path, options):
+		'''Write the metrics file to `path`, noting the job's bins.'''
+		metrics = self.as_dict()
+		metrics['bins'] = options['these_bins']
+		metrics['num_bins'] = options['num_bins']
+		with open(path, 'w') as metrics_file:
+			json.dump(metrics, metrics_file, sort_keys=True)
+
+
+def get_bucket(seconds):
+	if seconds < MIN_SECONDS:
+		return 0
+	return min(math.frexp(seconds / MIN_SECONDS)[1], NUM_BUCKETS - 1)
+
+
+def timed(iterable, histogram):
+	'''
+	Generator that yields the items of `iterable`, recording the time taken to
+	get each one in `histogram`.
+	'''
+	iterator = iter(iterable)
+	while True:
+		start = time.time()
+		try:
+			item = next(iterator)
+		except StopIteration:
+			return
+		histogram.record(time.time() - start)
+		yield item
+
+
+def read_metrics(jobs_dir, target_module_name):
+	'''
+	Read the metrics files written by the subjobs of the job whose target
+	module is called `target_module_name`, within `jobs_dir`.
+	'''
+	metrics = []
+	prefix = target_module_name + '-'
+	for fname in sorted(os.listdir(jobs_dir)):
+		if fname.startswith(prefix) and fname.endswith(EXTENSION):
+			with open(os.path.join(jobs_dir, fname)) as metrics_file:
+				metrics.append(json.load(metrics_file))
+	return metrics
+
+
+def merge(histograms):
+	'''Merge histograms given as dicts (see `Histogram.as_dict`).'''
+	merged = {'counts': [0] * NUM_BUCKETS, 'total_seconds': 0.0}
+	for histogram in histograms:
+		for i, count in enumerate(histogram['counts']):
+			merged['counts'][i] += count
+		merged['total_seconds'] += histogram['total_seconds']
+	return merged
+
+
+def quantile(histogram, q):
+	'''
+	An upper bound on the `q` quantile of the durations in `histogram`,
+	given as a dict, or None if it's empty.
+	'''
+	counts = histogram['counts']
+	total = sum(counts)
+	if total == 0:
+		return None
+	cumulative = 0
+	for i, count in enumerate(counts):
+		cumulative += count
+		if cumulative >= q * total:
+			return MIN_SECONDS * 2**i
+
+
+def get_utilization(workers):
+	'''
+	The fraction of the time of `workers`, given as dicts, during which they
+	were running the target function (see above), or None if no time was
+	recorded.
+	'''
+	if all('busy_seconds' in worker for worker in workers):
+		busy = sum(worker['busy_seconds'] for worker in workers)
+		total = sum(worker['seconds'] for worker in workers)
+	else:
+		busy = sum(worker['calls']['total_seconds'] for worker in workers)
+		total = busy + sum(
+			worker['waits']['total_seconds'] for worker in workers)
+	return busy / total if total else None
+
+
+def summarize_workers(metrics):
+	'''
+	Summarize each worker of one subjob (or of several subjobs, given as a
+	list), as a list of dicts with the subjob's host, the worker's pid, its
+	number of calls, and its utilization.
+	'''
+	if isinstance(metrics, dict):
+		metrics = [metrics]
+	return [
+		{
+			'host': subjob['host'],
+			'pid': worker.get('pid'),
+			'calls': sum(worker['calls']['counts']),
+			'utilization': get_utilization([worker]),
+		}
+		for subjob in metrics for worker in subjob['workers']
+	]
+
+
+def summarize(metrics):
+	'''
+	Summarize the metrics of one subjob (or of several subjobs, given as a
+	list), as a dict with the number of calls, quantiles of the call time,
+	the fraction of the workers' time during which they were running the
+	target function ("utilization", overall and for each worker, see above
+	and `summarize_workers`),
+	and the time the parent spent generating and putting work onto the queue.
+	'''
+	if isinstance(metrics, dict):
+		metrics = [metrics]
+	workers = [worker for subjob in metrics for worker in subjob['workers']]
+	calls = merge([worker['calls'] for worker in workers])
+	return {
+		'calls': sum(calls['counts']),
+		'mean': calls['total_seconds'] / max(1, sum(calls['counts'])),
+		'p50': quantile(calls, 0.5),
+		'p90': quantile(calls, 0.9),
+		'p99': quantile(calls, 0.99),
+		'utilization': get_utilization(workers),
+		'workers': summarize_workers(metrics),
+		'generate_seconds': sum(m['generate']['total_seconds'] for m in metrics),
+		'put_seconds': sum(m['put']['total_seconds'] for m in metrics),
+		'wall_seconds': max(m['wall_seconds'] for m in metrics),
+	}
+
+
+def format_utilization(utilization):
+	if utilization is None:
+		return '-'
+	return '%.0f%%' % (100 * utilization)
+
+
+def format_seconds(seconds):
+	if seconds is None:
+		return '-'
+	if seconds < 1e-3:
+		return '%.0fus' % (seconds * 1e6)
+	if seconds < 1:
+		return '%.1fms' % (seconds * 1e3)
+	return '%.1fs' % seconds
+
+
+def format_report(metrics):
+	'''
+	Format a report on the metrics of several subjobs, with a line for each
+	subjob, a line for all of them together, the utilization of each worker,
+	and the histogram of call times.
+	'''
+	header = '%-12s %10s %9s %9s %9s %9s %6s %9s %9s %9s' % (
+		'bins', 'calls', 'mean', 'p50', 'p90', 'p99', 'util', 'generate',
+		'put', 'wall')
+	lines = [header]
+	rows = [
+		('%s/%d' % (','.join(map(str, m['bins'])), m['num_bins']), summarize(m))
+		for m in metrics
+	]
+	rows.append(('all', summarize(metrics)))
+	for label, summary in rows:
+		lines.append('%-12s %10d %9s %9s %9s %9s %6s %9s %9s %9s' % (
+			label, summary['calls'], format_seconds(summary['mean']),
+			format_seconds(summary['p50']), format_seconds(summary['p90']),
+			format_seconds(summary['p99']),
+			format_utilization(summary['utilization']),
+			format_seconds(summary['generate_seconds']),
+			format_seconds(summary['put_seconds']),
+			format_seconds(summary['wall_seconds']),
+		))
+
+	# Show each worker's utilization, to find workers that were starved (or
+	# hosts that were slow).
+	lines.append('')
+	lines.append('%-12s %-24s %10s %6s' % ('bins', 'worker', 'calls', 'util'))
+	for label, subjob in zip([label for label, summary in rows], metrics):
+		for worker in summarize_workers(subjob):
+			lines.append('%-12s %-24s %10d %6s' % (
+				label, '%s:%s' % (worker['host'], worker['pid'] or '-'),
+				worker['calls'], format_utilization(worker['utilization'])
+			))
+
+	# Show the non-empty part of the histogram of all call times.
+	calls = merge([
+		worker['calls'] for subjob in metrics for worker in subjob['workers']])
+	counts = calls['counts']
+	nonzero = [i for i, count in enumerate(counts) if count]
+	if nonzero:
+		lines.append('')
+		lines.append('call times:')
+		peak = max(counts)
+		for i in range(nonzero[0], nonzero[-1] + 1):
+			lines.append('  < %9s %10d %s' % (
+				format_seconds(MIN_SECONDS * 2**i), counts[i],
+				'#' * int(math.ceil(40.0 * counts[i] / peak))
+			))
+
+	return '\n'.join(lines)
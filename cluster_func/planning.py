@@ -0,0 +1,89 @@
+'''
+Cost-weighted bin assignment.  When argument sets take very different
+amounts of time, dealing them out in turn leaves some bins with far more work
+than others.  Instead, dispatch can call a user-supplied `cost` callable on
+each argument set, and plan an assignment in which each bin gets about the
+same total estimated cost, using the greedy "longest processing time first"
+rule: argument sets are taken in order of decreasing cost, and each is put
+in the bin with the least total cost so far.
+
+The plan is written to a plan file, which holds the bin of each argument
+set, by position, so the arguments iterable needs to be stable (as for the
+default binning):
+
+	MAGIC <width><bin>...		(one bin for each argument set)
+
+where the width is the number of bytes in each bin ('2' or '4'), and bins
+are unsigned integers, in the byte order of the machine that planned the job.
+'''
+
+import os
+import heapq
+from array import array
+from exceptions import PlanFormatError
+from arguments import unpack
+
+MAGIC = 'CLUFPLN2'
+
+
+def find_typecode(width):
+	'''
+	The array typecode for unsigned integers `width` bytes wide.  Their
+	widths differ between platforms, so check the width of each candidate.
+	'''
+	for typecode in ('H', 'I', 'L'):
+		if array(typecode).itemsize == width:
+			return typecode
+	raise PlanFormatError('No array typecode is %d bytes wide' % width)
+
+
+def generate_costs(arguments, cost_func):
+	'''
+	Generator that yields the estimated cost of each argument set in
+	`arguments`, by calling `cost_func` with the same arguments as the target
+	function.
+	'''
+	for args in arguments:
+		positional, keywords = unpack(args)
+		cost = float(cost_func(*positional, **keywords))
+		if cost < 0:
+			raise ValueError('Costs must not be negative, got %s' % cost)
+		yield cost
+
+
+def plan_bins(costs, num_bins):
+	'''
+	Assign each of the `costs` to one of `num_bins` bins, so that the bins'
+	total costs are about equal.  Returns an array, whose i-th element is the
+	bin for the i-th cost, along with a list of the total cost of each bin.
+	'''
+	plan = array(find_typecode(2 if num_bins <= 2**16 else 4), [0]) * len(costs)
+	totals = [(0.0, this_bin) for this_bin in range(num_bins)]
+	for i in sorted(xrange(len(costs)), key=costs.__getitem__, reverse=True):
+		total, this_bin = totals[0]
+		plan[i] = this_bin
+		heapq.heapreplace(totals, (total + costs[i], this_bin))
+
+	return plan, [total for total, this_bin in sorted(totals, key=lambda t: t[1])]
+
+
+def write_plan(path, plan):
+	'''Write the `plan` array made by `plan_bins` to a plan file at `path`.'''
+	with open(path, 'wb') as plan_file:
+		plan_file.write(MAGIC + str(plan.itemsize))
+		plan.tofile(plan_file)
+
+
+def read_plan(path):
+	'''Read the plan array from the plan file at `path`.'''
+	with open(path, 'rb') as plan_file:
+		header = plan_file.read(len(MAGIC) + 1)
+		if (
+			len(header) != len(MAGIC) + 1 or header[:len(MAGIC)] != MAGIC
+			or header[-1] not in '24'
+		):
+			raise PlanFormatError('%s is not a plan file' % path)
+		plan = array(find_typecode(int(header[-1])))
+		num_entries = (os.path.getsize(path) - len(header)) // plan.itemsize
+		plan.fromfile(plan_file, num_entries)
+	return plan
@@ -0,0 +1,159 @@
+'''
+Profiling the workers of a direct-mode job.  Each worker process is run
+under a profiler, and writes its profile to a file of its own in a profile
+directory in the jobs dir, named by host, process id, and thread id.  The
+files can be merged, across workers and subjobs, using pstats.
+
+Two kinds of profiler are available:
+
+	- cprofile: cProfile, which traces every function call.  It's exact,
+		but it slows down targets that make many small calls.
+	- sample: a sampling profiler, which records the call stack every
+		SAMPLE_SECONDS of cpu time.  Its overhead is low enough to use on
+		long runs, but functions that take little time may be missed.
+
+Samples are converted into the same format as cProfile's, so that both can
+be read using pstats.  For sampled profiles, time is estimated from the
+number of samples, and "calls" counts the samples in which a function
+appears.
+'''
+
+import os
+import sys
+import signal
+import socket
+import marshal
+import threading
+import cProfile
+import pstats
+
+PROFILERS = ('cprofile', 'sample')
+SAMPLE_SECONDS = 0.005
+EXTENSION = '.profile'
+
+
+class Profiler(object):
+	'''
+	Runs functions in the current process (or thread) under the profiler
+	called `kind`, and writes the profile into `directory`.
+	'''
+
+	def __init__(self, kind, directory):
+		self.kind = kind
+		self.directory = directory
+
+	def run(self, func, *args):
+		path = os.path.join(self.directory, '%s-%d-%d.prof' % (
+			socket.gethostname(), os.getpid(), threading.current_thread().ident))
+		profiler = (
+			SamplingProfiler() if self.kind == 'sample' else cProfile.Profile())
+		profiler.enable()
+		try:
+			return func(*args)
+		finally:
+			profiler.disable()
+			profiler.dump_stats(path)
+
+
+class SamplingProfiler(object):
+	'''
+	Records the call stack of the main thread every `interval` seconds of
+	cpu time, using a profiling timer.  Has the same interface as
+	cProfile.Profile, as far as it's used here.
+	'''
+
+	def __init__(self, interval=SAMPLE_SECONDS):
+		self.interval = interval
+		self.samples = {}
+		self.base = None
+
+	def sample(self, signum, frame):
+		# Only frames above the one that enabled profiling are recorded.
+		stack = []
+		while frame is not None and frame is not self.base:
+			code = frame.f_code
+			stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+			frame = frame.f_back
+		stack = tuple(stack)
+		self.samples[stack] = self.samples.get(stack, 0) + 1
+
+	def enable(self):
+		self.base = sys._getframe(1)
+		signal.signal(signal.SIGPROF, self.sample)
+
+		# Restart system calls interrupted by the timer, rather than failing
+		# them (e.g. while the worker reads from a queue).
+		signal.siginterrupt(signal.SIGPROF, False)
+		signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+	def disable(self):
+		signal.setitimer(signal.ITIMER_PROF, 0, 0)
+		signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+	def get_stats(self):
+		'''
+		Convert the samples into a dict like that used by pstats, mapping
+		each function to (primitive calls, calls, own time, cumulative time,
+		callers).
+		'''
+		stats = {}
+		callers = {}
+		for stack, count in self.samples.iteritems():
+			seconds = count * self.interval
+			for i, func in enumerate(stack):
+				if func in stack[:i]:
+					continue
+				entry = stats.setdefault(func, [0, 0, 0.0, 0.0])
+				entry[0] += count
+				entry[1] += count
+				entry[3] += seconds
+				if i == 0:
+					entry[2] += seconds
+				if i + 1 < len(stack):
+					caller = callers.setdefault(func, {}).setdefault(
+						stack[i+1], [0, 0, 0.0, 0.0])
+					caller[0] += count
+					caller[1] += count
+					caller[3] += seconds
+					if i == 0:
+						caller[2] += seconds
+
+		return dict(
+			(func, tuple(entry) + ({
+				caller: tuple(value)
+				for caller, value in callers.get(func, {}).iteritems()
+			},))
+			for func, entry in stats.iteritems()
+		)
+
+	def dump_stats(self, path):
+		with open(path, 'wb') as profile_file:
+			marshal.dump(self.get_stats(), profile_file)
+
+
+def find_profiles(jobs_dir, target_module_name):
+	'''
+	List the profiles written by all subjobs of the job whose target module
+	is called `target_module_name`, within `jobs_dir`.
+	'''
+	paths = []
+	prefix = target_module_name + '-'
+	for dirname in sorted(os.listdir(jobs_dir)):
+		directory = os.path.join(jobs_dir, dirname)
+		if not (
+			dirname.startswith(prefix) and dirname.endswith(EXTENSION)
+			and os.path.isdir(directory)
+		):
+			continue
+		for fname in sorted(os.listdir(directory)):
+			if fname.endswith('.prof'):
+				paths.append(os.path.join(directory, fname))
+	return paths
+
+
+def merge_profiles(paths, stream=sys.stdout):
+	'''Merge the profiles at `paths` into one pstats.Stats.'''
+	stats = pstats.Stats(paths[0], stream=stream)
+	for path in paths[1:]:
+		stats.add(path)
+	return stats
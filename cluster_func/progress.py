@@ -0,0 +1,149 @@
+'''
+Live progress reporting for direct-mode jobs.  Each worker counts the
+argument sets it completes in a counter of its own, in shared memory, and a
+monitor thread in the parent process reads the counters periodically, and
+reports:
+
+	- the number of completed argument sets, out of the total (if known),
+	- the throughput, over the last WINDOW_SECONDS,
+	- the throughput of each worker, over the same window, and
+	- the estimated time remaining (if the total is known).
+
+Reports are written to stderr, or, to a heartbeat file, which is replaced by
+each report, as JSON.  A heartbeat file that stops being updated means that
+the subjob has stalled or died.
+'''
+
+import os
+import sys
+import json
+import time
+import threading
+import collections
+from multiprocessing.sharedctypes import RawValue
+
+DEFAULT_INTERVAL = 30.0
+WINDOW_SECONDS = 60.0
+
+
+class ProgressMonitor(threading.Thread):
+	'''
+	Thread that reports the progress counted in `counters` (one per worker)
+	every `interval` seconds, until stopped.  If `heartbeat_path` is given,
+	reports are written there, instead of to stderr.  `total` is the number
+	of argument sets in the job, or None if it isn't known.
+	'''
+
+	def __init__(self, processes, interval, total=None, heartbeat_path=None):
+		super(ProgressMonitor, self).__init__()
+		self.daemon = True
+		self.counters = [RawValue('L', 0) for proc_num in range(processes)]
+		self.interval = interval
+		self.total = total
+		self.heartbeat_path = heartbeat_path
+		self.start_time = time.time()
+		self.snapshots = collections.deque()
+		self.stopped = threading.Event()
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			self.report()
+
+	def stop(self):
+		'''Stop reporting, after making a final report.'''
+		self.stopped.set()
+		self.join()
+		self.report()
+
+	def snapshot(self):
+		'''
+		Take the counts, and remember them, dropping counts older than the
+		window (except the one marking its start).
+		'''
+		now = time.time()
+		counts = [counter.value for counter in self.counters]
+		self.snapshots.append((now, counts))
+		while (
+			len(self.snapshots) > 2
+			and now - self.snapshots[1][0] >= WINDOW_SECONDS
+		):
+			self.snapshots.popleft()
+		return now, counts
+
+	def get_progress(self):
+		'''
+		Make a dict describing progress: the time, number completed, total,
+		overall and per-worker rates (per second), and the ETA in seconds.
+		'''
+		now, counts = self.snapshot()
+		then, then_counts = self.snapshots[0]
+		if then == now:
+			then, then_counts = self.start_time, [0] * len(counts)
+		elapsed = max(now - then, 1e-9)
+
+		worker_rates = [
+			(count - then_count) / elapsed
+			for count, then_count in zip(counts, then_counts)
+		]
+		rate = sum(worker_rates)
+		completed = sum(counts)
+		eta = None
+		if self.total is not None and rate > 0:
+			eta = max(0, self.total - completed) / rate
+
+		return {
+			'time': now,
+			'elapsed_seconds': now - self.start_time,
+			'completed': completed,
+			'total': self.total,
+			'rate': rate,
+			'worker_rates': worker_rates,
+			'eta_seconds': eta,
+		}
+
+	def report(self):
+		progress = self.get_progress()
+		if self.heartbeat_path is not None:
+			write_heartbeat(self.heartbeat_path, progress)
+		else:
+			sys.stderr.write(format_progress(progress) + '\n')
+			sys.stderr.flush()
+
+
+def write_heartbeat(path, progress):
+	'''
+	Replace the heartbeat file at `path` with `progress`, atomically, so that
+	readers never see a partly written file.
+	'''
+	temp_path = path + '.tmp'
+	with open(temp_path, 'w') as heartbeat_file:
+		json.dump(progress, heartbeat_file, sort_keys=True)
+	os.rename(temp_path, path)
+
+
+def format_duration(seconds):
+	minutes, seconds = divmod(int(seconds), 60)
+	hours, minutes = divmod(minutes, 60)
+	if hours:
+		return '%dh%02dm' % (hours, minutes)
+	if minutes:
+		return '%dm%02ds' % (minutes, seconds)
+	return '%ds' % seconds
+
+
+def format_progress(progress):
+	'''Format `progress`, made by ProgressMonitor.get_progress, as a line.'''
+	if progress['total'] is None:
+		completed = '%d done' % progress['completed']
+	else:
+		completed = '%d/%d (%.1f%%)' % (
+			progress['completed'], progress['total'],
+			100.0 * progress['completed'] / max(1, progress['total'])
+		)
+	eta = progress['eta_seconds']
+	return 'cluf: %s  %.1f/s  eta %s  elapsed %s  workers: %s' % (
+		completed, progress['rate'],
+		'-' if eta is None else format_duration(eta),
+		format_duration(progress['elapsed_seconds']),
+		' '.join('%.1f' % rate for rate in progress['worker_rates'])
+	)
@@ -0,0 +1,251 @@
+'''
+Saving the return values of the target function, so that the results of the
+subjobs of a dispatched job can be gathered afterwards.
+
+Like the journal, results are kept in a directory in the jobs dir, in which
+each worker process appends to its own file (named by host and process id).
+Each result is written as a record:
+
+	<key><length><pickled return value>
+
+where the key is a fixed-width 8-byte integer identifying the argument set
+(as in the journal), and the length is the 4-byte length of the pickle.  A
+chunk's records are written in one call, so a record is never split by a
+crash except at the very end of the file, where it is ignored.
+
+Keys are the position of the argument set in the arguments iterable (also
+when argument sets were materialized into shards), except when binning by
+hashing, when they're derived from the hash.  So gathering results in order
+only gives the original iteration order when not hashing.
+'''
+
+import os
+import mmap
+import heapq
+import socket
+import struct
+import cPickle as pickle
+from multiprocessing import Process
+from iterable_queue import IterableQueue
+
+HEADER = struct.Struct('<QI')
+EXTENSION = '.results'
+
+# When gathering results without ordering, readers send values to the parent
+# in batches of BATCH_SIZE, and at most MAX_BATCHES batches are waiting at any
+# time, so that memory use doesn't depend on the number of results.
+BATCH_SIZE = 256
+MAX_BATCHES = 64
+
+
+class ResultWriter(object):
+	'''
+	Appends results to a file of its own within the results `directory`.
+	The file is opened on first use, so a ResultWriter can be made in a
+	parent process and handed to worker processes.
+	'''
+
+	def __init__(self, directory):
+		self.directory = directory
+		self.fd = None
+
+	def record(self, keys, results):
+		if self.fd is None:
+			path = os.path.join(self.directory, '%s-%d%s' % (
+				socket.gethostname(), os.getpid(), EXTENSION))
+			self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+
+		records = []
+		for key, result in zip(keys, results):
+			value = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+			records.append(HEADER.pack(key, len(value)))
+			records.append(value)
+		os.write(self.fd, ''.join(records))
+
+	def close(self):
+		if self.fd is not None:
+			os.fsync(self.fd)
+			os.close(self.fd)
+			self.fd = None
+
+
+def find_result_files(jobs_dir, target_module_name):
+	'''
+	List the result files written by all subjobs of the job whose target
+	module is called `target_module_name`, within `jobs_dir`.
+	'''
+	paths = []
+	prefix = target_module_name + '-'
+	for dirname in sorted(os.listdir(jobs_dir)):
+		directory = os.path.join(jobs_dir, dirname)
+		if not (
+			dirname.startswith(prefix) and dirname.endswith(EXTENSION)
+			and os.path.isdir(directory)
+		):
+			continue
+		for fname in sorted(os.listdir(directory)):
+			if fname.endswith(EXTENSION):
+				paths.append(os.path.join(directory, fname))
+	return paths
+
+
+def open_records(path):
+	'''
+	Map the result file at `path` into memory, returning the map, or None if
+	the file is empty.
+	'''
+	with open(path, 'rb') as results_file:
+		if os.fstat(results_file.fileno()).st_size == 0:
+			return None
+		return mmap.mmap(results_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def generate_offsets(records):
+	'''
+	Generator that yields (key, offset, length) for each complete record in
+	the mapped result file `records`, without unpickling any values.
+	'''
+	if records is None:
+		return
+	offset = 0
+	end = len(records)
+	while offset + HEADER.size <= end:
+		key, length = HEADER.unpack_from(records, offset)
+		offset += HEADER.size
+		if offset + length > end:
+			break
+		yield key, offset, length
+		offset += length
+
+
+def sort_offsets(records):
+	'''
+	List (key, offset, length) for each complete record in the mapped result
+	file `records`, in order of their keys.  Workers usually write results in
+	order, but if they didn't, only the keys and offsets of the records are
+	sorted, not the values.  Records with the same key stay in the order they
+	were written.
+	'''
+	offsets = list(generate_offsets(records))
+	if any(offsets[i][0] > offsets[i+1][0] for i in xrange(len(offsets)-1)):
+		offsets.sort()
+	return offsets
+
+
+def read_results(path, ordered=False):
+	'''
+	Generator that yields (key, value) for each result in the result file at
+	`path`.  If `ordered` is True, results are yielded in order of their keys.
+	'''
+	records = open_records(path)
+	if ordered:
+		offsets = sort_offsets(records)
+	else:
+		offsets = generate_offsets(records)
+	for key, offset, length in offsets:
+		yield key, pickle.loads(records[offset:offset+length])
+	if records is not None:
+		records.close()
+
+
+def merge_ordered(paths):
+	'''
+	Generator that yields the values in all of the result files at `paths`,
+	in order of their keys.  Argument sets that were run more than once (e.g.
+	when a job was resumed, or a dynamic block was taken over) have several
+	results; only the first is yielded: the first written to the first file
+	(in the order of `paths`) that has one.  Records are merged by key,
+	file and position, so values are never compared, and only the values
+	yielded are unpickled.
+	'''
+	all_records = [open_records(path) for path in paths]
+	merged = heapq.merge(*[
+		number_offsets(file_num, records)
+		for file_num, records in enumerate(all_records)
+	])
+	last_key = None
+	for key, file_num, record_num, offset, length in merged:
+		if key == last_key:
+			continue
+		last_key = key
+		records = all_records[file_num]
+		yield pickle.loads(records[offset:offset+length])
+	for records in all_records:
+		if records is not None:
+			records.close()
+
+
+def number_offsets(file_num, records):
+	'''
+	Generator that yields (key, `file_num`, record number, offset, length)
+	for each complete record in the mapped result file `records`, in order of
+	their keys.
+	'''
+	for record_num, (key, offset, length) in enumerate(sort_offsets(records)):
+		yield key, file_num, record_num, offset, length
+
+
+def merge_unordered(paths, processes):
+	'''
+	Generator that yields the values in all of the result files at `paths`,
+	in no particular order.  The files are read in parallel by `processes`
+	reader processes.
+	'''
+	paths_queue = IterableQueue()
+	values_queue = IterableQueue(MAX_BATCHES)
+
+	reader_procs = []
+	for proc_num in range(max(1, min(processes, len(paths)))):
+		proc = Process(
+			target=reader,
+			args=(paths_queue.get_consumer(), values_queue.get_producer())
+		)
+		proc.start()
+		reader_procs.append(proc)
+
+	values_consumer = values_queue.get_consumer()
+	values_queue.close()
+
+	paths_producer = paths_queue.get_producer()
+	paths_queue.close()
+	for path in paths:
+		paths_producer.put(path)
+	paths_producer.close()
+
+	for batch in values_consumer:
+		for value in batch:
+			yield value
+
+	for proc in reader_procs:
+		proc.join()
+
+
+def reader(paths_consumer, values_producer):
+	'''
+	Reads the result files whose paths come from `paths_consumer`, and puts
+	their values onto `values_producer` in batches.
+	'''
+	batch = []
+	for path in paths_consumer:
+		for key, value in read_results(path):
+			batch.append(value)
+			if len(batch) >= BATCH_SIZE:
+				values_producer.put(batch)
+				batch = []
+	if batch:
+		values_producer.put(batch)
+	values_producer.close()
+
+
+def gather(jobs_dir, target_module_name, ordered=False, processes=1):
+	'''
+	Generator that yields the saved results of all subjobs of the job whose
+	target module is called `target_module_name`, from `jobs_dir`.  See
+	`merge_ordered` and `merge_unordered`.
+	'''
+	paths = find_result_files(jobs_dir, target_module_name)
+	if not paths:
+		return iter([])
+	if ordered:
+		return merge_ordered(paths)
+	return merge_unordered(paths, processes)
@@ -0,0 +1,117 @@
+'''
+Serializers for the chunks of argument sets and results that are sent
+between processes in direct mode.  By default, the queues pickle chunks
+themselves.  When a serializer is chosen, chunks are serialized into a
+string before being queued, and deserialized by the worker (or reducer) that
+receives them.  The serializers are:
+
+	- pickle: cPickle, using its highest protocol.
+	- cloudpickle: cloudpickle (if installed), which can also pickle lambdas,
+		closures, and functions defined interactively, by value.
+	- compressed: pickle, compressed with zlib.  This trades cpu time for
+		fewer bytes, which helps for large, compressible argument sets or
+		results.
+	- bytes: for targets that return strings (bytes).  Results are sent as
+		they are, framed by their lengths, without being pickled.  Argument
+		sets are pickled.
+'''
+
+import zlib
+import struct
+import cPickle as pickle
+from exceptions import OptionError
+
+COMPRESSION_LEVEL = 1
+LENGTH = struct.Struct('<Q')
+
+
+class Serializer(object):
+	'''
+	Serializes chunks of argument sets (`dumps` and `loads`) and lists of
+	results (`dump_results` and `load_results`) as strings.
+	'''
+
+	def dumps(self, obj):
+		return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+	def loads(self, data):
+		return pickle.loads(data)
+
+	def dump_results(self, results):
+		return self.dumps(results)
+
+	def load_results(self, data):
+		return self.loads(data)
+
+
+class CloudPickleSerializer(Serializer):
+
+	def __init__(self):
+		try:
+			import cloudpickle
+		except ImportError:
+			raise OptionError(
+				'The cloudpickle serializer requires the `cloudpickle` '
+				'package.'
+			)
+		self.cloudpickle = cloudpickle
+
+	def dumps(self, obj):
+		return self.cloudpickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+
+class CompressedSerializer(Serializer):
+
+	def dumps(self, obj):
+		return zlib.compress(
+			pickle.dumps(obj, pickle.HIGHEST_PROTOCOL), COMPRESSION_LEVEL)
+
+	def loads(self, data):
+		return pickle.loads(zlib.decompress(data))
+
+
+class BytesSerializer(Serializer):
+	'''
+	Sends results, which must be strings, as their lengths followed by the
+	strings themselves, all in one string.  The number of results and their
+	lengths are fixed-width 8-byte integers.
+	'''
+
+	def dump_results(self, results):
+		for result in results:
+			if not isinstance(result, str):
+				raise TypeError(
+					'The bytes serializer requires the target to return '
+					'strings, got %s.' % type(result).__name__
+				)
+		lengths = [len(result) for result in results]
+		return ''.join(
+			[struct.pack('<%dQ' % (len(results) + 1), len(results), *lengths)]
+			+ results
+		)
+
+	def load_results(self, data):
+		num_results, = LENGTH.unpack_from(data)
+		start = LENGTH.size * (num_results + 1)
+		lengths = struct.unpack_from('<%dQ' % num_results, data, LENGTH.size)
+		results = []
+		for length in lengths:
+			results.append(data[start:start + length])
+			start += length
+		return results
+
+
+SERIALIZERS = {
+	'pickle': Serializer,
+	'cloudpickle': CloudPickleSerializer,
+	'compressed': CompressedSerializer,
+	'bytes': BytesSerializer,
+}
+
+
+def get_serializer(name):
+	'''Make the serializer called `name`.'''
+	if name not in SERIALIZERS:
+		raise OptionError(
+			'`serializer` must be one of %s.' % ', '.join(sorted(SERIALIZERS)))
+	return SERIALIZERS[name]()
@@ -0,0 +1,223 @@
+'''
+Shard files hold materialized argument sets, so that the arguments iterable
+only needs to be enumerated once, during dispatch, rather than once by every
+subjob.  Each subjob then reads only the shard holding its own bin.
+
+A shard file consists of a header, a sequence of length-prefixed pickled
+records, a fixed-width index holding the offset and key of each record, and a
+footer that locates the index:
+
+	MAGIC
+	<record length><pickled record>		(repeated for each record)
+	<record offset><record key>			(repeated for each record)
+	<index offset><number of records>MAGIC
+
+The key identifies the argument set in the whole job, as when argument sets
+aren't materialized (see `assign_bins`), so that journals and saved results
+use the same keys either way.
+
+Shard files are read through mmap, so any record can be loaded without
+deserializing the records before it, and without reading the whole file
+into memory.  That lets worker processes be handed small ShardSlice objects,
+which identify a range of records, rather than the argument sets themselves.
+'''
+
+import os
+import mmap
+import struct
+import cPickle as pickle
+from exceptions import BinError, ShardFormatError
+
+MAGIC = 'CLUFSHD2'
+LENGTH = struct.Struct('<I')
+ENTRY = struct.Struct('<QQ')
+FOOTER = struct.Struct('<QQ%ds' % len(MAGIC))
+
+
+class ShardWriter(object):
+	'''
+	Writes records to a new shard file at `path`.  Must be closed to write
+	the index, after which the shard can be read.
+	'''
+
+	def __init__(self, path):
+		self.path = path
+		self.shard_file = open(path, 'wb')
+		self.shard_file.write(MAGIC)
+		self.offset = len(MAGIC)
+		self.index = bytearray()
+		self.num_records = 0
+
+	def write(self, item, key=None):
+		'''Write `item`, whose key is its position in the shard by default.'''
+		if key is None:
+			key = self.num_records
+		record = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+		self.index.extend(ENTRY.pack(self.offset, key))
+		self.shard_file.write(LENGTH.pack(len(record)))
+		self.shard_file.write(record)
+		self.offset += LENGTH.size + len(record)
+		self.num_records += 1
+
+	def close(self):
+		if self.shard_file.closed:
+			return
+		self.shard_file.write(self.index)
+		self.shard_file.write(FOOTER.pack(self.offset, self.num_records, MAGIC))
+		self.shard_file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+class ShardReader(object):
+	'''
+	Provides random access to the records in the shard file at `path`.
+	Supports len(), indexing, and iteration.  The key of each record is
+	given by `key`.
+	'''
+
+	def __init__(self, path):
+		self.path = path
+		with open(path, 'rb') as shard_file:
+			self.mmap = mmap.mmap(
+				shard_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		# Locate the index using the footer, validating the file as we go.
+		if len(self.mmap) < len(MAGIC) + FOOTER.size:
+			raise ShardFormatError('%s is too short to be a shard' % path)
+		self.index_offset, self.num_records, magic = FOOTER.unpack_from(
+			self.mmap, len(self.mmap) - FOOTER.size)
+		if self.mmap[:len(MAGIC)] != MAGIC or magic != MAGIC:
+			raise ShardFormatError('%s is not a shard' % path)
+
+	def __len__(self):
+		return self.num_records
+
+	def _entry(self, k):
+		if k < 0:
+			k += self.num_records
+		if not 0 <= k < self.num_records:
+			raise IndexError('shard record index out of range')
+		return ENTRY.unpack_from(self.mmap, self.index_offset + k * ENTRY.size)
+
+	def key(self, k):
+		'''The key of the `k`th record.'''
+		return self._entry(k)[1]
+
+	def __getitem__(self, k):
+		offset, key = self._entry(k)
+		length, = LENGTH.unpack_from(self.mmap, offset)
+		start = offset + LENGTH.size
+		return pickle.loads(self.mmap[start:start + length])
+
+	def __iter__(self):
+		for k in xrange(self.num_records):
+			yield self[k]
+
+	def close(self):
+		self.mmap.close()
+
+
+class ShardSlice(object):
+	'''
+	A picklable reference to the records of the shard at `path` whose 
+	positions are given by `indices` (usually an xrange).  Iterating it 
+	yields the records, which are read directly from the shard by whichever
+	process does the iterating.
+	'''
+
+	def __init__(self, path, indices):
+		self.path = path
+		self.indices = indices
+
+	def __len__(self):
+		return len(self.indices)
+
+	def __iter__(self):
+		reader = get_reader(self.path)
+		for k in self.indices:
+			yield reader[k]
+
+
+# Readers are opened once per process and reused by every ShardSlice.
+_READERS = {}
+def get_reader(path):
+	'''Get the (cached) ShardReader for `path` in this process.'''
+	key = (os.getpid(), path)
+	if key not in _READERS:
+		_READERS[key] = ShardReader(path)
+	return _READERS[key]
+
+
+def write_shard(path, iterable):
+	'''
+	Write every element of `iterable` to a shard file at `path`.  The number
+	of elements written is returned.
+	'''
+	with ShardWriter(path) as writer:
+		for item in iterable:
+			writer.write(item)
+	return writer.num_records
+
+
+def write_shards(paths, binned_items):
+	'''
+	Write the (key, bin, item) triples yielded by `binned_items` into a set of
+	shard files, one per bin.  `paths` is a list whose i-th element is the
+	path for bin i.  The number of items written to each bin is returned as a
+	list.
+	'''
+	writers = [ShardWriter(path) for path in paths]
+	try:
+		for key, this_bin, item in binned_items:
+			if not isinstance(this_bin, (int, long)) or not (
+				0 <= this_bin < len(paths)
+			):
+				raise BinError(
+					'Bin %s is not between 0 and %d'
+					% (repr(this_bin), len(paths) - 1)
+				)
+			writers[this_bin].write(item, key)
+	finally:
+		for writer in writers:
+			writer.close()
+
+	return [writer.num_records for writer in writers]
+
+
+def read_shard(path):
+	'''Open the shard file at `path` for reading.'''
+	return ShardReader(path)
+
+
+def generate_slices(reader, chunk_sizes, completed=None):
+	'''
+	Generator that divides the records of the shard opened by `reader` into
+	consecutive ShardSlices.  `chunk_sizes` is a callable that returns the
+	size of the next slice.  Records whose keys are in `completed` are left
+	out.
+	'''
+	if completed is None:
+		start = 0
+		while start < len(reader):
+			stop = min(start + chunk_sizes(), len(reader))
+			yield ShardSlice(reader.path, xrange(start, stop))
+			start = stop
+		return
+
+	indices = []
+	size = chunk_sizes()
+	for k in xrange(len(reader)):
+		if reader.key(k) in completed:
+			continue
+		indices.append(k)
+		if len(indices) >= size:
+			yield ShardSlice(reader.path, indices)
+			indices = []
+			size = chunk_sizes()
+	if indices:
+		yield ShardSlice(reader.path, indices)
@@ -0,0 +1,187 @@
+'''
+Passing large NumPy arrays between processes through shared memory.  Rather
+than pickling an array onto a queue (which copies it into the queue, and
+again out of it), the array is copied once into a shared memory segment, and
+only a small descriptor, a SharedArray, is sent in its place.  The process
+that receives the descriptor maps the segment, and gets an array backed
+directly by it.
+
+Segments are files in a directory of their own, in /dev/shm (or the
+temporary directory, where there is no /dev/shm).  Each segment's file is
+removed as soon as it has been mapped by the receiving process, so that its
+memory is freed once the array is no longer used.  Segments that were never
+received (e.g. because a worker died) are removed along with the directory
+when the job ends, and directories left behind by jobs that were killed are
+removed by the next job to run on the same machine.
+
+Only arrays that are positional or keyword arguments, or that are results
+(or elements of results that are tuples or lists), are shared.  NumPy isn't
+imported here: arrays can only be found if the target module imported it.
+'''
+
+import os
+import sys
+import mmap
+import errno
+import shutil
+import atexit
+import tempfile
+import itertools
+from arguments import Arguments, unpack
+
+DEFAULT_MIN_BYTES = 2**20
+SHM_DIR = '/dev/shm'
+PREFIX = 'cluf-'
+
+
+def get_numpy():
+	'''The numpy module, if it has been imported.'''
+	return sys.modules.get('numpy')
+
+
+class SharedArray(object):
+	'''
+	Describes an array of dtype `dtype` and shape `shape`, held in the shared
+	memory segment at `path`.  Sent in place of the array.
+	'''
+
+	def __init__(self, path, dtype, shape):
+		self.path = path
+		self.dtype = dtype
+		self.shape = shape
+
+	def attach(self):
+		'''
+		Map the segment, and remove its file, returning an array backed by
+		the segment.
+		'''
+		with open(self.path, 'r+b') as segment_file:
+			buf = mmap.mmap(segment_file.fileno(), 0)
+		os.remove(self.path)
+		return get_numpy().ndarray(self.shape, self.dtype, buffer=buf)
+
+
+class Sharer(object):
+	'''
+	Moves arrays of at least `min_bytes` into shared memory segments, in a
+	directory that is removed when this process exits (or when `close` is
+	called).  Processes forked after the Sharer is made share its directory.
+	'''
+
+	def __init__(self, min_bytes=DEFAULT_MIN_BYTES):
+		self.min_bytes = min_bytes
+		self.directory = make_directory()
+		self.segment_nums = itertools.count()
+		atexit.register(self.close)
+
+	def share(self, value):
+		'''
+		If `value` is an array of at least `min_bytes`, copy it into a
+		segment, and return a SharedArray for it.  Otherwise return `value`.
+		'''
+		numpy = get_numpy()
+		if (
+			numpy is None or not isinstance(value, numpy.ndarray)
+			or value.nbytes < self.min_bytes or value.dtype.hasobject
+		):
+			return value
+
+		path = os.path.join(self.directory, '%d-%d' % (
+			os.getpid(), next(self.segment_nums)))
+		with open(path, 'w+b') as segment_file:
+			segment_file.truncate(value.nbytes)
+			buf = mmap.mmap(segment_file.fileno(), value.nbytes)
+		shared = numpy.ndarray(value.shape, value.dtype, buffer=buf)
+		shared[...] = value
+		del shared
+		buf.close()
+		return SharedArray(path, value.dtype, value.shape)
+
+	def share_chunk(self, chunk):
+		'''Share the large arrays among the argument sets in `chunk`.'''
+		if get_numpy() is None:
+			return chunk
+		return [share_arguments(self.share, args) for args in chunk]
+
+	def share_results(self, results):
+		'''Share the large arrays among `results`.'''
+		if get_numpy() is None:
+			return results
+		return [share_within(self.share, result) for result in results]
+
+	def close(self):
+		shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def attach(value):
+	'''If `value` is a SharedArray, get its array.  Otherwise return `value`.'''
+	if isinstance(value, SharedArray):
+		return value.attach()
+	return value
+
+
+def attach_chunk(chunk):
+	'''Get the arrays for the SharedArrays among the argument sets in `chunk`.'''
+	attached = []
+	for args in chunk:
+		positional, keywords = unpack(args)
+		if any(
+			isinstance(value, SharedArray)
+			for value in itertools.chain(positional, keywords.itervalues())
+		):
+			args = share_arguments(attach, args)
+		attached.append(args)
+	return attached
+
+
+def attach_result(result):
+	'''Get the arrays for the SharedArrays in `result`.'''
+	return share_within(attach, result)
+
+
+def share_arguments(func, args):
+	'''Apply `func` to each argument of the argument set `args`.'''
+	if type(args) is tuple:
+		return tuple(func(arg) for arg in args)
+	return Arguments(
+		*[func(arg) for arg in args.args],
+		**dict((key, func(value)) for key, value in args.kwargs.iteritems())
+	)
+
+
+def share_within(func, result):
+	'''Apply `func` to `result`, or to its elements, if it's a tuple or list.'''
+	if type(result) in (tuple, list):
+		return type(result)(func(value) for value in result)
+	return func(result)
+
+
+def make_directory():
+	'''
+	Make a directory for this process's segments, after removing any left
+	behind by processes that have died.
+	'''
+	base = SHM_DIR if os.path.isdir(SHM_DIR) else tempfile.gettempdir()
+	remove_stale_directories(base)
+	return tempfile.mkdtemp(prefix='%s%d-' % (PREFIX, os.getpid()), dir=base)
+
+
+def remove_stale_directories(base):
+	for dirname in os.listdir(base):
+		if not dirname.startswith(PREFIX):
+			continue
+		try:
+			pid = int(dirname[len(PREFIX):].split('-')[0])
+		except ValueError:
+			continue
+		if not is_alive(pid):
+			shutil.rmtree(os.path.join(base, dirname), ignore_errors=True)
+
+
+def is_alive(pid):
+	'''Whether the process `pid` exists (on this machine).'''
+	try:
+		os.kill(pid, 0)
+	except OSError, e:
+		return e.errno != errno.ESRCH
+	return True
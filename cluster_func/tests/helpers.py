@@ -0,0 +1,74 @@
+'''
+Fixtures shared by the tests.  Workers and reducers run in processes of their
+own, so what they see is recorded in files, in a temporary directory made for
+each test by JobTestCase.
+'''
+
+import os
+import ast
+import shutil
+import tempfile
+import unittest
+
+# Workers record their calls as files in this directory.
+CALLS_DIR = None
+
+# The reducer writes what it saw here.
+REDUCED_PATH = None
+
+
+class JobTestCase(unittest.TestCase):
+	'''
+	Makes a temporary directory, `temp_dir`, for each test, in which workers
+	record their calls, and reducers record what they see.
+	'''
+
+	def setUp(self):
+		global CALLS_DIR, REDUCED_PATH
+		self.temp_dir = tempfile.mkdtemp()
+		CALLS_DIR = os.path.join(self.temp_dir, 'calls')
+		os.mkdir(CALLS_DIR)
+		REDUCED_PATH = os.path.join(self.temp_dir, 'reduced')
+
+	def tearDown(self):
+		shutil.rmtree(self.temp_dir)
+
+
+def record_call(name):
+	'''Record a call named `name`, adding to the count of calls so named.'''
+	open(os.path.join(CALLS_DIR, str(name)), 'a').write('x')
+
+
+def record(i):
+	'''Target that records a call named after its argument.'''
+	record_call(i)
+	return i
+
+
+def count_calls(parse=int):
+	'''
+	Map the name of each call recorded, as read by `parse`, to the number of
+	times it was made.
+	'''
+	return dict(
+		(parse(fname), len(open(os.path.join(CALLS_DIR, fname)).read()))
+		for fname in os.listdir(CALLS_DIR)
+	)
+
+
+def write_results(results):
+	'''Reducer that records the repr of each result, one per line.'''
+	with open(REDUCED_PATH, 'w') as reduced_file:
+		for result in results:
+			reduced_file.write('%r\n' % (result,))
+
+
+def read_reduced():
+	'''The results recorded by `write_results`, in the order they were seen.'''
+	with open(REDUCED_PATH) as reduced_file:
+		return [ast.literal_eval(line) for line in reduced_file]
+
+
+def was_reduced():
+	'''Whether the reducer recorded anything.'''
+	return os.path.exists(REDUCED_PATH)
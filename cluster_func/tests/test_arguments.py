@@ -0,0 +1,96 @@
+'''
+Tests for argument sets (see the `arguments` module), and for reading them
+from the arguments iterable.
+'''
+
+import pickle
+import unittest
+import collections
+from cluster_func import run_direct, Arguments
+from cluster_func.arguments import unpack, get_argument
+from cluster_func._cf import as_arguments, assign_bins
+from cluster_func.exceptions import BinError
+from helpers import JobTestCase, write_results, read_reduced
+
+Point = collections.namedtuple('Point', 'x y')
+
+
+def describe(a, b=0, c=0):
+	return a, b, c
+
+
+class TestArgumentSets(unittest.TestCase):
+
+	def test_elements_become_argument_sets(self):
+		with_keywords = Arguments(1, b=2)
+		argument_sets = list(as_arguments([
+			(1, 2), Point(3, 4), Arguments(5, 6), with_keywords, 7, 'ab']))
+		self.assertEqual(argument_sets[:3], [(1, 2), (3, 4), (5, 6)])
+		self.assertIs(argument_sets[3], with_keywords)
+		self.assertEqual(argument_sets[4:], [(7,), ('ab',)])
+
+		# Only plain tuples are passed on as tuples.
+		self.assertIs(type(argument_sets[1]), tuple)
+		self.assertIs(type(argument_sets[2]), tuple)
+
+	def test_unpack(self):
+		self.assertEqual(unpack((1, 2)), ((1, 2), {}))
+		self.assertEqual(unpack(Arguments(1, b=2)), ((1,), {'b': 2}))
+
+	def test_get_argument(self):
+		self.assertEqual(get_argument((1, 2), 1), 2)
+		self.assertEqual(get_argument(Arguments(1, b=2), 0), 1)
+		self.assertEqual(get_argument(Arguments(1, b=2), 'b'), 2)
+		for args, key in [((1, 2), 2), ((1, 2), 'b'), (Arguments(1), 'b')]:
+			with self.assertRaises(KeyError):
+				get_argument(args, key)
+
+	def test_arguments_are_compact(self):
+		arguments = Arguments(1, 2)
+		self.assertFalse(hasattr(arguments, '__dict__'))
+		self.assertNotIn('kwargs', pickle.dumps(arguments, 2))
+
+		restored = pickle.loads(pickle.dumps(arguments, 2))
+		self.assertEqual((restored.args, restored.kwargs), ((1, 2), {}))
+		restored = pickle.loads(pickle.dumps(Arguments(1, b=2), 2))
+		self.assertEqual((restored.args, restored.kwargs), ((1,), {'b': 2}))
+
+	def test_arguments_can_be_indexed(self):
+		arguments = Arguments(1, b=2)
+		self.assertEqual((arguments[0], arguments['b']), (1, 2))
+		self.assertIn('b', arguments)
+		self.assertNotIn(1, arguments)
+		self.assertEqual(repr(arguments), 'Arguments(1, b=2)')
+
+
+class TestKeyBinning(unittest.TestCase):
+
+	def bins(self, iterable, key):
+		return [
+			this_bin for i, this_bin, args
+			in assign_bins(iterable, {'key': key, 'num_bins': 3})
+		]
+
+	def test_positional_and_named_keys(self):
+		# The key argument designates the bin.
+		self.assertEqual(self.bins([(2, 'a'), (1, 'b')], 0), [2, 1])
+		self.assertEqual(
+			self.bins([Arguments(0, b=1), Arguments(0, b=2)], 'b'), [1, 2])
+
+	def test_missing_key(self):
+		with self.assertRaises(BinError):
+			self.bins([(1,)], 'b')
+
+
+class TestDirectArguments(JobTestCase):
+
+	def test_each_form_reaches_the_target(self):
+		run_direct(describe, [
+			1, (2, 3), Point(4, 5), Arguments(6, c=7), Arguments(8, 9)
+		], write_results, {'processes': 2})
+		self.assertEqual(sorted(read_reduced()), [
+			(1, 0, 0), (2, 3, 0), (4, 5, 0), (6, 0, 7), (8, 9, 0)])
+
+
+if __name__ == '__main__':
+	unittest.main()
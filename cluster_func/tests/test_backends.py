@@ -0,0 +1,115 @@
+'''
+Tests for the submission backends (see the `backends` module).  Schedulers
+are stood in for by scripts, put first on the PATH, that record how they
+were called.
+'''
+
+import os
+import json
+import stat
+import shutil
+import tempfile
+import unittest
+from cluster_func import backends
+from cluster_func.exceptions import OptionError
+
+FAKE_SCHEDULER = '''#!/bin/sh
+echo "$@" >> "%s"
+echo 123.server
+'''
+
+
+class TestBackends(unittest.TestCase):
+
+	def setUp(self):
+		self.temp_dir = tempfile.mkdtemp()
+		self.calls_path = os.path.join(self.temp_dir, 'calls')
+		for command in ('qsub', 'sbatch'):
+			path = os.path.join(self.temp_dir, command)
+			open(path, 'w').write(FAKE_SCHEDULER % self.calls_path)
+			os.chmod(path, stat.S_IRWXU)
+		self.path = os.environ['PATH']
+		os.environ['PATH'] = self.temp_dir + os.pathsep + self.path
+		self.script_path = os.path.join(self.temp_dir, 'job-array-4.sh')
+		open(self.script_path, 'w').write(
+			'echo $CLUF_ARRAY_ID >> "%s"\n' % self.calls_path)
+
+	def tearDown(self):
+		os.environ['PATH'] = self.path
+		shutil.rmtree(self.temp_dir)
+
+	def read_calls(self):
+		return open(self.calls_path).read().split('\n')[:-1]
+
+	def directives(self, name):
+		options = {'pbs_options': {}, 'job_array': True, 'nodes': 4}
+		return backends.BACKENDS[name]().format_directives(
+			'job', 'out', 'err', options)
+
+	def test_pbs_array_range_is_given_once(self):
+		self.assertIn('#PBS -t 0-3', self.directives('pbs'))
+		entries = backends.PBSBackend().submit_array(self.script_path, 4, 1)
+		self.assertEqual(entries, [{'job_id': '123.server'}])
+		self.assertEqual(self.read_calls(), [self.script_path])
+
+	def test_slurm_array_range_is_given_once(self):
+		self.assertIn('#SBATCH --array=0-3', self.directives('slurm'))
+		entries = backends.SlurmBackend().submit_array(self.script_path, 4, 1)
+		self.assertEqual(entries, [{'job_id': '123.server'}])
+		self.assertEqual(
+			self.read_calls(), ['--parsable %s' % self.script_path])
+
+	def test_local_array_runs_each_subjob(self):
+		entries = backends.LocalBackend().submit_array(self.script_path, 4, 2)
+		self.assertEqual(
+			sorted(entry['subjob'] for entry in entries), range(4))
+		self.assertEqual(
+			set(entry['returncode'] for entry in entries), set([0]))
+		self.assertEqual(sorted(self.read_calls()), ['0', '1', '2', '3'])
+
+	def test_separate_subjobs_get_output_directives(self):
+		directives = backends.PBSBackend().format_directives(
+			'job', 'out', 'err', {'pbs_options': {'walltime': '1:00:00'},
+			'processes': 4, 'threads_per_process': 2})
+		self.assertEqual(sorted(directives), sorted([
+			'#PBS -l walltime=1:00:00', '#PBS -l nodes=1:ppn=8',
+			'#PBS -N job', '#PBS -o out', '#PBS -e err'
+		]))
+
+	def test_scripts_are_submitted_concurrently(self):
+		script_paths = [
+			os.path.join(self.temp_dir, 'job-%d.pbs' % i) for i in range(20)]
+		entries = backends.submit_scripts(
+			backends.PBSBackend(), script_paths, 4)
+		self.assertEqual(entries, [{'job_id': '123.server'}] * 20)
+		self.assertEqual(sorted(self.read_calls()), sorted(script_paths))
+
+	def test_slurm_translates_pbs_options(self):
+		directives = backends.SlurmBackend().format_directives(
+			'job', 'out', 'err', {'pbs_options': {
+				'walltime': '1:00:00', 'pmem': '2gb', 'gpus': 1,
+				'partition': 'fast'
+			}, 'processes': 3})
+		self.assertEqual(sorted(directives), sorted([
+			'#SBATCH --time=1:00:00', '#SBATCH --mem-per-cpu=2gb',
+			'#SBATCH --gres=gpu:1', '#SBATCH --partition=fast',
+			'#SBATCH --ntasks=1', '#SBATCH --cpus-per-task=3',
+			'#SBATCH --job-name=job', '#SBATCH --output=out',
+			'#SBATCH --error=err'
+		]))
+
+	def test_manifest(self):
+		path = os.path.join(self.temp_dir, 'job.manifest')
+		entries = [{'job_id': '1', 'subjob': 0}]
+		backends.write_manifest(path, backends.SlurmBackend(), entries)
+		self.assertEqual(
+			json.load(open(path)), {'backend': 'slurm', 'jobs': entries})
+
+	def test_unknown_backend(self):
+		self.assertEqual(backends.get_backend({}).name, 'pbs')
+		with self.assertRaises(OptionError):
+			backends.get_backend({'backend': 'condor'})
+
+
+if __name__ == '__main__':
+	unittest.main()
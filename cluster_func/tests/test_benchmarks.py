@@ -0,0 +1,75 @@
+'''
+Tests that the benchmark suite (see benchmarks/run.py) runs, on few items.
+'''
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))))
+RUN_PATH = os.path.join(REPO_DIR, 'benchmarks', 'run.py')
+SCALE = 0.01
+
+
+def run_benchmarks(*args):
+	return subprocess.check_output([sys.executable, RUN_PATH] + list(args))
+
+
+class TestBenchmarks(unittest.TestCase):
+
+	def setUp(self):
+		self.temp_dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.temp_dir)
+
+	def run_case(self, name):
+		output = run_benchmarks('--case', name, '--scale', str(SCALE))
+		result = json.loads(output.strip().splitlines()[-1])
+		self.assertEqual(result['name'], name)
+		self.assertGreater(result['items'], 0)
+		self.assertGreater(result['items_per_sec'], 0)
+		self.assertGreater(result['peak_rss_kb'], 0)
+		return result
+
+	def test_direct_cases(self):
+		for name in ('direct_noop', 'direct_noop_chunked', 'direct_echo'):
+			result = self.run_case(name)
+			self.assertIn('overhead_us', result)
+		self.assertIn('bytes_per_sec', self.run_case('serializer_bytes'))
+
+	def test_binning_cases(self):
+		for name in (
+			'binning_order', 'binning_key', 'binning_plan',
+			'binning_hash_crc32', 'binning_hash_jump', 'binify'
+		):
+			self.assertEqual(self.run_case(name)['items'], 2000)
+
+	def test_dispatch_cases(self):
+		for name in ('dispatch_scripts', 'dispatch_job_array'):
+			self.assertEqual(self.run_case(name)['items'], 2)
+
+	def test_results_are_saved_and_compared(self):
+		first_path = os.path.join(self.temp_dir, 'first.json')
+		second_path = os.path.join(self.temp_dir, 'second.json')
+		run_benchmarks('-q', '-k', 'binify', '-o', first_path)
+		output = run_benchmarks(
+			'-q', '-k', 'binify', '-o', second_path, '--compare', first_path)
+
+		results = json.load(open(second_path))
+		self.assertEqual(results['scale'], 0.1)
+		self.assertEqual(
+			[result['name'] for result in results['results']], ['binify'])
+		comparison = output.split('\n\n')[-1].strip().split('\n')
+		self.assertEqual(comparison[0].split()[0], 'benchmark')
+		self.assertEqual(comparison[1].split()[0], 'binify')
+		self.assertTrue(comparison[1].endswith('%'))
+
+
+if __name__ == '__main__':
+	unittest.main()
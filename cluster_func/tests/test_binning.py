@@ -0,0 +1,149 @@
+'''
+Tests for binning argument sets by hashing (see the `binning` module).
+'''
+
+import unittest
+from zlib import crc32
+from cluster_func import run_direct, binning, utils
+from cluster_func.exceptions import OptionError
+from helpers import JobTestCase, record_call, count_calls
+
+
+def record_name(name, size=0):
+	record_call(name)
+
+
+def first_letter(name, size=0):
+	return name[0]
+
+
+def hashed_bins(arguments, **options):
+	options.setdefault('hash', [0])
+	options.setdefault('num_bins', 4)
+	return list(binning.generate_hashed_bins(arguments, options))
+
+
+class TestHashing(unittest.TestCase):
+
+	def test_sha1_is_the_default_and_matches_binify(self):
+		# Jobs keep the bins that earlier versions gave them.
+		arguments = [('item-%d' % i,) for i in range(100)]
+		for hash_function in (None, 'sha1'):
+			options = {'num_bins': 7}
+			if hash_function is not None:
+				options['hash_function'] = hash_function
+			for key, this_bin, args in hashed_bins(arguments, **options):
+				self.assertEqual(this_bin, utils.binify(args[0], 7))
+				self.assertTrue(0 <= key < 2**64)
+
+	def test_crc32(self):
+		[(key, this_bin, args)] = hashed_bins(
+			[('abc',)], hash_function='crc32')
+		self.assertEqual(this_bin, (crc32('abc') & 0xffffffff) % 4)
+		self.assertEqual(key >> 32, crc32('abc') & 0xffffffff)
+		self.assertEqual(key & 0xffffffff, crc32('cba') & 0xffffffff)
+		self.assertEqual(args, ('abc',))
+
+	def test_bins_are_balanced(self):
+		arguments = [('item-%d' % i,) for i in range(4000)]
+		counts = [0] * 4
+		for key, this_bin, args in hashed_bins(arguments):
+			counts[this_bin] += 1
+		for count in counts:
+			self.assertTrue(900 < count < 1100, counts)
+
+	def test_selected_arguments_are_hashed(self):
+		# Only the selected arguments matter.  Their string forms are joined.
+		first = hashed_bins([('a', 1, 'z')], hash=[0, 2], num_bins=1000)
+		second = hashed_bins([('a', 2, 'z')], hash=[0, 2], num_bins=1000)
+		self.assertEqual(first[0][:2], second[0][:2])
+		self.assertEqual(first[0][1], utils.binify('az', 1000))
+
+	def test_keys_can_be_skipped(self):
+		options = {'hash': [0], 'num_bins': 2}
+		for key, this_bin, args in binning.generate_hashed_bins(
+			[('a',), ('b',)], options, keyed=False
+		):
+			self.assertEqual(key, None)
+
+	def test_bin_key(self):
+		arguments = [('apple', 1), ('avocado', 2), ('banana', 3)]
+		bins = [this_bin for key, this_bin, args in hashed_bins(
+			arguments, bin_key=first_letter, num_bins=1000)]
+		self.assertEqual(bins[0], bins[1])
+		self.assertEqual(bins[0], utils.binify('a', 1000))
+
+	def test_unknown_hash_function(self):
+		with self.assertRaises(OptionError):
+			hashed_bins([('a',)], hash_function='md5')
+		if binning.xxhash is None:
+			with self.assertRaises(OptionError):
+				hashed_bins([('a',)], hash_function='xxh64')
+
+
+class TestJumpBins(unittest.TestCase):
+
+	def setUp(self):
+		self.hashes = [
+			binning.sha1_hash('item-%d' % i) for i in range(3000)]
+
+	def bins(self, scheme, num_bins):
+		bin_func = binning.get_bin_func(scheme)
+		return [bin_func(hash_value, num_bins) for hash_value in self.hashes]
+
+	def test_bins_are_in_range_and_balanced(self):
+		counts = [0] * 6
+		for this_bin in self.bins('jump', 6):
+			counts[this_bin] += 1
+		for count in counts:
+			self.assertTrue(400 < count < 600, counts)
+		self.assertEqual(set(self.bins('jump', 1)), set([0]))
+
+	def test_adding_a_bin_only_moves_work_to_it(self):
+		before = self.bins('jump', 10)
+		after = self.bins('jump', 11)
+		moved = [
+			(old, new) for old, new in zip(before, after) if old != new]
+		self.assertTrue(set(new for old, new in moved) <= set([10]))
+
+		# About 1/11 of the work moves, where modulo binning moves most.
+		self.assertTrue(150 < len(moved) < 400, len(moved))
+		modulo_moved = sum(
+			old != new for old, new in
+			zip(self.bins('modulo', 10), self.bins('modulo', 11))
+		)
+		self.assertGreater(modulo_moved, 2000)
+
+	def test_unknown_bin_scheme(self):
+		with self.assertRaises(OptionError):
+			binning.get_bin_func('ring')
+
+
+class TestHashedJobs(JobTestCase):
+
+	def test_bins_split_the_work(self):
+		for scheme in ('modulo', 'jump'):
+			self.check_bins_split_the_work(scheme)
+
+	def check_bins_split_the_work(self, scheme):
+		# Names are recorded with the scheme, so the schemes don't mix.
+		names = ['%s-%d' % (scheme, i) for i in range(60)]
+		seen = []
+		for this_bin in range(3):
+			run_direct(record_name, [(name, 1) for name in names], None, {
+				'hash': [0], 'num_bins': 3, 'these_bins': [this_bin],
+				'bin_scheme': scheme, 'processes': 2
+			})
+			ran = set(
+				name for name in count_calls(str) if name.startswith(scheme)
+			) - set(seen)
+			self.assertTrue(ran)
+			seen.extend(ran)
+		self.assertEqual(sorted(seen), sorted(names))
+		calls = count_calls(str)
+		for name in names:
+			self.assertEqual(calls[name], 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
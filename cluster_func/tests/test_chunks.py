@@ -0,0 +1,67 @@
+'''
+Tests for sending argument sets to workers in chunks, of fixed size or sized
+automatically from the time taken by calls.
+'''
+
+import unittest
+from cluster_func import run_direct
+from cluster_func._cf import (
+	generate_chunks, get_chunksize, CallTiming, AUTO_CHUNK_SECONDS,
+	MAX_AUTO_CHUNKSIZE
+)
+from cluster_func.exceptions import OptionError
+from helpers import JobTestCase, record, count_calls
+
+
+class TestChunking(unittest.TestCase):
+
+	def test_fixed_size_chunks(self):
+		self.assertEqual(
+			list(generate_chunks(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+		self.assertEqual(list(generate_chunks([], 3)), [])
+
+	def test_auto_chunks_start_with_one_argument_set(self):
+		timing = CallTiming()
+		self.assertEqual(get_chunksize('auto', timing), 1)
+
+		# Calls taking a tenth of the target time per chunk make chunks of 10
+		timing.record(AUTO_CHUNK_SECONDS / 10 * 4, 4)
+		self.assertEqual(get_chunksize('auto', timing), 10)
+
+	def test_auto_chunks_are_bounded(self):
+		timing = CallTiming()
+		timing.record(0, 100)
+		self.assertEqual(get_chunksize('auto', timing), MAX_AUTO_CHUNKSIZE)
+		timing.record(1000 * AUTO_CHUNK_SECONDS, 1)
+		self.assertEqual(get_chunksize('auto', timing), 1)
+
+	def test_auto_chunks_grow_as_calls_are_timed(self):
+		timing = CallTiming()
+		chunks = generate_chunks(range(100), 'auto', timing)
+		self.assertEqual(next(chunks), [0])
+		timing.record(AUTO_CHUNK_SECONDS / 5, 1)
+		self.assertEqual(next(chunks), [1, 2, 3, 4, 5])
+
+
+class TestChunkedJobs(JobTestCase):
+
+	def assert_each_run_once(self, num_args):
+		self.assertEqual(count_calls(), dict.fromkeys(range(num_args), 1))
+
+	def test_chunksize_from_the_command_line(self):
+		run_direct(record, range(50), None, {'processes': 3, 'chunksize': '8'})
+		self.assert_each_run_once(50)
+
+	def test_auto_chunksize(self):
+		run_direct(record, range(300), None, {
+			'processes': 3, 'chunksize': 'auto'})
+		self.assert_each_run_once(300)
+
+	def test_invalid_chunksize(self):
+		for chunksize in ('big', 0, -2):
+			with self.assertRaises(OptionError):
+				run_direct(record, range(5), None, {'chunksize': chunksize})
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,104 @@
+'''
+Tests for running coroutine targets on per-worker event loops (see the
+`coroutines` module).  These need trollius, the python 2 backport of asyncio,
+and are skipped without it.
+'''
+
+import time
+import unittest
+from cluster_func import run_direct, coroutines, metrics
+from cluster_func.exceptions import OptionError, WorkerError
+from helpers import JobTestCase, write_results, read_reduced
+
+try:
+	import trollius
+	from trollius import From, Return
+except ImportError:
+	trollius = None
+
+def square(i):
+	return i * i
+
+
+if trollius is not None:
+
+	@trollius.coroutine
+	def slow_square(i):
+		yield From(trollius.sleep(0.1))
+		raise Return(i * i)
+
+	@trollius.coroutine
+	def fail_on_seven(i):
+		yield From(trollius.sleep(0.01))
+		if i == 7:
+			raise ValueError('seven')
+		raise Return(i)
+
+
+@unittest.skipIf(trollius is None, 'trollius is not installed')
+class TestCoroutineRunner(unittest.TestCase):
+
+	def run_chunks(self, target_func, chunks, concurrency,
+		worker_metrics=None):
+		completed = []
+		def complete(chunk_num, chunk, keys, results, seconds):
+			completed.append((chunk_num, results))
+		coroutines.CoroutineRunner(
+			target_func, iter(chunks), concurrency, complete, worker_metrics
+		).run()
+		return sorted(completed)
+
+	def test_calls_run_concurrently(self):
+		chunks = [(n, [(i,) for i in range(n*10, n*10 + 10)], None)
+			for n in range(5)]
+		start = time.time()
+		completed = self.run_chunks(slow_square, chunks, 50)
+		self.assertLess(time.time() - start, 2.5)
+		self.assertEqual(completed, [
+			(n, [i * i for i in range(n*10, n*10 + 10)]) for n in range(5)])
+
+	def test_concurrent_calls_are_busy_once(self):
+		worker_metrics = metrics.WorkerMetrics()
+		worker_metrics.start()
+		self.run_chunks(slow_square, [(0, [(i,) for i in range(20)], None)], 20,
+			worker_metrics)
+		worker_metrics.stop()
+		recorded = worker_metrics.as_dict()
+		self.assertEqual(sum(recorded['calls']['counts']), 20)
+		self.assertGreater(recorded['calls']['total_seconds'], 1.5)
+		self.assertLess(recorded['busy_seconds'], 0.5)
+		self.assertLessEqual(recorded['busy_seconds'], recorded['seconds'])
+
+	def test_empty_chunks_are_completed(self):
+		self.assertEqual(
+			self.run_chunks(slow_square, [(0, [], None)], 5), [(0, [])])
+
+	def test_error_is_reraised(self):
+		chunks = [(n, [(i,) for i in range(n*4, n*4 + 4)], None)
+			for n in range(10)]
+		with self.assertRaises(ValueError):
+			self.run_chunks(fail_on_seven, chunks, 3)
+
+
+@unittest.skipIf(trollius is None, 'trollius is not installed')
+class TestCoroutineJobs(JobTestCase):
+
+	def test_workers_run_calls_concurrently(self):
+		start = time.time()
+		run_direct(slow_square, range(200), write_results, {
+			'processes': 2, 'async_concurrency': 50, 'chunksize': 10})
+		self.assertLess(time.time() - start, 5)
+		self.assertEqual(sorted(read_reduced()), [i * i for i in range(200)])
+
+	def test_coroutine_raising_fails_the_job(self):
+		with self.assertRaises(WorkerError):
+			run_direct(fail_on_seven, range(100), write_results, {
+				'processes': 2, 'async_concurrency': 5})
+
+	def test_concurrency_requires_a_coroutine_target(self):
+		with self.assertRaises(OptionError):
+			run_direct(square, range(10), None, {'async_concurrency': 5})
+
+
+if __name__ == '__main__':
+	unittest.main()
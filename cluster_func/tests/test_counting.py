@@ -0,0 +1,75 @@
+'''
+Tests for counting the arguments iterable (see the `counting` module).
+'''
+
+import os
+import sys
+import types
+import shutil
+import tempfile
+import unittest
+from cluster_func import counting
+
+MODULE_NAME = 'cluf_counting_target'
+
+
+def generate(num_items):
+	for i in range(num_items):
+		yield i
+
+
+class TestCounting(unittest.TestCase):
+
+	def setUp(self):
+		self.jobs_dir = tempfile.mkdtemp()
+		self.module_path = os.path.join(self.jobs_dir, MODULE_NAME + '.py')
+		open(self.module_path, 'w').write('args = None\n')
+		module = types.ModuleType(MODULE_NAME)
+		module.__file__ = self.module_path
+		sys.modules[MODULE_NAME] = module
+		self.options = {'jobs_dir': self.jobs_dir, 'target_cli': []}
+
+	def tearDown(self):
+		del sys.modules[MODULE_NAME]
+		shutil.rmtree(self.jobs_dir)
+
+	def count(self, iterable, **options):
+		return counting.count_iterations(
+			iterable, dict(self.options, **options), MODULE_NAME)
+
+	def test_lengths_are_used(self):
+		self.assertEqual(counting.get_length(range(7)), 7)
+		self.assertEqual(counting.get_length(iter(xrange(9))), 9)
+		self.assertEqual(counting.get_length(generate(3)), None)
+
+	def test_count_callable_leaves_the_iterable_alone(self):
+		iterable = generate(5)
+		self.assertEqual(self.count(iterable, count=lambda: 1000), 1000)
+		self.assertEqual(list(iterable), range(5))
+
+	def test_generators_are_enumerated(self):
+		self.assertEqual(counting.enumerate_count(generate(1234)), 1234)
+		self.assertEqual(counting.enumerate_count([]), 0)
+
+	def test_counts_are_cached(self):
+		self.assertEqual(self.count(generate(30)), 30)
+
+		# The cached count is used, even though the iterable has changed.
+		self.assertEqual(self.count(generate(40)), 30)
+		self.assertEqual(self.count(generate(40), recount=True), 40)
+
+	def test_cache_depends_on_the_source_and_arguments(self):
+		self.assertEqual(self.count(generate(30)), 30)
+		self.assertEqual(self.count(generate(40), target_cli=['--big']), 40)
+		open(self.module_path, 'w').write('args = range(50)\n')
+		self.assertEqual(self.count(generate(50)), 50)
+
+	def test_no_cache_without_the_module_source(self):
+		del sys.modules[MODULE_NAME].__file__
+		self.assertEqual(self.count(generate(30)), 30)
+		self.assertEqual(self.count(generate(40)), 40)
+		self.assertEqual(os.listdir(self.jobs_dir), [MODULE_NAME + '.py'])
+
+
+if __name__ == '__main__':
+	unittest.main()
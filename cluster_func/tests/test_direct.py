@@ -0,0 +1,73 @@
+'''
+Tests for running the target function in direct mode with `run_direct`,
+including streaming results to a reducer, and stopping the job when a
+worker fails.  Run from the root of the repository with
+
+	$ python -m unittest discover -s cluster_func/tests -p 'test_*.py'
+'''
+
+import unittest
+from cluster_func import run_direct
+from cluster_func.exceptions import WorkerError
+from helpers import JobTestCase, write_results, read_reduced, was_reduced
+
+
+def square(i):
+	return i * i
+
+
+def fail_on_seven(i):
+	if i == 7:
+		raise ValueError('seven')
+	return i
+
+
+def fail_reducing(results):
+	for result in results:
+		raise KeyError('reducer')
+
+
+class TestRunDirect(JobTestCase):
+
+	def test_reducer_gets_every_result(self):
+		run_direct(square, range(50), write_results, {'processes': 3})
+		self.assertEqual(
+			sorted(read_reduced()), [i * i for i in range(50)])
+
+	def test_chunked_reducer_gets_every_result(self):
+		run_direct(
+			square, range(50), write_results,
+			{'processes': 3, 'chunksize': 7}
+		)
+		self.assertEqual(
+			sorted(read_reduced()), [i * i for i in range(50)])
+
+	def test_target_raising_fails_the_job(self):
+		with self.assertRaises(WorkerError):
+			run_direct(fail_on_seven, range(200), None, {'processes': 2})
+
+	def test_target_raising_stops_the_reducer(self):
+		with self.assertRaises(WorkerError):
+			run_direct(
+				fail_on_seven, range(200), write_results, {'processes': 2})
+
+		# The reducer was stopped before it could see every result.
+		self.assertFalse(was_reduced() and sorted(
+			read_reduced()) == [i for i in range(200) if i != 7])
+
+	def test_reducer_raising_fails_the_job(self):
+		with self.assertRaises(WorkerError):
+			run_direct(square, range(200), fail_reducing, {'processes': 2})
+
+	def test_iterable_raising_is_raised(self):
+		def args():
+			for i in range(100):
+				if i == 30:
+					raise IOError('args')
+				yield i
+		with self.assertRaises(IOError):
+			run_direct(square, args(), None, {'processes': 2})
+
+
+if __name__ == '__main__':
+	unittest.main()
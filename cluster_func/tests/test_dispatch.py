@@ -0,0 +1,163 @@
+'''
+Tests for dispatching a job from the command line, and running the subjobs
+it makes, without a scheduler.
+'''
+
+import os
+import sys
+import json
+import stat
+import shutil
+import tempfile
+import unittest
+import subprocess
+from cluster_func import shards
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))))
+CLUF_PATH = os.path.join(REPO_DIR, 'bin', 'cluf')
+
+# Each argument set records which bin ran it as a file in `out`.  The
+# arguments are made by a generator, which can only be enumerated once.
+TARGET_MODULE = '''
+import os
+def target(i):
+	open(os.path.join('out', str(i)), 'a').write(os.environ.get('BIN', '?'))
+def args():
+	for i in range(50):
+		yield i
+def cost(i):
+	return 100 if i < 3 else 1
+'''
+
+
+class DispatchTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.job_dir = tempfile.mkdtemp()
+		open(os.path.join(self.job_dir, 'target.py'), 'w').write(
+			TARGET_MODULE)
+		os.mkdir(os.path.join(self.job_dir, 'out'))
+		self.env = dict(os.environ)
+		self.env['PYTHONPATH'] = REPO_DIR
+
+		# Subjob scripts call `cluf`, so put one on the PATH.
+		bin_dir = os.path.join(self.job_dir, 'bin')
+		os.mkdir(bin_dir)
+		cluf_path = os.path.join(bin_dir, 'cluf')
+		open(cluf_path, 'w').write(
+			'#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, CLUF_PATH))
+		os.chmod(cluf_path, stat.S_IRWXU)
+		self.env['PATH'] = bin_dir + os.pathsep + self.env['PATH']
+
+	def tearDown(self):
+		shutil.rmtree(self.job_dir)
+
+	def cluf(self, *args, **env):
+		return subprocess.check_output(
+			[sys.executable, CLUF_PATH] + list(args), cwd=self.job_dir,
+			env=dict(self.env, **env), stderr=subprocess.STDOUT
+		)
+
+	def jobs_path(self, fname):
+		return os.path.join(self.job_dir, 'jobs', fname)
+
+	def run_subjob_script(self, fname, **env):
+		'''Run the cluf command in a subjob script, as the scheduler would.'''
+		command = open(self.jobs_path(fname)).read().strip().split('\n')[-1]
+		tokens = command.split()
+		self.assertEqual(tokens[0], 'cluf')
+		return self.cluf(*tokens[1:], **env)
+
+	def bins_by_arg(self):
+		out_dir = os.path.join(self.job_dir, 'out')
+		return dict(
+			(int(fname), open(os.path.join(out_dir, fname)).read())
+			for fname in os.listdir(out_dir)
+		)
+
+
+class TestMaterialize(DispatchTestCase):
+
+	def test_each_bin_gets_a_shard(self):
+		self.cluf('target.py', '-n', '3', '--materialize', '-j', 'jobs')
+		for this_bin in range(3):
+			shard = shards.read_shard(self.jobs_path('target-%d-3.shard' % this_bin))
+			args = [i for i in range(50) if i % 3 == this_bin]
+			self.assertEqual(list(shard), [(i,) for i in args])
+			self.assertEqual([shard.key(k) for k in range(len(shard))], args)
+			shard.close()
+
+	def test_subjobs_read_their_shards(self):
+		self.cluf('target.py', '-n', '3', '--materialize', '-j', 'jobs')
+		for this_bin in range(3):
+			script = 'target-%d-3.pbs' % this_bin
+			self.assertIn('-S jobs/target-%d-3.shard' % this_bin,
+				open(self.jobs_path(script)).read())
+			self.run_subjob_script(script, BIN=str(this_bin))
+		self.assertEqual(
+			self.bins_by_arg(), dict((i, str(i % 3)) for i in range(50)))
+
+	def test_uncounted_iterable_is_spooled(self):
+		# Without --nodes, the number of subjobs depends on the number of
+		# argument sets, so the generator is spooled to count it.
+		self.cluf(
+			'target.py', '--materialize', '-j', 'jobs', '-i', '10')
+		names = sorted(os.listdir(os.path.join(self.job_dir, 'jobs')))
+		self.assertEqual(
+			[name for name in names if name.endswith('.shard')],
+			['target-%d-5.shard' % this_bin for this_bin in range(5)]
+		)
+		self.assertFalse(any(name.endswith('.spool') for name in names))
+
+
+class TestCostPlanning(DispatchTestCase):
+
+	def test_subjobs_run_their_planned_bins(self):
+		self.cluf('target.py', '-n', '3', '--cost', 'cost', '-j', 'jobs')
+		for this_bin in range(3):
+			self.run_subjob_script('target-%d-3.pbs' % this_bin,
+				BIN=str(this_bin))
+		bins_by_arg = self.bins_by_arg()
+		self.assertEqual(sorted(bins_by_arg), range(50))
+
+		# Each of the three expensive argument sets gets a subjob of its own,
+		# and the cheap ones are spread evenly.
+		self.assertEqual(sorted(bins_by_arg[i] for i in range(3)), ['0', '1', '2'])
+		counts = [
+			sum(1 for b in bins_by_arg.values() if b == this_bin)
+			for this_bin in '012'
+		]
+		self.assertLessEqual(max(counts) - min(counts), 1)
+
+
+class TestLocalBackend(DispatchTestCase):
+
+	def test_subjobs_are_run_and_recorded(self):
+		self.cluf(
+			'target.py', '-n', '4', '-q', '--backend', 'local', '-j', 'jobs',
+			'--submit-concurrency', '2'
+		)
+		self.assertEqual(sorted(self.bins_by_arg()), range(50))
+		manifest = json.load(open(self.jobs_path('target.manifest')))
+		self.assertEqual(manifest['backend'], 'local')
+		self.assertEqual(
+			sorted(entry['subjob'] for entry in manifest['jobs']), range(4))
+		for entry in manifest['jobs']:
+			self.assertEqual(entry['returncode'], 0)
+			self.assertTrue(
+				os.path.exists(os.path.join(self.job_dir, entry['script'])))
+
+	def test_job_array(self):
+		self.cluf(
+			'target.py', '-n', '3', '-q', '-J', '--backend', 'local',
+			'-j', 'jobs'
+		)
+		self.assertEqual(sorted(self.bins_by_arg()), range(50))
+		manifest = json.load(open(self.jobs_path('target.manifest')))
+		self.assertEqual(
+			sorted(entry['subjob'] for entry in manifest['jobs']), range(3))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,101 @@
+'''
+Tests for the per-worker `setup` and `teardown` hooks, and `get_context`.
+'''
+
+import os
+import unittest
+from cluster_func import run_direct, get_context
+from cluster_func.exceptions import WorkerError
+import helpers
+from helpers import JobTestCase
+
+
+def record_call(name):
+	helpers.record_call('%s-%d' % (name, os.getpid()))
+
+
+def count_processes(name):
+	'''The number of processes that made the call named `name`.'''
+	return len([
+		call for call in helpers.count_calls(str)
+		if call.startswith(name + '-')
+	])
+
+
+def setup():
+	record_call('setup')
+	return {'offset': 1000}
+
+
+def teardown():
+	record_call('teardown')
+
+
+def add_offset(i):
+	result = i + get_context()['offset']
+	record_call('result-%d' % result)
+	return result
+
+
+def fail_on_seven(i):
+	if i == 7:
+		raise ValueError('seven')
+	return add_offset(i)
+
+
+def fail_setup():
+	raise IOError('setup')
+
+
+class TestHooks(JobTestCase):
+
+	def test_each_process_is_set_up_and_torn_down(self):
+		run_direct(add_offset, range(20), None, {
+			'processes': 3, 'setup': setup, 'teardown': teardown})
+		self.assertEqual(count_processes('setup'), 3)
+		self.assertEqual(count_processes('teardown'), 3)
+		for i in range(20):
+			self.assertEqual(count_processes('result-%d' % (i + 1000)), 1)
+
+	def test_teardown_runs_when_the_target_raises(self):
+		with self.assertRaises(WorkerError):
+			run_direct(fail_on_seven, range(50), None, {
+				'processes': 3, 'setup': setup, 'teardown': teardown})
+		self.assertEqual(count_processes('setup'), 3)
+		self.assertEqual(count_processes('teardown'), 3)
+
+	def test_no_teardown_when_setup_raises(self):
+		with self.assertRaises(WorkerError):
+			run_direct(add_offset, range(10), None, {
+				'processes': 2, 'setup': fail_setup, 'teardown': teardown})
+		self.assertEqual(count_processes('teardown'), 0)
+
+	def test_threads_share_one_setup(self):
+		run_direct(add_offset, range(20), None, {
+			'executor': 'thread', 'threads': 4, 'setup': setup,
+			'teardown': teardown
+		})
+		self.assertEqual(count_processes('setup'), 1)
+		self.assertEqual(count_processes('teardown'), 1)
+
+	def test_threads_tear_down_when_the_target_raises(self):
+		with self.assertRaises(WorkerError):
+			run_direct(fail_on_seven, range(50), None, {
+				'executor': 'thread', 'threads': 2, 'setup': setup,
+				'teardown': teardown
+			})
+		self.assertEqual(count_processes('setup'), 1)
+		self.assertEqual(count_processes('teardown'), 1)
+
+	def test_thread_pools_tear_down_when_the_target_raises(self):
+		with self.assertRaises(WorkerError):
+			run_direct(fail_on_seven, range(50), None, {
+				'processes': 2, 'threads_per_process': 3, 'setup': setup,
+				'teardown': teardown
+			})
+		self.assertEqual(count_processes('setup'), 2)
+		self.assertEqual(count_processes('teardown'), 2)
+
+
+if __name__ == '__main__':
+	unittest.main()
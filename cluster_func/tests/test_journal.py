@@ -0,0 +1,109 @@
+'''
+Tests for the completion journal (see the `journal` module), and for
+resuming jobs with it.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from cluster_func import run_direct, journal
+from cluster_func.exceptions import WorkerError
+from helpers import JobTestCase, record, count_calls
+
+
+# Journals are named after the target's module, so the targets of the jobs
+# being resumed are defined here.
+def succeed(i):
+	return record(i)
+
+
+def fail_on_seven(i):
+	if i == 7:
+		raise ValueError('seven')
+	return record(i)
+
+
+class TestJournal(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_recorded_keys_are_loaded(self):
+		writer = journal.JournalWriter(self.directory)
+		writer.record([0, 5, 9])
+		writer.record(iter([100]))
+		writer.close()
+		completed = journal.load_completed(self.directory)
+		for key in range(101):
+			self.assertEqual(key in completed, key in (0, 5, 9, 100))
+
+	def test_partial_key_is_ignored(self):
+		writer = journal.JournalWriter(self.directory)
+		writer.record([3, 4])
+		writer.close()
+		path = os.path.join(self.directory, os.listdir(self.directory)[0])
+		with open(path, 'ab') as journal_file:
+			journal_file.write(journal.KEY.pack(5)[:3])
+		completed = journal.load_completed(self.directory)
+		self.assertTrue(3 in completed and 4 in completed)
+		self.assertFalse(5 in completed)
+
+	def test_key_set_holds_64_bit_keys(self):
+		keys = [2**64 - 1, 2**63 + 1, 2**53 + 1, 2**32 + 7]
+		writer = journal.JournalWriter(self.directory)
+		writer.record(keys)
+		writer.close()
+		completed = journal.load_completed(self.directory, hashed=True)
+		for key in keys:
+			self.assertIn(key, completed)
+		for key in (2**64 - 2, 2**63, 2**53, 2**53 + 2, 7):
+			self.assertNotIn(key, completed)
+
+	def test_missing_journal_is_empty(self):
+		completed = journal.load_completed(
+			os.path.join(self.directory, 'missing'))
+		self.assertNotIn(0, completed)
+
+
+class TestResume(JobTestCase):
+
+	def setUp(self):
+		super(TestResume, self).setUp()
+		self.jobs_dir = os.path.join(self.temp_dir, 'jobs')
+
+	def run_job(self, target, options=None):
+		run_direct(target, range(100), None, dict(options or {}, **{
+			'resume': True, 'jobs_dir': self.jobs_dir, 'processes': 2,
+			'chunksize': 3
+		}))
+
+	def test_completed_argument_sets_are_skipped(self):
+		with self.assertRaises(WorkerError):
+			self.run_job(fail_on_seven)
+		first_run = count_calls()
+		self.assertNotIn(7, first_run)
+
+		self.run_job(succeed)
+		calls = count_calls()
+		self.assertEqual(sorted(calls), range(100))
+
+		# Argument sets completed in the first run weren't run again.
+		self.assertLess(sum(calls.values()), 100 + len(first_run))
+
+		self.run_job(succeed)
+		self.assertEqual(count_calls(), calls)
+
+	def test_resuming_hashed_bins(self):
+		self.run_job(succeed, {'hash': [0]})
+		calls = count_calls()
+		self.assertEqual(sorted(calls), range(100))
+		self.run_job(succeed, {'hash': [0]})
+		self.assertEqual(count_calls(), calls)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,332 @@
+'''
+Tests for dividing work dynamically between subjobs (see the `leases`
+module), including subjobs that start late, and subjobs that die.
+'''
+
+import os
+import sys
+import time
+import shutil
+import signal
+import tempfile
+import threading
+import unittest
+import subprocess
+from Queue import Queue
+from StringIO import StringIO
+from cluster_func import leases
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))))
+CLUF_PATH = os.path.join(REPO_DIR, 'bin', 'cluf')
+
+# Subjobs run the target module as separate processes, in the job directory.
+# Each argument set records which process ran it as a file in `out`.
+TARGET_MODULE = '''
+import os, time
+def target(i):
+	time.sleep(0.005)
+	open(os.path.join('out', str(i)), 'a').write('%%d\\n' %% os.getpid())
+args = %s
+'''
+
+
+def make_old(path, seconds):
+	then = time.time() - seconds
+	os.utime(path, (then, then))
+
+
+class TestLeaseDirectory(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def lease_path(self, block):
+		return os.path.join(self.directory, '%d.lease' % block)
+
+	def test_blocks_are_claimed_once(self):
+		first = leases.LeaseDirectory(self.directory, 60)
+		second = leases.LeaseDirectory(self.directory, 60)
+		second.holder = 'second'
+		self.assertEqual(first.claim(0), 0)
+		self.assertEqual(second.claim(0), 1)
+		self.assertEqual(first.claim(0), 2)
+
+	def test_done_blocks_and_end(self):
+		subjob = leases.LeaseDirectory(self.directory, 60)
+		self.assertEqual(subjob.unfinished(), None)
+		for block in range(3):
+			self.assertEqual(subjob.claim(0), block)
+		subjob.complete(1)
+		subjob.set_end(3)
+		self.assertEqual(subjob.unfinished(), [0, 2])
+		self.assertEqual(subjob.claim(0), None)
+
+		# Others see what's done, and where the end is.
+		other = leases.LeaseDirectory(self.directory, 60)
+		self.assertEqual(other.unfinished(), [0, 2])
+
+	def test_expired_leases_are_stolen(self):
+		first = leases.LeaseDirectory(self.directory, 60)
+		second = leases.LeaseDirectory(self.directory, 60)
+		second.holder = 'second'
+		first.claim(0)
+		first.set_end(1)
+		self.assertEqual(second.claim(0), None)
+
+		make_old(self.lease_path(0), 61)
+		self.assertEqual(second.claim(0), 0)
+		self.assertEqual(open(self.lease_path(0)).read(), 'second')
+
+		# The first subjob finds out that it lost the lease.
+		first.renew()
+		self.assertEqual(first.held, set())
+
+	def test_fresh_lease_taken_by_mistake_is_restored(self):
+
+		# Another subjob steals the expired lease after we find that it
+		# expired, but before we move it aside.
+		class Racing(leases.LeaseDirectory):
+			def _expired(self, path):
+				if path == self_lease_path:
+					open(path, 'w').write('other')
+					return True
+				return leases.LeaseDirectory._expired(self, path)
+
+		self_lease_path = self.lease_path(0)
+		open(self_lease_path, 'w').write('dead')
+		subjob = Racing(self.directory, 60)
+		self.assertFalse(subjob._try_steal_lease(0))
+		self.assertEqual(open(self_lease_path).read(), 'other')
+		self.assertEqual(
+			[fname for fname in os.listdir(self.directory)], ['0.lease'])
+
+
+class TestCoordinatorState(unittest.TestCase):
+
+	def test_claim_complete_and_expire(self):
+		state = leases.CoordinatorState(60)
+		self.assertEqual(state.claim('a', 0), 0)
+		self.assertEqual(state.claim('b', 0), 1)
+
+		# A holder isn't given its own block again.
+		self.assertEqual(state.claim('a', 0), 2)
+		state.complete('a', 0)
+		state.set_end('a', 3)
+		self.assertEqual(state.unfinished('a'), [1, 2])
+		self.assertEqual(state.claim('a', 0), None)
+
+		state.leases[1] = ('b', time.time() - 1)
+		self.assertEqual(state.claim('a', 0), 1)
+		state.complete('a', 1)
+		state.complete('a', 2)
+		self.assertTrue(state.finished())
+
+
+class TestCoordinatorClient(unittest.TestCase):
+
+	def test_finished_coordinator_means_no_more_blocks(self):
+		address = leases.start_coordinator(0.5)
+		client = leases.open_leases(address, 0.5)
+		self.assertEqual(client.claim(0), 0)
+		client.set_end(1)
+		client.complete(0)
+		self.assertEqual(client.unfinished(), [])
+
+		# Once all blocks are done, the coordinator exits.
+		late = leases.open_leases(address, 0.5)
+		deadline = time.time() + 10
+		stderr = sys.stderr
+		sys.stderr = StringIO()
+		try:
+			while not late.gone:
+				self.assertLess(time.time(), deadline)
+				time.sleep(0.1)
+				self.assertEqual(late.claim(0), None)
+			self.assertEqual(late.unfinished(), [])
+			late.renew()
+			late.complete(0)
+			warnings = sys.stderr.getvalue()
+		finally:
+			sys.stderr = stderr
+		self.assertEqual(warnings.count('can\'t be reached'), 1)
+
+
+class TestLeaseTracker(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.acks = Queue()
+		self.tracker = leases.LeaseTracker(
+			leases.LeaseDirectory(self.directory, 60), self.acks, 60,
+			max_outstanding=2
+		)
+		self.tracker.start()
+
+	def tearDown(self):
+		self.tracker.stop()
+		shutil.rmtree(self.directory)
+
+	def claim_in_thread(self):
+		claimed = []
+		thread = threading.Thread(
+			target=lambda: claimed.append(self.tracker.claim(0)))
+		thread.daemon = True
+		thread.start()
+		return thread, claimed
+
+	def test_claims_wait_for_room(self):
+		self.assertEqual(self.tracker.claim(0), 0)
+		self.tracker.sent(0)
+		self.tracker.sent(0)
+		self.tracker.emitted(0)
+
+		thread, claimed = self.claim_in_thread()
+		thread.join(0.2)
+		self.assertEqual(claimed, [])
+
+		self.acks.put((0, True))
+		thread.join(5)
+		self.assertEqual(claimed, [1])
+		self.acks.put((1, True))
+		time.sleep(0.1)
+		self.assertEqual(self.tracker.in_progress(), set([1]))
+		self.assertTrue(
+			os.path.exists(os.path.join(self.directory, '0.done')))
+
+	def test_skipped_chunks_make_room_but_dont_complete(self):
+		self.assertEqual(self.tracker.claim(0), 0)
+		self.tracker.sent(0)
+		self.tracker.sent(0)
+		self.tracker.emitted(0)
+		self.acks.put((0, True))
+		self.acks.put((1, False))
+		self.assertEqual(self.tracker.claim(0), 1)
+		self.assertFalse(
+			os.path.exists(os.path.join(self.directory, '0.done')))
+
+	def test_aborting_stops_claims(self):
+		self.tracker.abort = threading.Event()
+		self.tracker.claim(0)
+		self.tracker.sent(0)
+		self.tracker.sent(0)
+		thread, claimed = self.claim_in_thread()
+		self.tracker.abort.set()
+		thread.join(5)
+		self.assertEqual(claimed, [None])
+
+
+class TestSubjobs(unittest.TestCase):
+
+	def setUp(self):
+		self.job_dir = tempfile.mkdtemp()
+		self.write_target('range(600)')
+		os.mkdir(os.path.join(self.job_dir, 'out'))
+		self.env = dict(os.environ)
+		self.env['PYTHONPATH'] = REPO_DIR
+		self.subjobs = []
+
+	def tearDown(self):
+		for subjob in self.subjobs:
+			if subjob.poll() is None:
+				os.killpg(subjob.pid, signal.SIGKILL)
+				subjob.wait()
+		shutil.rmtree(self.job_dir)
+
+	def write_target(self, args):
+		open(os.path.join(self.job_dir, 'target.py'), 'w').write(
+			TARGET_MODULE % args)
+
+	def start_subjob(self, lease_seconds=60, location='leases'):
+		subjob = subprocess.Popen(
+			[
+				sys.executable, CLUF_PATH, 'target.py', '--processes', '2',
+				'--dynamic', location, '--block-size', '20',
+				'--lease-seconds', str(lease_seconds)
+			],
+			cwd=self.job_dir, env=self.env, preexec_fn=os.setsid,
+			stdout=open(os.devnull, 'w'), stderr=subprocess.PIPE
+		)
+		self.subjobs.append(subjob)
+		return subjob
+
+	def wait_for_output(self, num_items):
+		deadline = time.time() + 30
+		while len(os.listdir(os.path.join(self.job_dir, 'out'))) < num_items:
+			self.assertLess(time.time(), deadline)
+			time.sleep(0.05)
+
+	def pids_by_item(self):
+		out_dir = os.path.join(self.job_dir, 'out')
+		return dict(
+			(int(fname), open(os.path.join(out_dir, fname)).read().split())
+			for fname in os.listdir(out_dir)
+		)
+
+	def test_staggered_start_shares_the_work(self):
+		first = self.start_subjob()
+		self.wait_for_output(50)
+		second = self.start_subjob()
+		second.communicate()
+		first.communicate()
+		self.assertEqual(second.returncode, 0)
+		self.assertEqual(first.returncode, 0)
+
+		pids_by_item = self.pids_by_item()
+		self.assertEqual(sorted(pids_by_item), range(600))
+
+		# Each subjob has two worker processes.
+		pids = set(pid for pids in pids_by_item.values() for pid in pids)
+		self.assertEqual(len(pids), 4)
+
+	def test_blocks_of_killed_subjob_are_finished(self):
+		first = self.start_subjob(lease_seconds=1)
+		self.wait_for_output(50)
+		second = self.start_subjob(lease_seconds=1)
+		self.wait_for_output(100)
+		os.killpg(first.pid, signal.SIGKILL)
+		first.wait()
+
+		second.communicate()
+		self.assertEqual(second.returncode, 0)
+		self.assertEqual(sorted(self.pids_by_item()), range(600))
+
+	def test_subjob_starting_after_the_coordinator_exits(self):
+		address = leases.start_coordinator(1)
+		first = self.start_subjob(lease_seconds=1, location=address)
+		first.communicate()
+		self.assertEqual(first.returncode, 0)
+		self.assertEqual(sorted(self.pids_by_item()), range(600))
+
+		# The coordinator exits a lease period after the job is done.  A
+		# subjob that starts after that finds nothing left to do.
+		time.sleep(2)
+		late = self.start_subjob(lease_seconds=1, location=address)
+		stderr = late.communicate()[1]
+		self.assertEqual(late.returncode, 0, stderr)
+		self.assertIn('can\'t be reached', stderr)
+		pids_by_item = self.pids_by_item()
+		self.assertEqual(sorted(pids_by_item), range(600))
+		for pids in pids_by_item.values():
+			self.assertEqual(len(pids), 1)
+
+	def test_unfinished_blocks_are_reported(self):
+		first = self.start_subjob()
+		self.wait_for_output(50)
+		os.killpg(first.pid, signal.SIGKILL)
+		first.wait()
+
+		# The dead subjob's leases haven't expired, and the arguments can
+		# only be gone through once, so its blocks are left for a rerun.
+		self.write_target('iter(range(600))')
+		second = self.start_subjob()
+		stderr = second.communicate()[1]
+		self.assertEqual(second.returncode, 0)
+		self.assertIn('Blocks not done by any subjob yet', stderr)
+
+
+if __name__ == '__main__':
+	unittest.main()
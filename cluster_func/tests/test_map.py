@@ -0,0 +1,78 @@
+'''
+Tests for `cluster_func.map`, the library counterpart to direct mode.
+'''
+
+import time
+import unittest
+from cluster_func import map as cluf_map
+from cluster_func.exceptions import WorkerError
+
+
+def square(i):
+	return i * i
+
+
+def fail_on_seven(i):
+	if i == 7:
+		raise ValueError('seven')
+	return i
+
+
+def slow_unless_seven(i):
+	if i == 7:
+		raise ValueError('seven')
+	time.sleep(30)
+
+
+class UnpicklableError(Exception):
+	def __init__(self, first, second):
+		Exception.__init__(self, first)
+
+
+def fail_unpicklably(i):
+	raise UnpicklableError(1, 2)
+
+
+class TestMap(unittest.TestCase):
+
+	def test_ordered(self):
+		self.assertEqual(
+			list(cluf_map(square, range(100), processes=3, ordered=True)),
+			[i * i for i in range(100)]
+		)
+
+	def test_unordered_chunked(self):
+		self.assertEqual(
+			sorted(cluf_map(square, range(100), processes=3, chunksize=8)),
+			[i * i for i in range(100)]
+		)
+
+	def test_target_raising_is_reraised(self):
+		for ordered in (False, True):
+			results = cluf_map(
+				fail_on_seven, range(100), processes=2, ordered=ordered)
+			with self.assertRaises(ValueError):
+				list(results)
+
+	def test_results_before_failure_are_yielded(self):
+		results = []
+		with self.assertRaises(ValueError):
+			for result in cluf_map(
+				fail_on_seven, range(100), processes=1, ordered=True
+			):
+				results.append(result)
+		self.assertEqual(results, range(7))
+
+	def test_other_workers_are_terminated(self):
+		start = time.time()
+		with self.assertRaises(ValueError):
+			list(cluf_map(slow_unless_seven, range(8), processes=8))
+		self.assertLess(time.time() - start, 20)
+
+	def test_unpicklable_error(self):
+		with self.assertRaises(WorkerError):
+			list(cluf_map(fail_unpicklably, range(5), processes=2))
+
+
+if __name__ == '__main__':
+	unittest.main()
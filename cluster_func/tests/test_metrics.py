@@ -0,0 +1,150 @@
+'''
+Tests for recording metrics in direct mode, and reporting on them (see the
+`metrics` module).
+'''
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from cluster_func import run_direct, metrics
+
+
+def nap(i):
+	time.sleep(0.002)
+	return i
+
+
+def nap_longer(i):
+	time.sleep(0.02)
+	return i
+
+
+def histogram(*seconds):
+	recorded = metrics.Histogram()
+	for duration in seconds:
+		recorded.record(duration)
+	return recorded.as_dict()
+
+
+class TestHistograms(unittest.TestCase):
+
+	def test_buckets(self):
+		self.assertEqual(metrics.get_bucket(0), 0)
+		self.assertEqual(metrics.get_bucket(1.5e-6), 1)
+		self.assertEqual(metrics.get_bucket(3e-6), 2)
+		self.assertEqual(metrics.get_bucket(1e9), metrics.NUM_BUCKETS - 1)
+
+	def test_quantiles(self):
+		calls = histogram(*([1e-3] * 9 + [1.0]))
+		self.assertLess(metrics.quantile(calls, 0.5), 2e-3)
+		self.assertGreater(metrics.quantile(calls, 0.99), 1.0)
+		self.assertEqual(metrics.quantile(histogram(), 0.5), None)
+
+	def test_worker_utilization(self):
+		subjob = {
+			'host': 'node1', 'wall_seconds': 4.0, 'bins': [0], 'num_bins': 1,
+			'generate': histogram(), 'put': histogram(),
+			'workers': [
+				{'pid': 11, 'calls': histogram(3.0), 'waits': histogram(1.0)},
+				{'pid': 12, 'calls': histogram(1.0), 'waits': histogram(3.0)},
+				{'pid': 13, 'calls': histogram(), 'waits': histogram()},
+			]
+		}
+		summary = metrics.summarize(subjob)
+		self.assertEqual(summary['utilization'], 0.5)
+		self.assertEqual(summary['workers'], [
+			{'host': 'node1', 'pid': 11, 'calls': 1, 'utilization': 0.75},
+			{'host': 'node1', 'pid': 12, 'calls': 1, 'utilization': 0.25},
+			{'host': 'node1', 'pid': 13, 'calls': 0, 'utilization': None},
+		])
+		report = metrics.format_report([subjob])
+		self.assertIn('node1:11', report)
+		self.assertIn('75%', report)
+
+	def test_utilization_is_busy_time_over_running_time(self):
+		subjob = {
+			'host': 'node1', 'wall_seconds': 4.0, 'bins': [0], 'num_bins': 1,
+			'generate': histogram(), 'put': histogram(),
+			'workers': [
+				{
+					'pid': 11, 'calls': histogram(*[1.0] * 8),
+					'waits': histogram(1.0), 'busy_seconds': 3.0,
+					'seconds': 4.0
+				},
+				{
+					'pid': 12, 'calls': histogram(1.0), 'waits': histogram(),
+					'busy_seconds': 1.0, 'seconds': 4.0
+				},
+			]
+		}
+		summary = metrics.summarize(subjob)
+		self.assertEqual(summary['utilization'], 0.5)
+		self.assertEqual(
+			[worker['utilization'] for worker in summary['workers']],
+			[0.75, 0.25]
+		)
+
+	def test_overlapping_calls_are_busy_once(self):
+		worker_metrics = metrics.WorkerMetrics()
+		worker_metrics.start()
+		first = worker_metrics.begin_call()
+		second = worker_metrics.begin_call()
+		time.sleep(0.05)
+		worker_metrics.end_call(first)
+		worker_metrics.end_call(second)
+		time.sleep(0.05)
+		worker_metrics.stop()
+
+		recorded = worker_metrics.as_dict()
+		self.assertGreater(recorded['calls']['total_seconds'], 0.1)
+		self.assertTrue(0.05 <= recorded['busy_seconds'] < 0.1)
+		self.assertTrue(0.1 <= recorded['seconds'])
+		self.assertLess(metrics.get_utilization([recorded]), 1)
+
+
+class TestRecording(unittest.TestCase):
+
+	def setUp(self):
+		self.jobs_dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.jobs_dir)
+
+	def test_each_worker_is_recorded(self):
+		run_direct(nap, range(60), None, {
+			'processes': 3, 'metrics': True, 'jobs_dir': self.jobs_dir})
+		job_metrics = metrics.read_metrics(self.jobs_dir, __name__)
+		self.assertEqual(len(job_metrics), 1)
+
+		summary = metrics.summarize(job_metrics)
+		self.assertEqual(summary['calls'], 60)
+		workers = summary['workers']
+		self.assertEqual(len(workers), 3)
+		self.assertEqual(sum(worker['calls'] for worker in workers), 60)
+
+		# Each worker process recorded its own pid.
+		pids = set(worker['pid'] for worker in workers)
+		self.assertEqual(len(pids), 3)
+		self.assertNotIn(os.getpid(), pids)
+		self.assertNotIn(0, pids)
+		for worker in workers:
+			if worker['calls']:
+				self.assertTrue(0 < worker['utilization'] <= 1)
+
+	def test_threads_do_not_exceed_full_utilization(self):
+		run_direct(nap_longer, range(40), None, {
+			'processes': 1, 'threads_per_process': 4, 'metrics': True,
+			'jobs_dir': self.jobs_dir})
+		job_metrics = metrics.read_metrics(self.jobs_dir, __name__)
+		worker = job_metrics[0]['workers'][0]
+
+		# The calls overlapped, so their total time is more than the worker
+		# was running for.
+		self.assertGreater(worker['calls']['total_seconds'], worker['seconds'])
+		self.assertTrue(0 < metrics.summarize(job_metrics)['utilization'] <= 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,69 @@
+'''
+Tests for cost-weighted bin assignment (see the `planning` module).
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from array import array
+from cluster_func import planning
+from cluster_func.exceptions import PlanFormatError
+
+
+def cost(i, weight=1):
+	return i * weight
+
+
+class TestPlanning(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'test.plan')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_costs_are_estimated_with_the_arguments(self):
+		self.assertEqual(
+			list(planning.generate_costs([(3,), (4,)], cost)), [3.0, 4.0])
+		with self.assertRaises(ValueError):
+			list(planning.generate_costs([(-1,)], cost))
+
+	def test_bins_get_about_equal_costs(self):
+		# A few expensive argument sets, and many cheap ones.
+		costs = array('d', [100, 90, 80] + [1] * 270)
+		plan, totals = planning.plan_bins(costs, 3)
+		self.assertEqual(len(plan), len(costs))
+		self.assertEqual(sorted(plan[:3]), [0, 1, 2])
+		self.assertEqual(sum(totals), sum(costs))
+		self.assertLessEqual(max(totals) - min(totals), 1)
+		for this_bin in range(3):
+			self.assertEqual(totals[this_bin], sum(
+				c for c, b in zip(costs, plan) if b == this_bin))
+
+	def test_plans_are_written_and_read(self):
+		for num_bins in (3, 2**16 + 1):
+			costs = array('d', range(50))
+			plan, totals = planning.plan_bins(costs, num_bins)
+			planning.write_plan(self.path, plan)
+			self.assertEqual(
+				os.path.getsize(self.path),
+				len(planning.MAGIC) + 1 + 50 * plan.itemsize
+			)
+			self.assertEqual(list(planning.read_plan(self.path)), list(plan))
+
+	def test_bins_have_fixed_widths(self):
+		plan, totals = planning.plan_bins(array('d', [1]), 10)
+		self.assertEqual(plan.itemsize, 2)
+		plan, totals = planning.plan_bins(array('d', [1]), 2**20)
+		self.assertEqual(plan.itemsize, 4)
+
+	def test_bad_plan_file(self):
+		open(self.path, 'wb').write('CLUFPLN1L' + '\0' * 16)
+		with self.assertRaises(PlanFormatError):
+			planning.read_plan(self.path)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,112 @@
+'''
+Tests for profiling the workers of a job (see the `profiling` module).
+'''
+
+import os
+import sys
+import pstats
+import shutil
+import tempfile
+import unittest
+import subprocess
+from cluster_func import run_direct, profiling
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))))
+CLUF_PATH = os.path.join(REPO_DIR, 'bin', 'cluf')
+
+
+def spin(i):
+	total = 0
+	for j in range(20000):
+		total += j * i
+	return total
+
+
+def get_func_names(stats):
+	return set(func[2] for func in stats.stats)
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+	def test_samples_are_converted_to_stats(self):
+		profiler = profiling.SamplingProfiler(interval=0.01)
+		outer = ('a.py', 1, 'outer')
+		inner = ('a.py', 5, 'inner')
+		profiler.samples = {(inner, outer): 3, (outer,): 1}
+		stats = profiler.get_stats()
+
+		# Own time is counted for the innermost function only.
+		self.assertEqual(stats[outer][:4], (4, 4, 0.01, 0.04))
+		self.assertEqual(stats[inner][:4], (3, 3, 0.03, 0.03))
+		self.assertEqual(stats[inner][4], {outer: (3, 3, 0.03, 0.03)})
+		self.assertEqual(stats[outer][4], {})
+
+	def test_recursion_is_counted_once(self):
+		profiler = profiling.SamplingProfiler(interval=0.01)
+		func = ('a.py', 1, 'recurse')
+		profiler.samples = {(func, func, func): 2}
+		self.assertEqual(profiler.get_stats()[func][:4], (2, 2, 0.02, 0.02))
+
+
+class TestProfiledJobs(unittest.TestCase):
+
+	def setUp(self):
+		self.jobs_dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.jobs_dir)
+
+	def run_profiled(self, kind, **options):
+		run_direct(spin, range(40), None, dict({
+			'processes': 2, 'profile': kind, 'jobs_dir': self.jobs_dir,
+			'num_bins': 1, 'these_bins': [0]
+		}, **options))
+		return profiling.find_profiles(self.jobs_dir, __name__)
+
+	def test_each_worker_writes_a_profile(self):
+		paths = self.run_profiled('cprofile')
+		self.assertEqual(len(paths), 2)
+		self.assertEqual(
+			set(os.path.dirname(path) for path in paths),
+			set([os.path.join(self.jobs_dir, '%s-0-1.profile' % __name__)])
+		)
+		stats = profiling.merge_profiles(paths)
+		self.assertIn('spin', get_func_names(stats))
+		spin_stats = [
+			stat for func, stat in stats.stats.items() if func[2] == 'spin']
+		self.assertEqual(spin_stats[0][1], 40)
+
+	def test_sampled_profiles_can_be_read(self):
+		paths = self.run_profiled('sample')
+		self.assertEqual(len(paths), 2)
+		stats = profiling.merge_profiles(paths)
+		self.assertIn('spin', get_func_names(stats))
+
+	def test_each_thread_writes_a_profile(self):
+		paths = self.run_profiled('cprofile', threads_per_process=2)
+		self.assertEqual(len(paths), 4)
+
+	def test_profile_report(self):
+		self.run_profiled('cprofile')
+		output_path = os.path.join(self.jobs_dir, 'merged.prof')
+		env = dict(os.environ, PYTHONPATH=REPO_DIR)
+		report = subprocess.check_output([
+			sys.executable, CLUF_PATH, 'profile-report', __name__ + '.py',
+			'-j', self.jobs_dir, '-s', 'tottime', '-n', '100', '-o', output_path
+		], env=env)
+		self.assertIn('Merged 2 profiles', report)
+		self.assertIn('spin', report)
+		self.assertIn('spin', get_func_names(pstats.Stats(output_path)))
+
+	def test_profile_report_without_profiles(self):
+		env = dict(os.environ, PYTHONPATH=REPO_DIR)
+		report = subprocess.check_output([
+			sys.executable, CLUF_PATH, 'profile-report', 'missing.py',
+			'-j', self.jobs_dir
+		], env=env)
+		self.assertIn('No profiles for missing were found', report)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,104 @@
+'''
+Tests for live progress reporting (see the `progress` module).
+'''
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from cluster_func import run_direct, progress
+
+
+def square(i):
+	return i * i
+
+
+class TestProgressMonitor(unittest.TestCase):
+
+	def setUp(self):
+		self.monitor = progress.ProgressMonitor(3, 60, total=100)
+
+	def test_counts_are_summed(self):
+		for counter, count in zip(self.monitor.counters, [5, 10, 15]):
+			counter.value = count
+		report = self.monitor.get_progress()
+		self.assertEqual(report['completed'], 30)
+		self.assertEqual(report['total'], 100)
+		self.assertEqual(len(report['worker_rates']), 3)
+		self.assertGreater(report['rate'], 0)
+		self.assertAlmostEqual(
+			report['eta_seconds'], 70 / report['rate'], places=3)
+
+	def test_rates_are_over_the_window(self):
+		self.monitor.counters[0].value = 10
+		self.monitor.get_progress()
+		report = self.monitor.get_progress()
+
+		# Nothing was completed since the last snapshot, within the window.
+		self.assertEqual(report['completed'], 10)
+		self.assertEqual(report['rate'], 0)
+		self.assertEqual(report['eta_seconds'], None)
+
+	def test_old_snapshots_are_dropped(self):
+		now = self.monitor.start_time
+		for age in (300, 200, 100):
+			self.monitor.snapshots.append((now - age, [0, 0, 0]))
+		self.monitor.get_progress()
+		self.assertEqual(len(self.monitor.snapshots), 2)
+
+	def test_no_eta_without_a_total(self):
+		monitor = progress.ProgressMonitor(1, 60)
+		monitor.counters[0].value = 4
+		report = monitor.get_progress()
+		self.assertEqual(report['eta_seconds'], None)
+		self.assertIn('4 done', progress.format_progress(report))
+
+
+class TestFormatting(unittest.TestCase):
+
+	def test_durations(self):
+		self.assertEqual(progress.format_duration(42), '42s')
+		self.assertEqual(progress.format_duration(125), '2m05s')
+		self.assertEqual(progress.format_duration(3 * 3600 + 60), '3h01m')
+
+	def test_progress_line(self):
+		line = progress.format_progress({
+			'completed': 25, 'total': 100, 'rate': 2.5, 'eta_seconds': 30,
+			'elapsed_seconds': 10, 'worker_rates': [1.0, 1.5]
+		})
+		self.assertEqual(
+			line, 'cluf: 25/100 (25.0%)  2.5/s  eta 30s  elapsed 10s  '
+			'workers: 1.0 1.5'
+		)
+
+
+class TestHeartbeat(unittest.TestCase):
+
+	def setUp(self):
+		self.jobs_dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.jobs_dir)
+
+	def test_heartbeat_is_replaced(self):
+		path = os.path.join(self.jobs_dir, 'job.heartbeat')
+		progress.write_heartbeat(path, {'completed': 1})
+		progress.write_heartbeat(path, {'completed': 2})
+		self.assertEqual(json.load(open(path)), {'completed': 2})
+		self.assertEqual(os.listdir(self.jobs_dir), ['job.heartbeat'])
+
+	def test_job_writes_a_final_heartbeat(self):
+		run_direct(square, range(90), None, {
+			'processes': 3, 'heartbeat': True, 'jobs_dir': self.jobs_dir,
+			'num_bins': 1, 'these_bins': [0]
+		})
+		path = os.path.join(self.jobs_dir, '%s-0-1.heartbeat' % __name__)
+		report = json.load(open(path))
+		self.assertEqual(report['completed'], 90)
+		self.assertEqual(report['total'], 90)
+		self.assertEqual(len(report['worker_rates']), 3)
+
+
+if __name__ == '__main__':
+	unittest.main()
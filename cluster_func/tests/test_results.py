@@ -0,0 +1,94 @@
+'''
+Tests for saving results, and gathering them afterwards (see the `results`
+module), including results of subjobs that read materialized shards.
+'''
+
+import os
+import shutil
+import cPickle as pickle
+import tempfile
+import unittest
+from cluster_func import run_direct, shards, results
+
+
+def square(i):
+	return i * i
+
+
+class TestGather(unittest.TestCase):
+
+	def setUp(self):
+		self.jobs_dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.jobs_dir)
+
+	def run_bin(self, iterable, this_bin, num_bins, options=None):
+		options = dict(options or {}, **{
+			'save_results': True, 'jobs_dir': self.jobs_dir,
+			'these_bins': [this_bin], 'num_bins': num_bins, 'processes': 2,
+			'chunksize': 7
+		})
+		run_direct(square, iterable, None, options)
+
+	def gather(self, ordered):
+		return list(results.gather(self.jobs_dir, __name__, ordered=ordered))
+
+	def test_bins_are_gathered_in_order(self):
+		for this_bin in range(3):
+			self.run_bin(range(200), this_bin, 3)
+		self.assertEqual(self.gather(True), [i * i for i in range(200)])
+		self.assertEqual(
+			sorted(self.gather(False)), sorted(i * i for i in range(200)))
+
+	def test_sharded_bins_are_gathered_in_order(self):
+		paths = [
+			os.path.join(self.jobs_dir, '%d.shard' % this_bin)
+			for this_bin in range(3)
+		]
+		shards.write_shards(
+			paths, ((i, i % 3, (i,)) for i in range(200)))
+		for this_bin, path in enumerate(paths):
+			self.run_bin(
+				shards.read_shard(path), this_bin, 3, {'shard': path})
+		self.assertEqual(self.gather(True), [i * i for i in range(200)])
+
+	def test_rerun_results_are_gathered_once_when_ordered(self):
+		self.run_bin(range(50), 0, 1)
+		self.run_bin(range(50), 0, 1)
+		self.assertEqual(self.gather(True), [i * i for i in range(50)])
+		self.assertEqual(len(self.gather(False)), 100)
+
+	def write_records(self, fname, records):
+		path = os.path.join(self.jobs_dir, fname)
+		with open(path, 'wb') as results_file:
+			for key, value in records:
+				value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+				results_file.write(results.HEADER.pack(key, len(value)) + value)
+		return path
+
+	def test_first_of_duplicate_results_is_kept(self):
+		# Complex numbers can't be ordered, so merging mustn't compare them.
+		# The second file was written out of order.
+		paths = [
+			self.write_records('a.results', [(0, 3j), (1, 2j), (1, 1j)]),
+			self.write_records('b.results', [(2, 5j), (1, 4j), (0, 0j)]),
+		]
+		self.assertEqual(
+			list(results.merge_ordered(paths)), [3j, 2j, 5j])
+		self.assertEqual(
+			list(results.merge_ordered(paths[::-1])), [0j, 4j, 5j])
+
+	def test_partial_record_is_ignored(self):
+		writer = results.ResultWriter(self.jobs_dir)
+		writer.record([0, 1], ['a', 'b'])
+		writer.close()
+		path = os.path.join(self.jobs_dir, os.listdir(self.jobs_dir)[0])
+		with open(path, 'ab') as results_file:
+			results_file.write(results.HEADER.pack(2, 100) + 'partial')
+		self.assertEqual(
+			list(results.read_results(path)), [(0, 'a'), (1, 'b')])
+
+
+if __name__ == '__main__':
+	unittest.main()
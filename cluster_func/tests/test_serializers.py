@@ -0,0 +1,65 @@
+'''
+Tests for the serializers of chunks and results (see the `serializers`
+module), on their own and in direct mode.
+'''
+
+import unittest
+from cluster_func import run_direct, serializers
+from cluster_func.exceptions import OptionError
+from helpers import JobTestCase, write_results, read_reduced
+
+
+def as_string(i):
+	return 'x' * i
+
+
+def square(i):
+	return i * i
+
+
+class TestSerializers(unittest.TestCase):
+
+	def test_round_trips(self):
+		for name in serializers.SERIALIZERS:
+			try:
+				serializer = serializers.get_serializer(name)
+			except OptionError:
+				continue
+			chunk = [(1, 'a'), (2, {'b': [3.5]})]
+			self.assertEqual(serializer.loads(serializer.dumps(chunk)), chunk)
+
+	def test_bytes_results_are_framed_by_fixed_width_lengths(self):
+		serializer = serializers.get_serializer('bytes')
+		results = ['ab', '', 'c' * 300, '\0\xff']
+		data = serializer.dump_results(results)
+		self.assertEqual(len(data), 8 * 5 + 304)
+		self.assertEqual(data[:8], '\4' + '\0' * 7)
+		self.assertEqual(serializer.load_results(data), results)
+		self.assertEqual(
+			serializer.load_results(serializer.dump_results([])), [])
+
+	def test_bytes_results_must_be_strings(self):
+		with self.assertRaises(TypeError):
+			serializers.get_serializer('bytes').dump_results(['a', 1])
+
+	def test_unknown_serializer(self):
+		with self.assertRaises(OptionError):
+			serializers.get_serializer('yaml')
+
+
+class TestSerializedJobs(JobTestCase):
+
+	def test_bytes_results_reach_the_reducer(self):
+		run_direct(as_string, range(40), write_results, {
+			'processes': 2, 'chunksize': 6, 'serializer': 'bytes'})
+		self.assertEqual(
+			sorted(read_reduced()), sorted('x' * i for i in range(40)))
+
+	def test_compressed_job(self):
+		run_direct(square, range(40), write_results, {
+			'processes': 2, 'chunksize': 6, 'serializer': 'compressed'})
+		self.assertEqual(sorted(read_reduced()), [i * i for i in range(40)])
+
+
+if __name__ == '__main__':
+	unittest.main()
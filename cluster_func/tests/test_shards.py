@@ -0,0 +1,91 @@
+'''
+Tests for the indexed shard format (see the `shards` module).
+'''
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from cluster_func import shards
+from cluster_func.exceptions import BinError, ShardFormatError
+
+
+class TestShards(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'test.shard')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_records_are_read_by_position(self):
+		items = [(i, 'x' * i, {'i': [i]}) for i in range(50)]
+		self.assertEqual(shards.write_shard(self.path, items), 50)
+		reader = shards.read_shard(self.path)
+		self.assertEqual(len(reader), 50)
+		self.assertEqual(reader[17], items[17])
+		self.assertEqual(reader[-1], items[-1])
+		self.assertEqual(list(reader), items)
+		with self.assertRaises(IndexError):
+			reader[50]
+		reader.close()
+
+	def test_keys_default_to_positions(self):
+		shards.write_shard(self.path, 'abc')
+		reader = shards.read_shard(self.path)
+		self.assertEqual([reader.key(k) for k in range(3)], [0, 1, 2])
+
+	def test_empty_shard(self):
+		shards.write_shard(self.path, [])
+		self.assertEqual(list(shards.read_shard(self.path)), [])
+
+	def test_items_are_written_to_their_bins_with_keys(self):
+		paths = [
+			os.path.join(self.directory, '%d.shard' % this_bin)
+			for this_bin in range(3)
+		]
+		counts = shards.write_shards(
+			paths, ((2**63 + i, i % 3, (i,)) for i in range(10)))
+		self.assertEqual(counts, [4, 3, 3])
+		reader = shards.read_shard(paths[1])
+		self.assertEqual(list(reader), [(1,), (4,), (7,)])
+		self.assertEqual(
+			[reader.key(k) for k in range(3)], [2**63 + 1, 2**63 + 4, 2**63 + 7])
+
+	def test_bad_bins(self):
+		paths = [os.path.join(self.directory, '0.shard')]
+		for this_bin in (1, -1, 'a'):
+			with self.assertRaises(BinError):
+				shards.write_shards(paths, [(0, this_bin, (0,))])
+
+	def test_bad_files(self):
+		open(self.path, 'wb').write('not a shard at all, but long enough')
+		with self.assertRaises(ShardFormatError):
+			shards.read_shard(self.path)
+		open(self.path, 'wb').write('short')
+		with self.assertRaises(ShardFormatError):
+			shards.read_shard(self.path)
+
+	def test_slices_are_small_and_skip_completed_keys(self):
+		shards.write_shard(self.path, range(20))
+		reader = shards.read_shard(self.path)
+		slices = list(shards.generate_slices(reader, lambda: 6))
+		self.assertEqual([len(s) for s in slices], [6, 6, 6, 2])
+		self.assertEqual([list(s) for s in slices][1], range(6, 12))
+
+		# Slices are sent to workers, so they hold a path and indices only.
+		copied = pickle.loads(pickle.dumps(slices[3]))
+		self.assertEqual(list(copied), [18, 19])
+
+		completed = set(range(0, 20, 2))
+		slices = shards.generate_slices(reader, lambda: 4, completed)
+		self.assertEqual(
+			[list(s) for s in slices],
+			[[1, 3, 5, 7], [9, 11, 13, 15], [17, 19]]
+		)
+
+
+if __name__ == '__main__':
+	unittest.main()
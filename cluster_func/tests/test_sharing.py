@@ -0,0 +1,158 @@
+'''
+Tests for sending NumPy arrays through shared memory (see the `sharing`
+module).  These need numpy, and are skipped without it.
+'''
+
+import os
+import mmap
+import shutil
+import tempfile
+import unittest
+from cluster_func import run_direct, sharing, Arguments
+import helpers
+from helpers import JobTestCase, read_reduced
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+MIN_BYTES = 1024
+
+
+def is_shared(array):
+	return isinstance(array.base, mmap.mmap)
+
+
+def scale(array, factor=1):
+	return is_shared(array), array * factor
+
+
+def describe_results(results):
+	'''
+	Reducer that records, for each result, whether the target's array
+	argument, and the array it returned, arrived in shared memory.
+	'''
+	helpers.write_results(
+		(arg_was_shared, is_shared(array), int(array.sum()))
+		for arg_was_shared, array in results
+	)
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestSharer(unittest.TestCase):
+
+	def setUp(self):
+		self.sharer = sharing.Sharer(MIN_BYTES)
+
+	def tearDown(self):
+		self.sharer.close()
+
+	def test_large_arrays_are_shared(self):
+		array = numpy.arange(1000, dtype='int64')
+		shared = self.sharer.share(array)
+		self.assertIsInstance(shared, sharing.SharedArray)
+		self.assertEqual(len(os.listdir(self.sharer.directory)), 1)
+
+		# Attaching the array removes the segment's file.
+		attached = sharing.attach(shared)
+		self.assertTrue(is_shared(attached))
+		self.assertTrue((attached == array).all())
+		self.assertEqual(os.listdir(self.sharer.directory), [])
+
+	def test_other_values_are_left_alone(self):
+		small = numpy.arange(10)
+		objects = numpy.array([object()] * 1000)
+		for value in (small, objects, 'text', [1, 2]):
+			self.assertIs(self.sharer.share(value), value)
+		self.assertEqual(os.listdir(self.sharer.directory), [])
+
+	def test_arguments_and_results_are_shared(self):
+		array = numpy.ones(1000)
+		shared_chunk = self.sharer.share_chunk(
+			[(array, 3), Arguments(array, factor=array)])
+		self.assertIsInstance(shared_chunk[0][0], sharing.SharedArray)
+		self.assertEqual(shared_chunk[0][1], 3)
+		self.assertIsInstance(shared_chunk[1].args[0], sharing.SharedArray)
+		self.assertIsInstance(
+			shared_chunk[1].kwargs['factor'], sharing.SharedArray)
+
+		attached = sharing.attach_chunk(shared_chunk)
+		self.assertTrue(is_shared(attached[0][0]))
+		self.assertTrue(is_shared(attached[1].kwargs['factor']))
+
+		results = self.sharer.share_results([(array, 'x'), array, 5])
+		self.assertIsInstance(results[0][0], sharing.SharedArray)
+		self.assertIsInstance(results[1], sharing.SharedArray)
+		self.assertEqual(results[2], 5)
+		self.assertEqual(
+			sharing.attach_result(results[0])[0].sum(), 1000)
+
+	def test_close_removes_the_directory(self):
+		self.sharer.share(numpy.ones(1000))
+		self.sharer.close()
+		self.assertFalse(os.path.exists(self.sharer.directory))
+
+
+class TestStaleDirectories(unittest.TestCase):
+
+	def setUp(self):
+		self.base = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.base)
+
+	def test_directories_of_dead_processes_are_removed(self):
+		# Process ids wrap around well before 2**31.
+		dead = os.path.join(self.base, '%s%d-x' % (sharing.PREFIX, 2**31 - 1))
+		alive = os.path.join(self.base, '%s%d-x' % (sharing.PREFIX, os.getpid()))
+		other = os.path.join(self.base, 'other')
+		for path in (dead, alive, other):
+			os.mkdir(path)
+		sharing.remove_stale_directories(self.base)
+		self.assertEqual(
+			sorted(os.listdir(self.base)),
+			sorted([os.path.basename(alive), 'other'])
+		)
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestSharedMemoryJobs(JobTestCase):
+
+	def run_job(self, arguments, **options):
+		run_direct(scale, arguments, describe_results, dict({
+			'processes': 2, 'shared_memory': MIN_BYTES}, **options))
+		return sorted(read_reduced())
+
+	def test_arrays_are_sent_both_ways(self):
+		arguments = [
+			Arguments(numpy.ones(1000, dtype='int64'), factor=i)
+			for i in range(20)
+		]
+		self.assertEqual(
+			self.run_job(arguments),
+			[(True, True, 1000 * i) for i in range(20)]
+		)
+
+	def test_small_arrays_are_pickled(self):
+		arguments = [(numpy.ones(10, dtype='int64'), i) for i in range(20)]
+		self.assertEqual(
+			self.run_job(arguments),
+			[(False, False, 10 * i) for i in range(20)]
+		)
+
+	def test_segments_are_removed(self):
+		arguments = [(numpy.ones(1000, dtype='int64'),)] * 20
+		self.run_job(arguments, chunksize=5)
+		base = sharing.SHM_DIR
+		if not os.path.isdir(base):
+			base = tempfile.gettempdir()
+		prefix = '%s%d-' % (sharing.PREFIX, os.getpid())
+		self.assertEqual(
+			[dirname for dirname in os.listdir(base)
+			if dirname.startswith(prefix)], []
+		)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,149 @@
+'''
+Tests for the thread executor, and for the pools of threads that run in
+worker processes (see the `threads` module).
+'''
+
+import os
+import sys
+import time
+import threading
+import unittest
+from cluster_func import run_direct, threads
+from cluster_func.exceptions import OptionError, WorkerError
+from helpers import JobTestCase, write_results, read_reduced
+
+# Thread workers share this process, so they can record what they saw here.
+SEEN = []
+SEEN_LOCK = threading.Lock()
+
+# The number of calls running at once in this process, when it's a worker.
+ACTIVE = [0]
+
+
+def record(i):
+	with SEEN_LOCK:
+		SEEN.append(i)
+	return i
+
+
+def fail_on_seven(i):
+	if i == 7:
+		raise ValueError('seven')
+	return record(i)
+
+
+def exit_on_seven(i):
+	if i == 7:
+		sys.exit(3)
+	return record(i)
+
+
+def collect(results):
+	for result in results:
+		pass
+
+
+def nap(i):
+	with SEEN_LOCK:
+		ACTIVE[0] += 1
+		active = ACTIVE[0]
+	time.sleep(0.01)
+	with SEEN_LOCK:
+		ACTIVE[0] -= 1
+	return i, os.getpid(), threading.current_thread().ident, active
+
+
+class TestThreadExecutor(unittest.TestCase):
+
+	def setUp(self):
+		del SEEN[:]
+
+	def test_every_argument_set_is_run(self):
+		run_direct(
+			record, range(200), collect, {'executor': 'thread', 'threads': 4})
+		self.assertEqual(sorted(SEEN), range(200))
+
+	def test_single_thread_raising_fails_the_job(self):
+		with self.assertRaises(WorkerError):
+			run_direct(
+				fail_on_seven, range(500), None,
+				{'executor': 'thread', 'threads': 1}
+			)
+
+		# No more work was handed out once the thread failed.
+		self.assertEqual(sorted(SEEN), range(7))
+
+	def test_thread_exiting_fails_the_job(self):
+		with self.assertRaises(WorkerError):
+			run_direct(
+				exit_on_seven, range(500), collect,
+				{'executor': 'thread', 'threads': 2}
+			)
+
+
+class TestThreadsPerProcess(JobTestCase):
+
+	def test_each_process_runs_a_pool_of_threads(self):
+		run_direct(nap, range(120), write_results, {
+			'processes': 2, 'threads_per_process': 3})
+		results = read_reduced()
+		self.assertEqual(sorted(i for i, pid, ident, active in results),
+			range(120))
+
+		# The calls were run by three threads in each of two processes, and
+		# no more than three calls ran at once in either.
+		pids = set(pid for i, pid, ident, active in results)
+		self.assertEqual(len(pids), 2)
+		self.assertNotIn(os.getpid(), pids)
+		workers = set((pid, ident) for i, pid, ident, active in results)
+		self.assertEqual(len(workers), 6)
+		most_active = max(active for i, pid, ident, active in results)
+		self.assertTrue(1 < most_active <= 3, most_active)
+
+	def test_chunks_are_shared_by_the_threads(self):
+		run_direct(nap, range(120), write_results, {
+			'processes': 1, 'threads_per_process': 4, 'chunksize': 5})
+		results = read_reduced()
+		self.assertEqual(sorted(i for i, pid, ident, active in results),
+			range(120))
+
+		# Each chunk is run by a single thread.
+		idents_by_chunk = {}
+		for i, pid, ident, active in results:
+			idents_by_chunk.setdefault(i // 5, set()).add(ident)
+		for idents in idents_by_chunk.values():
+			self.assertEqual(len(idents), 1)
+
+	def test_invalid_threads_per_process(self):
+		for options in (
+			{'threads_per_process': 0},
+			{'threads_per_process': '2'},
+			{'threads_per_process': 2, 'executor': 'thread'},
+			{'threads_per_process': 2, 'profile': 'sample'},
+		):
+			with self.assertRaises(OptionError):
+				run_direct(record, range(5), None, options)
+
+
+class TestRunPool(unittest.TestCase):
+
+	def setUp(self):
+		del SEEN[:]
+
+	def test_every_item_is_run(self):
+		threads.run_pool(record, iter(range(100)), 5)
+		self.assertEqual(sorted(SEEN), range(100))
+
+	def test_error_is_raised_and_items_are_skipped(self):
+		items = iter(range(1000))
+		with self.assertRaises(ValueError):
+			threads.run_pool(fail_on_seven, items, 1)
+		self.assertNotIn(999, SEEN)
+
+	def test_exit_does_not_block_the_producer(self):
+		with self.assertRaises(SystemExit):
+			threads.run_pool(exit_on_seven, iter(range(1000)), 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
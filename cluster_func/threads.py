@@ -0,0 +1,147 @@
+'''
+Support for running workers as threads of a single process (the "thread"
+executor), rather than as separate processes.  This suits targets that spend
+most of their time waiting on I/O: many more of them can run at once than
+there are cpus, without a copy of the target module per worker, and argument
+sets are handed to workers directly, without being pickled.
+
+ThreadQueue has the same interface as IterableQueue, so that workers and
+reducers can be run the same way whichever executor is used.
+
+Worker processes can also each run a pool of threads (see `run_pool`), so
+that targets which release the GIL, or wait on I/O, get several calls in
+flight per process, without a copy of the target module per call.
+'''
+
+import sys
+import Queue
+import threading
+
+DEFAULT_THREADS_PER_CPU = 5
+
+# Marks the end of the items in a ThreadQueue.  One is put for each consumer.
+_STOP = object()
+
+
+class ThreadQueue(object):
+	'''
+	Queue for passing items between threads.  Producers and consumers are
+	made using `get_producer` and `get_consumer`, after which the queue should
+	be closed.  Consumers can be iterated over, and stop once all the
+	producers have been closed, and all of the items have been consumed.
+	If `maxsize` is positive, producers block while the queue is full.
+	'''
+
+	def __init__(self, maxsize=0):
+		self.queue = Queue.Queue(maxsize)
+		self.lock = threading.Lock()
+		self.num_consumers = 0
+		self.open_producers = 0
+		self.closed = False
+
+	def get_producer(self):
+		with self.lock:
+			self.open_producers += 1
+		return ThreadQueueProducer(self)
+
+	def get_consumer(self):
+		with self.lock:
+			self.num_consumers += 1
+		return ThreadQueueConsumer(self)
+
+	def close(self):
+		'''Signal that no more producers or consumers will be made.'''
+		with self.lock:
+			self.closed = True
+			done = self.open_producers == 0
+		if done:
+			self._stop_consumers()
+
+	def _producer_closed(self):
+		with self.lock:
+			self.open_producers -= 1
+			done = self.closed and self.open_producers == 0
+		if done:
+			self._stop_consumers()
+
+	def _stop_consumers(self):
+		for consumer_num in range(self.num_consumers):
+			self.queue.put(_STOP)
+
+
+class ThreadQueueProducer(object):
+
+	def __init__(self, thread_queue):
+		self.thread_queue = thread_queue
+
+	def put(self, item):
+		self.thread_queue.queue.put(item)
+
+	def close(self):
+		self.thread_queue._producer_closed()
+
+
+class ThreadQueueConsumer(object):
+
+	def __init__(self, thread_queue):
+		self.thread_queue = thread_queue
+		self.done = False
+
+	def __iter__(self):
+		while not self.done:
+			item = self.thread_queue.queue.get()
+			if item is _STOP:
+				self.done = True
+				return
+			yield item
+
+
+def run_pool(func, items, num_threads, profiler=None):
+	'''
+	Call `func` on each of `items`, using a pool of `num_threads` threads,
+	which are handed items as they become free.  If `profiler` is not None,
+	each thread is run under it.  If `func` raises an exception, the
+	remaining items are skipped, and the exception is raised once all of
+	the threads have stopped.  Threads keep consuming items after any
+	exception (even SystemExit), so that the producer is never left blocked on
+	a full queue.
+	'''
+	pool_queue = ThreadQueue(num_threads)
+	producer = pool_queue.get_producer()
+	consumers = [pool_queue.get_consumer() for thread_num in range(num_threads)]
+	pool_queue.close()
+
+	errors = []
+	def drain(consumer):
+		for item in consumer:
+			# Keep consuming after an error, so that the producer isn't
+			# blocked, but skip the items.
+			if errors:
+				continue
+			try:
+				func(item)
+			except BaseException:
+				errors.append(sys.exc_info())
+
+	pool = []
+	for consumer in consumers:
+		thread = threading.Thread(
+			target=profiler.run if profiler else drain,
+			args=(() if profiler is None else (drain,)) + (consumer,)
+		)
+		thread.start()
+		pool.append(thread)
+
+	try:
+		for item in items:
+			if errors:
+				break
+			producer.put(item)
+	finally:
+		producer.close()
+		for thread in pool:
+			thread.join()
+
+	if errors:
+		error_type, error, traceback = errors[0]
+		raise error_type, error, traceback
@@ -3,6 +3,10 @@ import os
 import re
 import subprocess
 from exceptions import OptionError
+import binning
+import backends
+import profiling
+import serializers
 
 NON_CLI_OPTIONS = {'prepend_statements', 'append_statements'}
 CLI_ONLY_OPTIONS = {'mode',}
@@ -11,7 +15,14 @@ NORMALIZED_NON_CLI_OPTIONS = {
 	'queue', 'processes', 'env', 'prepend_script', 'append_script',
 	'prepend_statements', 'append_statements', 'hash', 'hash_cli', 'key',
 	'these_bins', 'num_bins', 'target_cli',
-	'nodes', 'iterations', 'pbs_options'
+	'nodes', 'iterations', 'pbs_options', 'chunksize', 'reducer_func_name',
+	'materialize', 'shard', 'resume', 'dynamic', 'block_size',
+	'lease_seconds', 'bin_key', 'bin_key_cli', 'hash_function',
+	'bin_scheme', 'cost', 'plan', 'count', 'recount',
+	'job_array', 'backend', 'submit_concurrency', 'save_results',
+	'metrics', 'progress', 'heartbeat', 'profile', 'executor', 'threads',
+	'threads_per_process', 'async_concurrency', 'setup', 'setup_cli',
+	'teardown', 'teardown_cli', 'shared_memory', 'serializer'
 }
 
 def cpus():
@@ -206,6 +217,8 @@ def normalize_options(options):
 		options['target_func_name'] = options.pop('target')
 	if 'args' in options:
 		options['argument_iterable_name'] = options.pop('args')
+	if 'reducer' in options:
+		options['reducer_func_name'] = options.pop('reducer')
 	if 'target_module' in options:
 		options['target_module_path'] = options.pop('target_module')
 
@@ -249,6 +262,16 @@ def normalize_options(options):
 		else:
 			options['hash_cli'] = ','.join([str(h) for h in options['hash']])
 
+	# Keep a command line compatible format of the bin key, if it's the name
+	# of a callable, so that it can be passed on to subjobs.
+	if 'bin_key' in options and isinstance(options['bin_key'], basestring):
+		options['bin_key_cli'] = options['bin_key']
+
+	# Likewise for the setup and teardown callables.
+	for option in ('setup', 'teardown'):
+		if isinstance(options.get(option), basestring):
+			options[option + '_cli'] = options[option]
+
 	# Parse the key option.  Try to interpret it as an integer specifying the
 	# position of the key argument, otherwise leave it as a string, to be 
 	# interpreted as the name of a keyword argument
@@ -258,6 +281,15 @@ def normalize_options(options):
 		except ValueError:
 			pass
 
+	# Parse the chunksize option.  It is either a positive integer or "auto".
+	if 'chunksize' in options and isinstance(options['chunksize'], basestring):
+		if options['chunksize'] != 'auto':
+			try:
+				options['chunksize'] = int(options['chunksize'])
+			except ValueError:
+				raise OptionError(
+					'`chunksize` must be a positive integer or "auto".')
+
 	# Convert env dictionary into a string
 	if 'env' in options and not isinstance(options['env'], basestring):
 		options['env'] = ' '.join([
@@ -281,10 +313,140 @@ def validate_options(options):
 	# Raise on error if we see conflicting options
 	if 'hash' in options and 'key' in options:
 		raise OptionError('The `hash` and `key` options are mutually exclusive.')
+	if 'bin_key' in options:
+		for option in ('hash', 'key'):
+			if option in options:
+				raise OptionError(
+					'The `bin_key` and `%s` options are mutually exclusive.'
+					% option
+				)
 	if 'nodes' in options and 'iterations' in options:
 		raise OptionError(
 			'The `nodes` and `iterations` options are mutually exclusive.')
 
+	if 'dynamic' in options:
+		for option in ('hash', 'bin_key', 'key', 'materialize', 'cost'):
+			if options.get(option):
+				raise OptionError(
+					'The `dynamic` and `%s` options are mutually exclusive.'
+					% option
+				)
+
+	if 'cost' in options:
+		for option in ('hash', 'bin_key', 'key'):
+			if option in options:
+				raise OptionError(
+					'The `cost` and `%s` options are mutually exclusive.'
+					% option
+				)
+
+	# Raise an error if the hash function isn't known or isn't available
+	if 'hash_function' in options:
+		binning.get_hash_functions(options['hash_function'])
+
+	# Raise an error if the bin scheme isn't known, or there's no hashing
+	if 'bin_scheme' in options:
+		binning.get_bin_func(options['bin_scheme'])
+		if not binning.uses_hashing(options):
+			raise OptionError(
+				'The `bin_scheme` option only applies when hashing, i.e. '
+				'with the `hash` or `bin_key` options.'
+			)
+
+	# Raise an error if the backend isn't known
+	if 'backend' in options:
+		backends.get_backend(options)
+	if 'submit_concurrency' in options:
+		if (
+			not isinstance(options['submit_concurrency'], int) 
+			or options['submit_concurrency'] < 1
+		):
+			raise OptionError('`submit_concurrency` must be a positive integer.')
+
+	# Raise an error if the progress interval isn't a positive number
+	if 'progress' in options:
+		if (
+			not isinstance(options['progress'], (int, float))
+			or options['progress'] <= 0
+		):
+			raise OptionError('`progress` must be a positive number of seconds.')
+
+	# Raise an error if the profiler isn't known
+	if 'profile' in options and options['profile'] not in profiling.PROFILERS:
+		raise OptionError(
+			'`profile` must be one of %s.' % ', '.join(profiling.PROFILERS))
+
+	# Raise an error if the executor isn't known, or if the number of threads
+	# isn't a positive integer
+	if options.get('executor', 'process') not in ('process', 'thread'):
+		raise OptionError('`executor` must be "process" or "thread".')
+	if 'threads' in options:
+		if not isinstance(options['threads'], int) or options['threads'] < 1:
+			raise OptionError('`threads` must be a positive integer.')
+
+	# Raise an error if the number of threads per worker process isn't a
+	# positive integer, or if workers aren't processes
+	if 'threads_per_process' in options:
+		if (
+			not isinstance(options['threads_per_process'], int)
+			or options['threads_per_process'] < 1
+		):
+			raise OptionError(
+				'`threads_per_process` must be a positive integer.')
+		if options.get('executor') == 'thread':
+			raise OptionError(
+				'`threads_per_process` can\'t be used when `executor` is '
+				'"thread".'
+			)
+
+	# Raise an error if the size of arrays to share isn't a positive integer.
+	# Threads don't need shared memory, since nothing is pickled.
+	if 'shared_memory' in options:
+		if (
+			not isinstance(options['shared_memory'], int)
+			or options['shared_memory'] < 1
+		):
+			raise OptionError(
+				'`shared_memory` must be a positive number of bytes.')
+		if options.get('executor') == 'thread':
+			raise OptionError(
+				'`shared_memory` can\'t be used when `executor` is "thread".')
+
+	# Raise an error if the serializer isn't known.  Threads don't need one.
+	if 'serializer' in options:
+		if options['serializer'] not in serializers.SERIALIZERS:
+			raise OptionError('`serializer` must be one of %s.' % ', '.join(
+				sorted(serializers.SERIALIZERS)))
+		if options.get('executor') == 'thread':
+			raise OptionError(
+				'`serializer` can\'t be used when `executor` is "thread".')
+
+	# Raise an error if the number of calls a worker runs at once isn't a
+	# positive integer
+	if 'async_concurrency' in options:
+		if (
+			not isinstance(options['async_concurrency'], int)
+			or options['async_concurrency'] < 1
+		):
+			raise OptionError(
+				'`async_concurrency` must be a positive integer.')
+
+	# The sampling profiler relies on signals, which only reach the main
+	# thread.
+	if options.get('profile') == 'sample':
+		if options.get('executor') == 'thread':
+			raise OptionError(
+				'`profile` can\'t be "sample" when `executor` is "thread".')
+		if 'threads_per_process' in options:
+			raise OptionError(
+				'`profile` can\'t be "sample" with `threads_per_process`.')
+
+	# Raise an error if chunksize isn't a positive integer or "auto"
+	if 'chunksize' in options and options['chunksize'] != 'auto':
+		if not isinstance(options['chunksize'], int) or options['chunksize'] < 1:
+			raise OptionError(
+				'`chunksize` must be a positive integer or "auto".')
+
 
 def merge_dicts(*dictionaries):
     merged = {}